@@ -1,20 +1,36 @@
-from fastapi import FastAPI, Depends, HTTPException, Response
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from typing import Optional, Set, List
+from typing import Optional, Set, List, Tuple, NamedTuple
 import sqlite3
-import json
+import secrets
+import os
 
 
-from storage import make_connection, get_particle, get_all_particles_by_author
-from authorise import register_user, login, logout, whoami
+from storage import (
+    make_connection, get_particle, get_particles, get_particle_by_title, get_all_particles_by_author, get_changes
+)
+from authorise import register_user, login, logout, whoami, User
 from edit_particles import (
     create_particle, update_particle_body, update_particle_title,
     add_tags, remove_tags, delete_particle,update_particle
 )
-from search import query
+from search import run_query, explain_query, query_key
 from pim_types import Particle, QueryHit, AuthResult
+from serialize import dumps, particle_json, particle_dict, particles_json, hits_json
+from assets import AssetStore, IMMUTABLE
+from compression import CompressionMiddleware
+from profiling import ProfiledConnection, ProfilingMiddleware, phase
+from ratelimit import RateLimitMiddleware
+import ratelimit
+import metrics
+import storage
+import events
+import sampler
+import blobs
+import singleflight
+from sharding import ShardRouter
+from memstore import MemoryStore
 
 """
 This module defines the FastAPI web application, including all API endpoints.
@@ -24,19 +40,101 @@ connections, and orchestrates calls to other modules.
 
 # FastAPI Setup
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+app.add_middleware(RateLimitMiddleware)  # outside compression: refusals are cheap; inside metrics: they are counted
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)  # outermost, so its total includes compression
+assets = AssetStore(static_dir="static", template_dir="templates")
 DB_PATH = "pim.db"
+MAX_BATCH_SIZE = 100
+MAX_CHANGES_PAGE = 1000
+
+# Identical concurrent reads (double submits, several open tabs) share one computation.
+search_flights = singleflight.Group("search")
+particle_flights = singleflight.Group("particle")
+
+metrics.registry.add_collector(metrics.lru_cache_collector("decode_tags", storage.decode_tags))
+metrics.registry.add_collector(metrics.table_size_collector(lambda: DB_PATH if MEMORY_STORE is None else None))
+
+
+class JSONBytesResponse(Response):
+    """
+    A response for bodies already encoded by the serialize module. Returning
+    it from a route also skips FastAPI's response_model validation.
+    """
+    media_type = "application/json"
+
+
+# Optional sharding: when SHARD_PATHS is set, DB_PATH is the directory
+# database (users, sessions, shard assignments) and each author's particles
+# live in one of the shard files.
+SHARD_PATHS: List[str] = []
+
+# Optional in-memory backend (memstore.MemoryStore): when set, every request
+# uses it instead of the SQLite database at DB_PATH, and SHARD_PATHS is ignored.
+MEMORY_STORE: Optional[MemoryStore] = None
+
+# Token for the /admin endpoints, sent as X-Admin-Token; they are disabled while it is empty.
+ADMIN_TOKEN = ""
 
 
 # Dependency
 def get_conn():
-    conn = make_connection(DB_PATH)
+    if MEMORY_STORE is not None:
+        yield MEMORY_STORE
+        return
+    # FastAPI runs a sync dependency and the endpoint using it on different
+    # threadpool threads, so the connection must be allowed to change threads.
+    with phase("connect"):
+        conn = make_connection(DB_PATH, check_same_thread=False, factory=ProfiledConnection)
     try:
         yield conn
     finally:
         conn.close()
 
 
+_router: Optional[ShardRouter] = None
+
+
+def shard_router() -> ShardRouter:
+    """The router for the current DB_PATH and SHARD_PATHS, built once and reused by every request."""
+    global _router
+    if _router is None or (_router.directory_path, _router.shard_paths) != (DB_PATH, SHARD_PATHS):
+        _router = ShardRouter(DB_PATH, SHARD_PATHS)
+    return _router
+
+
+class Auth(NamedTuple):
+    user: User
+    conn: sqlite3.Connection  # the database (or MEMORY_STORE) holding the user's particles
+
+
+def get_user(session: str, request: Request, conn: sqlite3.Connection = Depends(get_conn)) -> User:
+    """Checks the session and charges the user's rate limit bucket."""
+    with phase("auth"):
+        user = whoami(conn, session)
+    if not user:
+        raise HTTPException(401, "Invalid session")
+    policy, wait = ratelimit.check_user(request.url.path, user.username)
+    if wait:
+        ratelimit.RATE_LIMITED.inc(policy)
+        raise HTTPException(429, "Too many requests", headers={"Retry-After": ratelimit.retry_after(wait)})
+    return user
+
+
+def get_auth(user: User = Depends(get_user), conn: sqlite3.Connection = Depends(get_conn)):
+    """Yields the authenticated user with the connection for their particles."""
+    if not SHARD_PATHS or MEMORY_STORE is not None:
+        yield Auth(user, conn)
+        return
+    with phase("connect"):
+        shard = shard_router().connect(conn, user.username, check_same_thread=False, factory=ProfiledConnection)
+    try:
+        yield Auth(user, shard)
+    finally:
+        shard.close()
+
+
 # Models
 class RegisterRequest(BaseModel):
     username: str
@@ -67,6 +165,7 @@ class SearchResponse(BaseModel):
     title: str
     score: float
     snippet: str
+    highlights: List[Tuple[int, int]] = []
 
 class LogoutRequest(BaseModel):
     session: str
@@ -75,47 +174,102 @@ class UpdateParticleRequest(BaseModel):
     title: str
     body: str
 
-# HTML Serving
-@app.get("/", response_class=FileResponse)
-async def read_index():
-    return "templates/login.html"
-
-@app.get("/index.html", response_class=FileResponse)
-async def read_main_page():
-    return "templates/index.html"
-
-@app.get("/register.html", response_class=FileResponse)
-async def read_register_page():
-    return "templates/register.html"
-
-@app.get("/viewer.html", response_class=FileResponse)
-async def read_viewer_page():
-    return "templates/viewer.html"
+class BatchRequest(BaseModel):
+    ids: List[str]
 
-@app.get("/editor.html", response_class=FileResponse)
-async def read_editor_page():
-    return "templates/editor.html"
-
-@app.get("/settings.html", response_class=FileResponse)
-async def read_settings_page():
-    return "templates/settings.html"
-
-@app.get("/about.html", response_class=FileResponse)
-async def read_about_page():
-    return "templates/about.html"
+# HTML Serving
+@app.get("/static/{path:path}")
+async def read_static(path: str, request: Request):
+    return assets.static_response(path, request)
+
+@app.get("/blobs/{name}")
+def read_blob(name: str, request: Request):
+    """
+    Serves an image extracted from a note body. The name is the hash of the
+    content, so responses are immutable; Range requests are supported.
+    """
+    path = blobs.path_for(name)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(404, "Not Found")
+    etag = f'"{name.split(".")[0]}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=blobs.media_type(name), headers=headers)
+
+@app.get("/", response_class=HTMLResponse)
+async def read_index(request: Request):
+    return assets.template_response("login.html", request)
+
+@app.get("/index.html", response_class=HTMLResponse)
+async def read_main_page(request: Request):
+    return assets.template_response("index.html", request)
+
+@app.get("/register.html", response_class=HTMLResponse)
+async def read_register_page(request: Request):
+    return assets.template_response("register.html", request)
+
+@app.get("/viewer.html", response_class=HTMLResponse)
+async def read_viewer_page(request: Request):
+    return assets.template_response("viewer.html", request)
+
+@app.get("/editor.html", response_class=HTMLResponse)
+async def read_editor_page(request: Request):
+    return assets.template_response("editor.html", request)
+
+@app.get("/settings.html", response_class=HTMLResponse)
+async def read_settings_page(request: Request):
+    return assets.template_response("settings.html", request)
+
+@app.get("/about.html", response_class=HTMLResponse)
+async def read_about_page(request: Request):
+    return assets.template_response("about.html", request)
 
 # Particle Data
+@app.get("/particles/by-title")
+def get_particle_with_title(title: str, auth: Auth = Depends(get_auth)):
+    """The user's particle with this exact title, ignoring case and spacing (404 if none)."""
+    user, conn = auth
+    particle = get_particle_by_title(conn, user.username, title)
+    if not particle:
+        raise HTTPException(404, "Particle not found")
+    with phase("serialize"):
+        return JSONBytesResponse(particle_json(particle))
+
 @app.get("/particles/{pid}")
-def get_single_particle(pid: str, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
-    particle = get_particle(conn, pid)
+def get_single_particle(pid: str, auth: Auth = Depends(get_auth)):
+    user, conn = auth
+    particle = particle_flights.do((user.username, pid), lambda: get_particle(conn, pid))
     if not particle:
         raise HTTPException(404, "Particle not found")
     if particle.author != user.username:
         raise HTTPException(403, "Permission denied")
-    return particle._asdict()
+    with phase("serialize"):
+        return JSONBytesResponse(particle_json(particle))
+
+@app.post("/particles/batch")
+def get_particle_batch(req: BatchRequest, auth: Auth = Depends(get_auth)):
+    """
+    Fetches up to MAX_BATCH_SIZE particles with one session check and one
+    query. Results follow the request order, each with its own status:
+    200 with the particle, 404 if it does not exist, 403 if it is not yours.
+    """
+    user, conn = auth
+    if len(req.ids) > MAX_BATCH_SIZE:
+        raise HTTPException(400, f"At most {MAX_BATCH_SIZE} ids per batch")
+
+    found = get_particles(conn, list(dict.fromkeys(req.ids)))
+    with phase("serialize"):
+        results = []
+        for pid in req.ids:
+            particle = found.get(pid)
+            if not particle:
+                results.append({"id": pid, "status": 404})
+            elif particle.author != user.username:
+                results.append({"id": pid, "status": 403})
+            else:
+                results.append({"id": pid, "status": 200, "particle": particle_dict(particle)})
+        return JSONBytesResponse(dumps({"results": results}))
 
 
 # Auth
@@ -141,27 +295,26 @@ def do_logout(req: LogoutRequest, conn: sqlite3.Connection = Depends(get_conn)):
     return {"message": "Logged out"}
 
 @app.get("/whoami")
-def do_whoami(session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def do_whoami(user: User = Depends(get_user)):
     return {"username": user.username}
 
 
 # Particle Actions
+@app.exception_handler(storage.DuplicateTitleError)
+def duplicate_title(request: Request, exc: storage.DuplicateTitleError):
+    """Creating or renaming a particle onto a title the user already has is a conflict, not a server error."""
+    return JSONResponse({"detail": str(exc)}, status_code=409)
+
+
 @app.post("/particles")
-def create(req: ParticleRequest, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def create(req: ParticleRequest, auth: Auth = Depends(get_auth)):
+    user, conn = auth
     p = create_particle(conn, user, req.title, req.body, req.tags)
-    return p._asdict()
+    return JSONBytesResponse(particle_json(p))
 
 @app.put("/particles/{pid}")
-def update(pid: str, req: UpdateParticleRequest, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def update(pid: str, req: UpdateParticleRequest, auth: Auth = Depends(get_auth)):
+    user, conn = auth
 
     # This new function should handle updating both fields in the database
     updated_particle = update_particle(conn, user.username, pid, req.title, req.body)
@@ -169,78 +322,163 @@ def update(pid: str, req: UpdateParticleRequest, session: str, conn: sqlite3.Con
     if not updated_particle:
         raise HTTPException(404, "Particle not found or permission denied")
     
-    return updated_particle._asdict()
+    return JSONBytesResponse(particle_json(updated_particle))
 
 
 @app.put("/particles/{pid}/body")
-def update_body(pid: str, req: UpdateBodyRequest, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def update_body(pid: str, req: UpdateBodyRequest, auth: Auth = Depends(get_auth)):
+    user, conn = auth
     updated = update_particle_body(conn, user.username, pid, req.new_body)
-    return updated._asdict()
+    return JSONBytesResponse(particle_json(updated))
 
 @app.put("/particles/{pid}/title")
-def update_title(pid: str, req: UpdateTitleRequest, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def update_title(pid: str, req: UpdateTitleRequest, auth: Auth = Depends(get_auth)):
+    user, conn = auth
     updated = update_particle_title(conn, user.username, pid, req.new_title)
-    return updated._asdict()
+    return JSONBytesResponse(particle_json(updated))
 
 @app.put("/particles/{pid}/tags/add")
-def add_particle_tags(pid: str, req: TagUpdateRequest, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def add_particle_tags(pid: str, req: TagUpdateRequest, auth: Auth = Depends(get_auth)):
+    user, conn = auth
     updated = add_tags(conn, user.username, pid, req.tags)
-    return updated._asdict()
+    return JSONBytesResponse(particle_json(updated))
 
 @app.put("/particles/{pid}/tags/remove")
-def remove_particle_tags(pid: str, req: TagUpdateRequest, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def remove_particle_tags(pid: str, req: TagUpdateRequest, auth: Auth = Depends(get_auth)):
+    user, conn = auth
     updated = remove_tags(conn, user.username, pid, req.tags)
-    return updated._asdict()
+    return JSONBytesResponse(particle_json(updated))
 
 @app.delete("/particles/{pid}")
-def delete(pid: str, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def delete(pid: str, auth: Auth = Depends(get_auth)):
+    user, conn = auth
     ok = delete_particle(conn, user.username, pid)
     if not ok:
         raise HTTPException(404, "Particle not found")
     return {"message": "Particle deleted"}
 
 
-# Search
-@app.get("/search", response_model=List[SearchResponse])
-def search(q: str, session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
+# Operations
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of the service's metrics."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Not Found")
+    if not secrets.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(403, "Permission denied")
+
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+def start_profiler(interval_ms: float = 10.0, duration_s: float = 60.0, include_idle: bool = False):
+    """Starts a sampling profiler window (see sampler); its previous stacks are discarded."""
+    if not sampler.profiler.start(interval_ms / 1000, duration_s, include_idle):
+        raise HTTPException(409, "The profiler is already running")
+    return sampler.profiler.status()
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+def stop_profiler():
+    sampler.profiler.stop()
+    return sampler.profiler.status()
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+def profiler_status():
+    return sampler.profiler.status()
+
+@app.get("/admin/profiler/stacks", dependencies=[Depends(require_admin)])
+def profiler_stacks():
+    """The current window's stacks in collapsed format, ready for flamegraph.pl or speedscope."""
+    return Response(sampler.profiler.collapsed(), media_type="text/plain; charset=utf-8")
+
+
+# Live updates
+def get_session_user(session: str) -> User:
+    """
+    The session's user, checked on a short-lived connection. A sync
+    dependency, so FastAPI runs it in the threadpool rather than on the
+    event loop.
+    """
+    if MEMORY_STORE is not None:
+        user = whoami(MEMORY_STORE, session)
+    else:
+        conn = make_connection(DB_PATH)
+        try:
+            user = whoami(conn, session)
+        finally:
+            conn.close()
     if not user:
         raise HTTPException(401, "Invalid session")
-    hits = query(conn, user.username, q)
-    return [SearchResponse(**h._asdict()) for h in hits]
+    return user
+
+
+@app.get("/events")
+async def change_events(request: Request, user: User = Depends(get_session_user)):
+    """
+    Streams the user's particle changes as server-sent events
+    (created/updated/deleted with id and version, or resync on overflow).
+    No database connection is held open for the life of the stream.
+    """
+    sub = events.broker.subscribe(user.username)
+    return StreamingResponse(
+        events.event_stream(sub, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Search
+@app.get("/search", response_model=List[SearchResponse])
+def search(q: str, fuzzy: bool = False, auth: Auth = Depends(get_auth)):
+    """
+    Searches the user's particles. If a query cost limit cut the search
+    short, X-Search-Truncated lists the limits that applied. Concurrent
+    requests for the same query (see query_key) share one search.
+    """
+    user, conn = auth
+    with phase("search"):
+        result = search_flights.do((user.username, fuzzy, query_key(q)),
+                                   lambda: run_query(conn, user.username, q, fuzzy=fuzzy))
+    headers = {"X-Search-Truncated": ",".join(result.truncated)} if result.truncated else None
+    with phase("serialize"):
+        return JSONBytesResponse(hits_json(result.hits), headers=headers)
+
+@app.get("/search/explain")
+def search_explain(q: str, fuzzy: bool = False, auth: Auth = Depends(get_auth)):
+    user, conn = auth
+    return {"plan": explain_query(conn, user.username, q, fuzzy=fuzzy)}
+
+@app.get("/changes")
+def changes_since(since: int = 0, limit: int = 500, auth: Auth = Depends(get_auth)):
+    """
+    Returns the particles changed after cursor `since`, one page at a time.
+    Pass the returned cursor back as `since` until has_more is false; a
+    client that saves the final cursor only transfers later changes.
+    """
+    user, conn = auth
+    if since < 0 or not 1 <= limit <= MAX_CHANGES_PAGE:
+        raise HTTPException(400, f"since must be >= 0 and limit between 1 and {MAX_CHANGES_PAGE}")
+
+    changes, has_more = get_changes(conn, user.username, since, limit)
+    with phase("serialize"):
+        payload = {
+            "changes": [
+                {"seq": c.seq, "id": c.particle_id, "deleted": True} if c.deleted
+                else {"seq": c.seq, "id": c.particle_id, "particle": particle_dict(c.particle)}
+                for c in changes
+            ],
+            "cursor": changes[-1].seq if changes else since,
+            "has_more": has_more,
+        }
+        return JSONBytesResponse(dumps(payload))
 
 @app.get("/export")
-def export_data(session: str, conn: sqlite3.Connection = Depends(get_conn)):
-    user = whoami(conn, session)
-    if not user:
-        raise HTTPException(401, "Invalid session")
+def export_data(auth: Auth = Depends(get_auth)):
+    user, conn = auth
 
     particles = get_all_particles_by_author(conn, user.username)
-    export_data = []
-    for p in particles:
-        p_dict = p._asdict()
-        p_dict['tags'] = sorted(list(p.tags)) 
-        export_data.append(p_dict)
-
-    json_data = json.dumps(export_data, indent=2)
-
-    return Response(
-        content=json_data,
-        media_type="application/json",
-        headers={"Content-Disposition": "attachment; filename=pim_export.json"}
-    )
+    with phase("serialize"):
+        return JSONBytesResponse(particles_json(particles),
+                                 headers={"Content-Disposition": "attachment; filename=pim_export.json"})
@@ -0,0 +1,146 @@
+"""
+This module serves the static assets and HTML templates with HTTP caching.
+
+Every file under the static directory is loaded once, hashed and
+precompressed (gzip, plus brotli when the `brotli` package is installed).
+Each asset is reachable under a fingerprinted URL such as
+/static/css/base.3f2a9c1e.css, served with a one-year immutable
+Cache-Control, as well as under its plain URL, which must revalidate.
+
+Templates are rewritten so their static references point at the
+fingerprinted URLs, then served with an ETag and `no-cache`, so a returning
+browser gets a 304 for unchanged pages and never re-requests the assets
+they reference.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, NamedTuple, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from compression import choose_encoding, is_compressible
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# href="static/css/base.css" or src="/static/js/common.js"
+_STATIC_REF_RE = re.compile(r'(?P<attr>(?:href|src)=")/?static/(?P<path>[^"?#]+)"')
+
+
+class Asset(NamedTuple):
+    content: bytes
+    media_type: str
+    etag: str
+    encoded: Dict[str, bytes]  # content coding -> precompressed body
+
+
+def _digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _make_asset(content: bytes, filename: str) -> Asset:
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type == "application/javascript":
+        media_type += "; charset=utf-8"
+    encoded: Dict[str, bytes] = {}
+    if is_compressible(media_type):
+        for coding, body in (("gzip", gzip.compress(content, compresslevel=9, mtime=0)),
+                             ("br", brotli.compress(content, quality=11) if brotli else None)):
+            if body is not None and len(body) < len(content):
+                encoded[coding] = body
+    return Asset(content, media_type, f'"{_digest(content)[:16]}"', encoded)
+
+
+def fingerprint(path: str, digest: str) -> str:
+    """css/base.css -> css/base.<first 8 hex of digest>.css"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest[:8]}{ext}"
+
+
+def asset_response(asset: Asset, request: Request, cache_control: str) -> Response:
+    """
+    Builds a response for an asset: 304 when the client's ETag matches,
+    otherwise the best precompressed variant the client accepts.
+    """
+    headers = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if asset.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    coding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if coding in asset.encoded:
+        headers["Content-Encoding"] = coding
+        return Response(asset.encoded[coding], media_type=asset.media_type, headers=headers)
+    return Response(asset.content, media_type=asset.media_type, headers=headers)
+
+
+class AssetStore:
+    """Static assets and templates, loaded lazily and kept in memory."""
+
+    def __init__(self, static_dir: str = "static", template_dir: str = "templates", url_prefix: str = "/static"):
+        self.static_dir = static_dir
+        self.template_dir = template_dir
+        self.url_prefix = url_prefix
+        self._assets: Optional[Dict[str, Asset]] = None  # relative path -> asset
+        self._fingerprinted: Dict[str, str] = {}  # fingerprinted path -> relative path
+        self._urls: Dict[str, str] = {}  # relative path -> fingerprinted URL
+        self._templates: Dict[str, Optional[Asset]] = {}
+
+    def _load(self) -> Dict[str, Asset]:
+        if self._assets is None:
+            assets = {}
+            for dirpath, _, filenames in os.walk(self.static_dir):
+                for filename in filenames:
+                    full = os.path.join(dirpath, filename)
+                    rel = os.path.relpath(full, self.static_dir).replace(os.sep, "/")
+                    with open(full, "rb") as f:
+                        content = f.read()
+                    assets[rel] = _make_asset(content, filename)
+                    fp = fingerprint(rel, _digest(content))
+                    self._fingerprinted[fp] = rel
+                    self._urls[rel] = f"{self.url_prefix}/{fp}"
+            self._assets = assets
+        return self._assets
+
+    def url_for(self, path: str) -> str:
+        """The fingerprinted URL of a static file (its plain URL if unknown)."""
+        self._load()
+        return self._urls.get(path, f"{self.url_prefix}/{path}")
+
+    def static_response(self, path: str, request: Request) -> Response:
+        """Serves /static/<path>, immutable if <path> is a fingerprinted name."""
+        assets = self._load()
+        if path in self._fingerprinted:
+            return asset_response(assets[self._fingerprinted[path]], request, IMMUTABLE)
+        if path in assets:
+            return asset_response(assets[path], request, REVALIDATE)
+        return Response("Not Found", status_code=404, media_type="text/plain")
+
+    def template(self, name: str) -> Optional[Asset]:
+        """A template with its static references fingerprinted, or None if missing."""
+        if name not in self._templates:
+            full = os.path.join(self.template_dir, name)
+            if not os.path.isfile(full):
+                self._templates[name] = None
+            else:
+                with open(full, encoding="utf-8") as f:
+                    html = f.read()
+                html = _STATIC_REF_RE.sub(lambda m: f'{m.group("attr")}{self.url_for(m.group("path"))}"', html)
+                self._templates[name] = _make_asset(html.encode("utf-8"), name)
+        return self._templates[name]
+
+    def template_response(self, name: str, request: Request) -> Response:
+        asset = self.template(name)
+        if asset is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        return asset_response(asset, request, REVALIDATE)
@@ -8,6 +8,8 @@ from typing import Optional, NamedTuple
 import sqlite3
 from pim_types import AuthResult, Token
 import bcrypt 
+import metrics
+import storage
 
 class User(NamedTuple):
     """Represents an authenticated user's basic information"""
@@ -15,6 +17,7 @@ class User(NamedTuple):
     username: str
 
 # Helpers
+@metrics.time_histogram(metrics.BCRYPT, "hash")
 def _hash_password(pw: str) -> str: # Return a string 
     """ Hashes a password using bcrypt
     Args:
@@ -27,6 +30,7 @@ def _hash_password(pw: str) -> str: # Return a string
     hashed_bytes = bcrypt.hashpw(pw_bytes, salt)
     return hashed_bytes.decode("utf-8") # Decode bytes to a clean string
 
+@metrics.time_histogram(metrics.BCRYPT, "verify")
 def _verify_password(pw: str, pw_hash: str) -> bool: # Expect a string
     """verifies a plaintext password against a bcrypt hash and returns a bool"""
     pw_bytes = pw.encode("utf-8")
@@ -42,60 +46,38 @@ def _new_token() -> str:
 
 def register_user(conn: sqlite3.Connection, username: str, password: str) -> bool:
     """Add a new user. Return False if already exists."""
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM users WHERE username = ?", (username,))
-    if cur.fetchone():
-        return False
-    
-
-    cur.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)",
-                (username, _hash_password(password)))
-    conn.commit()
-    return True
+    if storage.get_password_hash(conn, username) is not None:
+        return False  # checked first so a taken name costs no bcrypt hash
+    return storage.add_user(conn, username, _hash_password(password))
 
 
 def login(conn: sqlite3.Connection, username: str, password: str) -> AuthResult:
     """Check credentials and create session token if valid
     Args:
-        conn: an active SQLite database connection.
+        conn: an active SQLite database connection, or another storage backend.
         username: The username for login
         password: The plaintext password for verification.
     Returns:
         An AuthResult object indicating success or failure, containing a
         session token on success.
     """
-    cur = conn.cursor()
-    # The password_hash is now retrieved as bytes
-    cur.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    if not row:
+    password_hash = storage.get_password_hash(conn, username)
+    if password_hash is None:
         return AuthResult(False, None, "User does not exist")
-    # The password_hash from the DB is passed directly to verification
-    if not _verify_password(password, row["password_hash"]):
+    if not _verify_password(password, password_hash):
         return AuthResult(False, None, "Invalid password")
 
     token = _new_token()
-    cur.execute("INSERT INTO sessions (token, username) VALUES (?, ?)", (token, username))
-    conn.commit()
+    storage.add_session(conn, token, username)
     return AuthResult(True, token, "Login successful")
 
 
 def logout(conn: sqlite3.Connection, session: Token) -> bool:
     """Removes a session token from the database if present."""
-    cur = conn.cursor()
-    cur.execute("DELETE FROM sessions WHERE token = ?", (session,))
-    conn.commit()
-    return cur.rowcount > 0
+    return storage.delete_session(conn, session)
 
 
 def whoami(conn: sqlite3.Connection, session: Token) -> Optional[User]:
     """Return user's ID and username if session is valid, else None."""
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT u.id, u.username
-        FROM users u
-        JOIN sessions s ON u.username = s.username
-        WHERE s.token = ?
-    """, (session,))
-    row = cur.fetchone()
-    return User(id=row["id"], username=row["username"]) if row else None
+    row = storage.get_session_user(conn, session)
+    return User(id=row[0], username=row[1]) if row else None
@@ -0,0 +1,91 @@
+"""
+This module defines the storage backend interface.
+
+Every storage function that reads or writes application data takes a
+`conn` that is either a sqlite3.Connection, which it queries itself, or an
+object implementing Backend, to which it hands the call (a method of the
+same name, without the conn argument). authorise, edit_particles, search
+and fuzzy only go through those functions, so they run unchanged on any
+backend. memstore.MemoryStore is the in-memory implementation.
+
+Operational features that are SQLite files by nature (backup, sharding,
+the query log's EXPLAIN and the table size metrics) stay SQLite-only.
+"""
+
+from typing import Dict, List, Optional, Protocol, Tuple, runtime_checkable
+
+from pim_types import Change, Particle, ParticleId, ParticleSummary
+
+# (id, user_facing_id, title, plain text, created_at): a search candidate row.
+CandidateRow = Tuple[str, int, str, str, str]
+
+
+@runtime_checkable
+class Backend(Protocol):
+    """The operations storage, search and fuzzy need from a data store."""
+
+    # Users and sessions
+
+    def add_user(self, username: str, password_hash: str) -> bool:
+        """Add a user. Return False if the username is taken."""
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        ...
+
+    def add_session(self, token: str, username: str) -> None:
+        ...
+
+    def delete_session(self, token: str) -> bool:
+        """Remove a session. Return True if it existed."""
+
+    def get_session_user(self, token: str) -> Optional[Tuple[int, str]]:
+        """(user id, username) of the session's user, or None."""
+
+    # Particles (see the storage functions of the same names)
+
+    def save_particle(self, p: Particle) -> None:
+        """Insert or update a particle; raises storage.DuplicateTitleError."""
+
+    def delete_particle(self, pid: ParticleId) -> bool:
+        ...
+
+    def get_particle(self, pid: ParticleId) -> Optional[Particle]:
+        ...
+
+    def get_particles(self, pids: List[ParticleId]) -> Dict[ParticleId, Particle]:
+        ...
+
+    def get_particle_by_title(self, author: str, title: str) -> Optional[Particle]:
+        ...
+
+    def list_particles(self, author: str, limit: int) -> List[ParticleSummary]:
+        ...
+
+    def get_all_particles_by_author(self, author: str) -> List[Particle]:
+        ...
+
+    def max_user_facing_id(self, author: str) -> int:
+        ...
+
+    def get_changes(self, author: str, since: int, limit: int) -> Tuple[List[Change], bool]:
+        ...
+
+    # Search
+
+    def search_candidates(self, author: str, plan, variants: Dict[str, List[str]],
+                          budget: float) -> Tuple[List[CandidateRow], bool]:
+        """
+        The author's particles matching a query_language.QueryPlan, newest
+        first, and whether the scan stopped early after `budget` seconds.
+        """
+
+    def explain(self, author: str, plan, variants: Dict[str, List[str]]) -> List[str]:
+        """Lines describing how the plan is evaluated, as query_language.explain."""
+
+    # Lifecycle
+
+    def location(self) -> str:
+        """A name identifying the store across instances ('' if it has none), e.g. for cache keys."""
+
+    def close(self) -> None:
+        ...
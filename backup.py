@@ -0,0 +1,280 @@
+"""
+This module takes and restores backups of the PIM database.
+
+A backup directory holds a chain of backup files described by manifest.json:
+
+- full backups are snapshots taken with the SQLite online backup API, a few
+  pages at a time with a pause between steps so writers are never locked
+  out for long;
+- incremental backups hold only what changed since the previous backup in
+  the chain, found through the particle_changes log (changed particles,
+  deletion tombstones) plus the small users table.
+
+restore() rebuilds a database from the newest full backup and the
+incrementals after it, optionally stopping at a point in time.
+
+    python -m backup full --db pim.db --dir backups
+    python -m backup incremental --db pim.db --dir backups
+    python -m backup restore --dir backups --target restored.db [--until 2025-06-01T12:00]
+    python -m backup list --dir backups
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import storage
+
+MANIFEST = "manifest.json"
+PAGES_PER_STEP = 256
+STEP_PAUSE = 0.005  # seconds between backup steps, giving writers a window
+MAX_RESTARTS = 3
+
+
+class BackupEntry(NamedTuple):
+    kind: str  # "full" or "incremental"
+    file: str
+    created_at: str
+    from_seq: int  # change log sequence the backup starts after (0 for full)
+    to_seq: int  # highest change log sequence included
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def read_manifest(directory: str) -> List[BackupEntry]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [BackupEntry(**entry) for entry in json.load(f)["entries"]]
+
+
+def _write_manifest(directory: str, entries: List[BackupEntry]) -> None:
+    path = os.path.join(directory, MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"entries": [e._asdict() for e in entries]}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _max_seq(conn: sqlite3.Connection, schema: str = "main") -> int:
+    return conn.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {schema}.particle_changes").fetchone()[0]
+
+
+def copy_database(src: sqlite3.Connection, dest_path: str, pages: int = PAGES_PER_STEP,
+                  pause: float = STEP_PAUSE, max_restarts: int = MAX_RESTARTS) -> None:
+    """
+    Copies a live database to dest_path with the online backup API.
+
+    The copy runs `pages` pages per step and sleeps `pause` seconds between
+    steps, when no lock is held. A write from another connection restarts
+    the copy; after max_restarts restarts it finishes in a single step
+    instead, so a busy database cannot starve the backup.
+    """
+    tmp = dest_path + ".partial"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    dest = sqlite3.connect(tmp)
+    last_remaining = None
+    restarts = 0
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal last_remaining, restarts
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        try:
+            src.backup(dest, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            src.backup(dest, pages=-1)
+    finally:
+        dest.close()
+    os.replace(tmp, dest_path)
+
+
+def _stamp() -> str:
+    return datetime.now().strftime("%Y%m%dT%H%M%S%f")
+
+
+def full_backup(db_path: str, directory: str, pages: int = PAGES_PER_STEP, pause: float = STEP_PAUSE) -> BackupEntry:
+    """Takes a snapshot of the database and starts a new chain in the manifest."""
+    os.makedirs(directory, exist_ok=True)
+    src = storage.make_connection(db_path)
+    filename = f"full-{_stamp()}.db"
+    try:
+        copy_database(src, os.path.join(directory, filename), pages, pause)
+    finally:
+        src.close()
+
+    snapshot = sqlite3.connect(os.path.join(directory, filename))
+    try:
+        to_seq = _max_seq(snapshot)
+    finally:
+        snapshot.close()
+    entry = BackupEntry("full", filename, datetime.now().isoformat(), 0, to_seq)
+    _write_manifest(directory, read_manifest(directory) + [entry])
+    return entry
+
+
+def incremental_backup(db_path: str, directory: str) -> BackupEntry:
+    """
+    Writes the particles changed since the last backup in the chain, their
+    deletion tombstones and the users table to a new incremental file.
+
+    Raises:
+        ValueError: If the directory has no full backup to build on.
+    """
+    entries = read_manifest(directory)
+    if not any(e.kind == "full" for e in entries):
+        raise ValueError("No full backup to base an incremental backup on")
+    since = entries[-1].to_seq
+    filename = f"incr-{_stamp()}.db"
+    path = os.path.join(directory, filename)
+
+    conn = storage.make_connection(db_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS inc", (path + ".partial",))
+        # One read transaction, so the rows and to_seq are from the same state.
+        conn.execute("BEGIN")
+        to_seq = _max_seq(conn)
+        conn.execute(f"""
+            CREATE TABLE inc.particles AS
+            SELECT {storage.PARTICLE_COLUMNS} FROM main.particles
+            WHERE id IN (SELECT particle_id FROM main.particle_changes
+                         WHERE seq > ? AND seq <= ? AND deleted = 0)
+        """, (since, to_seq))
+        conn.execute("""
+            CREATE TABLE inc.tombstones AS
+            SELECT particle_id FROM main.particle_changes WHERE seq > ? AND seq <= ? AND deleted = 1
+        """, (since, to_seq))
+        conn.execute("CREATE TABLE inc.users AS SELECT * FROM main.users")
+        conn.commit()
+        conn.execute("DETACH DATABASE inc")
+    finally:
+        conn.close()
+    os.replace(path + ".partial", path)
+
+    entry = BackupEntry("incremental", filename, datetime.now().isoformat(), since, to_seq)
+    _write_manifest(directory, entries + [entry])
+    return entry
+
+
+def restore_chain(directory: str, until: Optional[str] = None) -> List[BackupEntry]:
+    """
+    The backups to apply to restore the state as of `until` (an ISO
+    timestamp; latest if None): the newest full backup taken by then and the
+    incrementals that follow it up to that time.
+
+    Raises:
+        ValueError: If there is no full backup old enough.
+    """
+    entries = [e for e in read_manifest(directory) if until is None or e.created_at <= until]
+    fulls = [i for i, e in enumerate(entries) if e.kind == "full"]
+    if not fulls:
+        raise ValueError("No full backup taken before the requested time")
+    chain = [entries[fulls[-1]]]
+    for entry in entries[fulls[-1] + 1:]:
+        if entry.from_seq != chain[-1].to_seq:
+            break  # a gap in the chain: stop at the last consistent point
+        chain.append(entry)
+    return chain
+
+
+def restore(directory: str, target_path: str, until: Optional[str] = None) -> List[BackupEntry]:
+    """
+    Rebuilds a database at target_path from a backup directory.
+
+    Raises:
+        FileExistsError: If target_path already exists (restores never overwrite).
+        ValueError: If there is no usable full backup.
+
+    Returns:
+        The backups that were applied, oldest first.
+    """
+    if os.path.exists(target_path):
+        raise FileExistsError(f"{target_path} already exists")
+    chain = restore_chain(directory, until)
+
+    full = sqlite3.connect(os.path.join(directory, chain[0].file))
+    try:
+        copy_database(full, target_path, pages=-1, pause=0)
+    finally:
+        full.close()
+
+    try:
+        conn = storage.make_connection(target_path)
+        try:
+            for entry in chain[1:]:
+                _apply_incremental(conn, os.path.join(directory, entry.file))
+        finally:
+            conn.close()
+    except BaseException:
+        os.remove(target_path)  # never leave a half-restored database behind
+        raise
+    return chain
+
+
+def _apply_incremental(conn: sqlite3.Connection, path: str) -> None:
+    """Applies one incremental backup in a single transaction: all of it or, on error, none."""
+    conn.execute("ATTACH DATABASE ? AS inc", (path,))
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        cur.execute("INSERT OR REPLACE INTO main.users SELECT * FROM inc.users")
+        # Deletions first: a deleted particle's user_facing_id may have been reused.
+        cur.execute("DELETE FROM main.particles WHERE id IN (SELECT particle_id FROM inc.tombstones)")
+        # Titles can move between changed particles (A renamed away from "Alpha",
+        # then B renamed to "Alpha"), so free all their titles before saving any.
+        cur.execute("UPDATE main.particles SET normalized_title = NULL WHERE id IN (SELECT id FROM inc.particles)")
+        cur.row_factory = storage.particle_row
+        for particle in cur.execute(f"SELECT {storage.PARTICLE_COLUMNS} FROM inc.particles").fetchall():
+            storage.write_particle(conn, particle)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE inc")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Back up and restore the PIM database.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("full", "incremental"):
+        p = sub.add_parser(name)
+        p.add_argument("--db", default="pim.db")
+        p.add_argument("--dir", required=True)
+    p = sub.add_parser("restore")
+    p.add_argument("--dir", required=True)
+    p.add_argument("--target", required=True)
+    p.add_argument("--until", help="ISO timestamp to restore to (default: latest)")
+    p = sub.add_parser("list")
+    p.add_argument("--dir", required=True)
+    args = parser.parse_args()
+
+    if args.command == "full":
+        print(full_backup(args.db, args.dir))
+    elif args.command == "incremental":
+        print(incremental_backup(args.db, args.dir))
+    elif args.command == "restore":
+        for entry in restore(args.dir, args.target, args.until):
+            print(f"applied {entry.kind:<11} {entry.file} (seq {entry.from_seq}..{entry.to_seq})")
+    else:
+        for entry in read_manifest(args.dir):
+            print(f"{entry.created_at}  {entry.kind:<11} {entry.file}  seq {entry.from_seq}..{entry.to_seq}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the PIM application. Run each one from the repository root as a
+module, e.g. `python -m benchmarks.fuzzy_lookup`.
+"""
@@ -0,0 +1,86 @@
+"""
+Measures foreground request latency while a full backup runs.
+
+Fills a database file with N particles, then runs a foreground loop of
+get_particle + save_particle (the shape of an edit request) on its own
+connection while a backup runs on a background thread. Three cases are
+compared: no backup, the paged backup used by backup.full_backup, and a
+single-step backup that holds its read lock for the whole copy.
+
+    python -m benchmarks.backup_latency --particles 20000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import backup
+import storage
+from pim_types import Particle
+
+
+def populate(path: str, n: int) -> None:
+    conn = storage.make_connection(path)
+    rows = [(f"id-{i}", 1, i + 1, f"Title {i}", "<p>" + "lorem ipsum " * 150 + "</p>", "work",
+             "2025-01-01T00:00:00", "2025-01-01T00:00:00", "bench") for i in range(n)]
+    conn.executemany(
+        "INSERT INTO particles (id, user_id, user_facing_id, title, body, tags, created_at, updated_at, author) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def foreground(path: str, n: int, stop: threading.Event, latencies: list) -> None:
+    conn = storage.make_connection(path)
+    rng = random.Random(1)
+    while not stop.is_set():
+        pid = f"id-{rng.randrange(n)}"
+        start = time.perf_counter()
+        p: Particle = storage.get_particle(conn, pid)
+        storage.save_particle(conn, p._replace(updated_at=str(time.time())))
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.002)  # roughly a request every few milliseconds
+    conn.close()
+
+
+def run_case(path: str, n: int, label: str, pages: int, pause: float, duration: float) -> None:
+    latencies: list = []
+    stop = threading.Event()
+    worker = threading.Thread(target=foreground, args=(path, n, stop, latencies))
+    worker.start()
+    backup_s = 0.0
+    if pages:
+        with tempfile.TemporaryDirectory() as out:
+            start = time.perf_counter()
+            backup.full_backup(path, out, pages=pages, pause=pause)
+            backup_s = time.perf_counter() - start
+    else:
+        time.sleep(duration)
+    stop.set()
+    worker.join()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{label:<16} backup={backup_s:6.2f}s ops={len(latencies):>5} "
+          f"p50={pct(0.5):6.2f}ms p99={pct(0.99):8.2f}ms max={latencies[-1] * 1000:8.2f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--particles", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pim.db")
+        populate(path, args.particles)
+        print(f"database: {os.path.getsize(path) / 1e6:.1f} MB")
+        run_case(path, args.particles, "no backup", 0, 0, 2.0)
+        run_case(path, args.particles, "paged backup", backup.PAGES_PER_STEP, backup.STEP_PAUSE, 0)
+        run_case(path, args.particles, "single step", -1, 0, 0)
+
+
+if __name__ == "__main__":
+    main()
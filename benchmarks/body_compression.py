@@ -0,0 +1,122 @@
+"""
+Measures what compressing particle bodies saves and costs.
+
+Generates the same synthetic data set (Quill-style HTML bodies) twice, once
+with body compression disabled and once with the codec defaults, and
+reports for each database:
+
+- its file size and the bytes held by the body columns;
+- SQLite page cache misses per get_particle, with a fixed, small page cache
+  (each miss is one read() from the file, counted from /proc/self/io);
+- get_particle and search latency.
+
+    python -m benchmarks.body_compression --particles 2000 --words 400 --cache-kb 2000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import codec
+import search
+import storage
+from benchmarks.datagen import DataSpec, generate
+
+
+def read_syscalls() -> int:
+    """read() calls made by this process so far (-1 where /proc/self/io is unavailable)."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("syscr:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return -1
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(path: str, ids: List[str], author: str, word: str, reads: int, cache_kb: int) -> Dict:
+    conn = storage.make_connection(path)
+    conn.execute(f"PRAGMA cache_size = -{cache_kb}")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    body_bytes = conn.execute(
+        "SELECT SUM(length(CAST(body AS BLOB))), SUM(length(CAST(body_text AS BLOB))) FROM particles").fetchone()
+
+    rng = random.Random(7)
+    sample = [rng.choice(ids) for _ in range(reads)]
+    for pid in sample[:reads // 10]:  # warm the page cache
+        storage.get_particle(conn, pid)
+    latencies = []
+    before = read_syscalls()
+    for pid in sample:
+        start = time.perf_counter()
+        storage.get_particle(conn, pid)
+        latencies.append(time.perf_counter() - start)
+    misses = read_syscalls() - before if before >= 0 else float("nan")
+
+    search_times = []
+    for _ in range(20):
+        start = time.perf_counter()
+        search.run_query(conn, author, word)
+        search_times.append(time.perf_counter() - start)
+    conn.close()
+    return {
+        "file_mb": pages * page_size / 1e6,
+        "body_mb": (body_bytes[0] or 0) / 1e6,
+        "text_mb": (body_bytes[1] or 0) / 1e6,
+        "cache_share": min(1.0, cache_kb * 1024 / (pages * page_size)),
+        "misses_per_read": misses / reads,
+        "read_p50_ms": statistics.median(latencies) * 1000,
+        "read_p99_ms": percentile(latencies, 0.99) * 1000,
+        "search_p50_ms": statistics.median(search_times) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--particles", type=int, default=2000, help="particles per author")
+    parser.add_argument("--authors", type=int, default=2)
+    parser.add_argument("--words", type=int, default=400, help="median body length in words")
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--cache-kb", type=int, default=2000, help="SQLite page cache size")
+    args = parser.parse_args()
+
+    spec = DataSpec(authors=args.authors, particles_per_author=args.particles, body_words=args.words)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, threshold in (("plain", float("inf")), ("compressed", codec.COMPRESS_MIN_BYTES)):
+            path = os.path.join(tmp, f"{label}.db")
+            saved, codec.COMPRESS_MIN_BYTES = codec.COMPRESS_MIN_BYTES, threshold
+            try:
+                conn = storage.make_connection(path)
+                data = generate(conn, spec)
+                conn.execute("VACUUM")
+                conn.close()
+            finally:
+                codec.COMPRESS_MIN_BYTES = saved
+            ids = [pid for author_ids in data.particle_ids for pid in author_ids]
+            results[label] = measure(path, ids, data.authors[0], data.vocabulary[0], args.reads, args.cache_kb)
+
+    codec_name = "zstd" if codec.zstandard is not None else "zlib"
+    print(f"{args.authors * args.particles:,} particles, median {args.words} words, "
+          f"{args.cache_kb} KB page cache, codec {codec_name}")
+    print(f"{'':<11}{'file MB':>9}{'body MB':>9}{'text MB':>9}{'cached':>8}{'miss/read':>11}"
+          f"{'read p50':>10}{'read p99':>10}{'search p50':>12}")
+    for label, r in results.items():
+        print(f"{label:<11}{r['file_mb']:>9.1f}{r['body_mb']:>9.1f}{r['text_mb']:>9.1f}{r['cache_share']:>8.0%}"
+              f"{r['misses_per_read']:>11.2f}{r['read_p50_ms']:>8.3f}ms{r['read_p99_ms']:>8.3f}ms"
+              f"{r['search_p50_ms']:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
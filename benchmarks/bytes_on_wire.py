@@ -0,0 +1,101 @@
+"""
+Measures response bytes on the wire for a typical browser session.
+
+Replays a session against the app in-process twice: once as a client that
+neither accepts compression nor caches ("before"), and once as a browser that
+accepts gzip, keeps immutable assets and revalidates pages with ETags
+("after"). The session logs in, lists and searches notes, opens a few in the
+viewer and editor, then comes back later and repeats the listing.
+
+    python -m benchmarks.bytes_on_wire
+"""
+
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+from fastapi.testclient import TestClient
+
+import api
+
+_REF_RE = re.compile(r'(?:href|src)="(/?static/[^"]+)"')
+
+
+class Browser:
+    """A minimal browser: fetches pages plus their assets, optionally caching."""
+
+    def __init__(self, client: TestClient, caching: bool):
+        self.client = client
+        self.caching = caching
+        self.etags: Dict[str, str] = {}
+        self.immutable: Dict[str, bool] = {}
+        self.html: Dict[str, str] = {}  # last page body, reused on a 304
+        self.bytes = 0
+        self.requests = 0
+
+    def request(self, method: str, url: str, json: Optional[dict] = None):
+        headers = {"Accept-Encoding": "gzip" if self.caching else "identity"}
+        if self.caching and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+        resp = self.client.request(method, url, json=json, headers=headers)
+        self.bytes += resp.num_bytes_downloaded
+        self.requests += 1
+        if self.caching and "etag" in resp.headers:
+            self.etags[url] = resp.headers["etag"]
+        return resp
+
+    def page(self, url: str) -> None:
+        resp = self.request("GET", url)
+        html = resp.text if resp.status_code == 200 else self.html.get(url, "")
+        self.html[url] = html
+        for ref in _REF_RE.findall(html):
+            ref = "/" + ref.lstrip("/")
+            if self.caching and self.immutable.get(ref):
+                continue  # served from cache without a request
+            asset = self.request("GET", ref)
+            self.immutable[ref] = "immutable" in asset.headers.get("cache-control", "")
+
+
+def session(browser: Browser, notes: list) -> None:
+    browser.page("/")
+    token = browser.request("POST", "/login", json={"username": "bench", "password": "pw"}).json()["session"]
+    browser.page("/index.html")
+    browser.request("GET", f"/search?q=&session={token}")
+    browser.request("GET", f"/search?q=project&session={token}")
+    for pid in notes[:3]:
+        browser.page(f"/viewer.html?id={pid}")
+        browser.request("GET", f"/particles/{pid}?session={token}")
+    browser.page(f"/editor.html?id={notes[0]}")
+    browser.request("GET", f"/particles/{notes[0]}?session={token}")
+    # Coming back later: list again and open one note.
+    browser.page("/index.html")
+    browser.request("GET", f"/search?q=&session={token}")
+    browser.page(f"/viewer.html?id={notes[1]}")
+    browser.request("GET", f"/particles/{notes[1]}?session={token}")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        api.DB_PATH = os.path.join(tmp, "pim.db")
+        with TestClient(api.app) as client:
+            client.post("/register", json={"username": "bench", "password": "pw"})
+            token = client.post("/login", json={"username": "bench", "password": "pw"}).json()["session"]
+            body = "<p>Notes on the project plan, meeting outcomes and next steps.</p>" * 30
+            notes = [
+                client.post(f"/particles?session={token}",
+                            json={"title": f"Project note {i}", "body": body, "tags": ["work"]}).json()["id"]
+                for i in range(20)
+            ]
+            results = {}
+            for label, caching in (("before", False), ("after", True)):
+                browser = Browser(client, caching)
+                session(browser, notes)
+                results[label] = browser
+                print(f"{label:<7} {browser.requests:>3} requests {browser.bytes:>9,} bytes")
+            saved = 1 - results["after"].bytes / results["before"].bytes
+            print(f"reduction {saved:.0%}")
+
+
+if __name__ == "__main__":
+    main()
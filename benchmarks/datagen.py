@@ -0,0 +1,118 @@
+"""
+Generates synthetic PIM data for benchmarks and load tests.
+
+A DataSpec describes the data set: the number of authors and particles per
+author, a log-normal body length distribution and a Zipf-skewed vocabulary
+(a few words are very common, most are rare, as in real notes). The same
+spec and seed always produce the same data, so results can be compared
+across commits.
+
+    conn = storage.make_connection("bench.db")
+    data = generate(conn, DataSpec(authors=10, particles_per_author=1000))
+"""
+
+import bisect
+import itertools
+import math
+import random
+from datetime import datetime, timedelta
+from typing import List, NamedTuple
+
+import storage
+from authorise import _hash_password
+from pim_types import Particle
+
+PASSWORD = "benchmark-password"
+TAG_POOL = ["work", "home", "code", "ideas", "reading", "todo", "travel", "health", "money", "family"]
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "pe", "si", "da", "gu", "ho", "ze", "bi", "fa", "wu"]
+
+
+class DataSpec(NamedTuple):
+    authors: int = 5
+    particles_per_author: int = 1000
+    body_words: int = 120  # median body length in words
+    body_sigma: float = 0.8  # spread of the log-normal body length
+    vocabulary: int = 5000
+    zipf: float = 1.1  # vocabulary skew: word rank r has weight 1 / r**zipf
+    max_tags: int = 3
+    seed: int = 1
+
+
+class Dataset(NamedTuple):
+    spec: DataSpec
+    authors: List[str]
+    vocabulary: List[str]  # most frequent first
+    particle_ids: List[List[str]]  # per author, in creation order
+
+
+def make_vocabulary(n: int) -> List[str]:
+    """n distinct pronounceable words, shortest first."""
+    words = []
+    for length in itertools.count(2):
+        for combo in itertools.product(_SYLLABLES, repeat=length):
+            words.append("".join(combo))
+            if len(words) == n:
+                return words
+
+
+class WordSampler:
+    """Draws words with Zipf-distributed frequencies."""
+
+    def __init__(self, vocabulary: List[str], skew: float, rng: random.Random):
+        self.vocabulary = vocabulary
+        self.rng = rng
+        self._cumulative = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(vocabulary))))
+
+    def word(self) -> str:
+        x = self.rng.random() * self._cumulative[-1]
+        return self.vocabulary[bisect.bisect_left(self._cumulative, x)]
+
+    def words(self, n: int) -> List[str]:
+        return [self.word() for _ in range(n)]
+
+
+def body_length(spec: DataSpec, rng: random.Random) -> int:
+    return max(1, int(rng.lognormvariate(math.log(spec.body_words), spec.body_sigma)))
+
+
+def make_body(words: List[str], rng: random.Random) -> str:
+    """Wraps words in <p> paragraphs of 20-80 words, like the editor produces."""
+    paragraphs = []
+    i = 0
+    while i < len(words):
+        n = rng.randint(20, 80)
+        paragraphs.append("<p>" + " ".join(words[i:i + n]) + "</p>")
+        i += n
+    return "".join(paragraphs)
+
+
+def generate(conn, spec: DataSpec = DataSpec()) -> Dataset:
+    """
+    Fills a database with spec.authors users (all with password PASSWORD)
+    and their particles, written through storage.save_particle so the tag
+    index, change log and triggers are populated as in production.
+    """
+    rng = random.Random(spec.seed)
+    vocabulary = make_vocabulary(spec.vocabulary)
+    sampler = WordSampler(vocabulary, spec.zipf, rng)
+    password_hash = _hash_password(PASSWORD)  # one bcrypt hash shared by all users
+    start = datetime(2024, 1, 1)
+
+    authors, particle_ids = [], []
+    for a in range(spec.authors):
+        author = f"author{a}"
+        cur = conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (author, password_hash))
+        user_id = cur.lastrowid
+        ids = []
+        for i in range(spec.particles_per_author):
+            created = (start + timedelta(minutes=37 * i + a)).isoformat()
+            title = " ".join(sampler.words(rng.randint(2, 6))).capitalize() + f" {i}"
+            p = Particle(f"{author}-{i:07d}", user_id, i + 1, title,
+                         make_body(sampler.words(body_length(spec, rng)), rng), author,
+                         frozenset(rng.sample(TAG_POOL, rng.randint(0, spec.max_tags))), created, created)
+            storage.save_particle(conn, p)
+            ids.append(p.id)
+        authors.append(author)
+        particle_ids.append(ids)
+    conn.commit()
+    return Dataset(spec, authors, vocabulary, particle_ids)
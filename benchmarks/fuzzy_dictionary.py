@@ -0,0 +1,71 @@
+"""
+Measures what keeping an author's fuzzy term dictionary current costs.
+
+Generates one author's particles over a large vocabulary, then reports the
+time and memory of a full build from the change log, the latency of the
+catch-up after a single edit (what the first fuzzy search after a write
+pays) and how far a first search gets within fuzzy.UPDATE_BUDGET.
+
+    python -m benchmarks.fuzzy_dictionary --particles 20000 --vocabulary 100000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import fuzzy
+import storage
+from benchmarks.datagen import DataSpec, generate, make_body
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--particles", type=int, default=20_000)
+    parser.add_argument("--vocabulary", type=int, default=100_000)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = storage.make_connection(os.path.join(tmp, "bench.db"))
+        data = generate(conn, DataSpec(authors=1, particles_per_author=args.particles,
+                                       vocabulary=args.vocabulary, zipf=0.8, seed=args.seed))
+        author = data.authors[0]
+
+        start = time.perf_counter()
+        terms = len(fuzzy.build_term_dictionary(conn, author))
+        build_s = time.perf_counter() - start
+        tracemalloc.start()
+        dictionary = fuzzy.build_term_dictionary(conn, author)
+        memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        del dictionary
+        print(f"terms={terms} full build={build_s:.2f}s memory={memory_mb:.0f}MB")
+
+        start = time.perf_counter()
+        partial = fuzzy.term_dictionary(conn, author)
+        first_ms = (time.perf_counter() - start) * 1000
+        print(f"first search: {first_ms:.1f}ms, {len(partial)} terms indexed "
+              f"(budget {fuzzy.UPDATE_BUDGET * 1000:.0f}ms)")
+        fuzzy.term_dictionary(conn, author, budget=float("inf"))
+
+        rng = random.Random(args.seed)
+        timings = []
+        for _ in range(args.edits):
+            p = storage.get_particle(conn, rng.choice(data.particle_ids[0]))
+            words = rng.sample(data.vocabulary, 100)
+            storage.save_particle(conn, p._replace(body=make_body(words, rng)))
+            start = time.perf_counter()
+            fuzzy.term_dictionary(conn, author)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"catch-up after one edit p50={timings[len(timings) // 2] * 1000:.2f}ms "
+              f"max={timings[-1] * 1000:.2f}ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures fuzzy term lookup latency against a large term dictionary.
+
+Builds a TermDictionary of random words with an English-like letter skew,
+then looks up single-typo variants of dictionary words and reports latency
+percentiles for fuzzy.expand.
+
+    python -m benchmarks.fuzzy_lookup --terms 100000 --queries 1000
+"""
+
+import argparse
+import gc
+import random
+import time
+
+from fuzzy import TermDictionary, expand
+
+LETTERS = "etaoinshrdlucmfwypvbgkjqxz"
+WEIGHTS = [12, 9, 8, 8, 7, 7, 6, 6, 6, 4, 4, 3, 3, 2, 2, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1, 1]
+
+
+def random_terms(n: int, rng: random.Random) -> list:
+    terms = set()
+    while len(terms) < n:
+        terms.add("".join(rng.choices(LETTERS, WEIGHTS, k=rng.randint(3, 12))))
+    return sorted(terms)
+
+
+def with_typo(word: str, rng: random.Random) -> str:
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice(LETTERS) + word[i + 1:]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--terms", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    terms = random_terms(args.terms, rng)
+
+    start = time.perf_counter()
+    dictionary = TermDictionary()
+    for term in terms:
+        dictionary.add(term)
+    build_s = time.perf_counter() - start
+
+    queries = [with_typo(w, rng) for w in rng.sample(terms, args.queries)]
+    timings = []
+    gc.disable()
+    for q in queries:
+        start = time.perf_counter()
+        expand(dictionary, q)
+        timings.append(time.perf_counter() - start)
+    gc.enable()
+    timings.sort()
+
+    def pct(p: float) -> float:
+        return timings[min(len(timings) - 1, int(p * len(timings)))] * 1000
+
+    print(f"terms={len(dictionary)} build={build_s:.2f}s")
+    print(f"lookup p50={pct(0.50):.3f}ms p95={pct(0.95):.3f}ms p99={pct(0.99):.3f}ms max={timings[-1] * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
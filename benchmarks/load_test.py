@@ -0,0 +1,237 @@
+"""
+Drives the web application with concurrent scripted user sessions.
+
+Each virtual user repeatedly runs a session: log in, list recent particles,
+then a weighted random mix of actions (list, search, view, edit, create,
+export), then log out. Particle ids are learned from the listings and
+search results, as the browser does. Per endpoint, the harness reports
+request counts, throughput, p50/p95/p99 latency and error rates.
+
+By default the app runs in-process (httpx over ASGI, no network) against a
+synthetic database from benchmarks.datagen, so everything works offline.
+With --url, a running server is targeted instead; fill its database with
+--generate-only first so the benchmark users exist.
+
+    python -m benchmarks.load_test --users 20 --duration 30
+    python -m benchmarks.load_test --users 50 --mix search=6,view=3,edit=1 --output load.json
+    python -m benchmarks.load_test --generate-only pim.db
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+import api
+import ratelimit
+import storage
+from benchmarks.datagen import PASSWORD, DataSpec, WordSampler, generate, make_vocabulary
+from benchmarks.suite import summarize
+
+DEFAULT_MIX = "list=1,search=4,view=4,edit=1,create=0.3,export=0.05"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'search=4,view=2' -> {'search': 4.0, 'view': 2.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in VirtualUser.ACTIONS:
+            raise ValueError(f"Unknown action {name!r}; choose from {', '.join(VirtualUser.ACTIONS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Stats:
+    """Latencies and outcomes per endpoint label."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, label: str, seconds: float, ok: bool) -> None:
+        self.latencies[label].append(seconds)
+        if not ok:
+            self.errors[label] += 1
+
+    def report(self, elapsed: float) -> Dict:
+        endpoints = {}
+        for label in sorted(self.latencies):
+            samples = self.latencies[label]
+            endpoints[label] = {**summarize(samples), "rps": round(len(samples) / elapsed, 1),
+                                "errors": self.errors[label],
+                                "error_rate": round(self.errors[label] / len(samples), 4)}
+        total = sum(len(s) for s in self.latencies.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 1),
+                "errors": sum(self.errors.values()), "endpoints": endpoints}
+
+
+class VirtualUser:
+    """One simulated user running sessions against the app until the deadline."""
+
+    ACTIONS = ("list", "search", "view", "edit", "create", "export")
+
+    def __init__(self, client: httpx.AsyncClient, username: str, mix: Dict[str, float], sampler: WordSampler,
+                 stats: Stats, rng: random.Random, actions_per_session: int, think: float):
+        self.client = client
+        self.username = username
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.sampler = sampler
+        self.stats = stats
+        self.rng = rng
+        self.actions_per_session = actions_per_session
+        self.think = think
+        self.session: Optional[str] = None
+        self.known_ids: List[str] = []
+        self.created = 0
+
+    async def request(self, label: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.stats.record(label, time.perf_counter() - start, ok=False)
+            return None
+        self.stats.record(label, time.perf_counter() - start, ok=response.is_success)
+        return response
+
+    def _learn(self, response: Optional[httpx.Response]) -> None:
+        if response is not None and response.is_success:
+            ids = [hit["id"] for hit in response.json()]
+            self.known_ids = (ids + self.known_ids)[:200]
+
+    async def run(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            response = await self.request("POST /login", "POST", "/login",
+                                          json={"username": self.username, "password": PASSWORD})
+            if response is None or not response.is_success:
+                continue
+            self.session = response.json()["session"]
+            await self.list()
+            for _ in range(self.actions_per_session):
+                if time.monotonic() >= deadline:
+                    break
+                if self.think:
+                    await asyncio.sleep(self.rng.expovariate(1 / self.think))
+                await getattr(self, self.rng.choices(self.names, self.weights)[0])()
+            await self.request("POST /logout", "POST", "/logout", json={"session": self.session})
+
+    async def list(self) -> None:
+        self._learn(await self.request("GET /search (list)", "GET", "/search",
+                                       params={"q": "", "session": self.session}))
+
+    async def search(self) -> None:
+        words = " ".join(self.sampler.words(self.rng.choice((1, 1, 2))))
+        self._learn(await self.request("GET /search", "GET", "/search", params={"q": words, "session": self.session}))
+
+    async def view(self) -> None:
+        if self.known_ids:
+            await self.request("GET /particles/{pid}", "GET", f"/particles/{self.rng.choice(self.known_ids)}",
+                               params={"session": self.session})
+
+    async def edit(self) -> None:
+        if self.known_ids:
+            body = "<p>" + " ".join(self.sampler.words(self.rng.randint(20, 200))) + "</p>"
+            await self.request("PUT /particles/{pid}/body", "PUT", f"/particles/{self.rng.choice(self.known_ids)}/body",
+                               params={"session": self.session}, json={"new_body": body})
+
+    async def create(self) -> None:
+        self.created += 1
+        title = f"Load {self.username} {self.created} {self.rng.random():.8f}"
+        body = "<p>" + " ".join(self.sampler.words(self.rng.randint(20, 200))) + "</p>"
+        response = await self.request("POST /particles", "POST", "/particles", params={"session": self.session},
+                                      json={"title": title, "body": body, "tags": ["load"]})
+        if response is not None and response.is_success:
+            self.known_ids.insert(0, response.json()["id"])
+
+    async def export(self) -> None:
+        await self.request("GET /export", "GET", "/export", params={"session": self.session})
+
+
+async def run_load(client: httpx.AsyncClient, spec: DataSpec, users: int, duration: float, mix: Dict[str, float],
+                   actions_per_session: int = 20, think: float = 0.0) -> Dict:
+    """Runs `users` virtual users for `duration` seconds; returns the report."""
+    stats = Stats()
+    vocabulary = make_vocabulary(spec.vocabulary)
+    deadline = time.monotonic() + duration
+    vusers = []
+    for i in range(users):
+        rng = random.Random(spec.seed * 1000 + i)
+        vusers.append(VirtualUser(client, f"author{i % spec.authors}", mix, WordSampler(vocabulary, spec.zipf, rng),
+                                  stats, rng, actions_per_session, think))
+    start = time.perf_counter()
+    await asyncio.gather(*(vu.run(deadline) for vu in vusers))
+    report = stats.report(time.perf_counter() - start)
+    report["config"] = {"users": users, "duration_s": duration, "mix": mix,
+                        "actions_per_session": actions_per_session, "think_s": think, "spec": spec._asdict()}
+    return report
+
+
+def print_report(report: Dict) -> None:
+    print(f"{report['requests']} requests in {report['elapsed_s']}s: {report['rps']} req/s, "
+          f"{report['errors']} errors")
+    print(f"{'endpoint':<28}{'count':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for label, e in report["endpoints"].items():
+        print(f"{label:<28}{e['n']:>8}{e['rps']:>9}{e['p50_ms']:>10}{e['p95_ms']:>10}{e['p99_ms']:>10}"
+              f"{e['error_rate']:>9.1%}")
+
+
+def make_database(path: str, spec: DataSpec) -> None:
+    conn = storage.make_connection(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    generate(conn, spec)
+    conn.close()
+
+
+def main() -> None:
+    defaults = DataSpec()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="action weights, e.g. search=4,view=2")
+    parser.add_argument("--actions", type=int, default=20, help="actions per session between login and logout")
+    parser.add_argument("--think", type=float, default=0.0, help="mean think time between actions (seconds)")
+    parser.add_argument("--authors", type=int, default=defaults.authors)
+    parser.add_argument("--particles", type=int, default=defaults.particles_per_author, help="particles per author")
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--generate-only", metavar="PATH", help="write the synthetic database to PATH and exit")
+    parser.add_argument("--output", help="also write the report as JSON here")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep rate limiting on in-process (all virtual users share one client IP)")
+    args = parser.parse_args()
+
+    spec = DataSpec(authors=args.authors, particles_per_author=args.particles)
+    mix = parse_mix(args.mix)
+    if args.generate_only:
+        make_database(args.generate_only, spec)
+        return
+
+    async def go(transport: Optional[httpx.AsyncBaseTransport], base_url: str) -> Dict:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as client:
+            return await run_load(client, spec, args.users, args.duration, mix, args.actions, args.think)
+
+    if args.url:
+        report = asyncio.run(go(None, args.url))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            api.DB_PATH = os.path.join(tmp, "load.db")
+            make_database(api.DB_PATH, spec)
+            ratelimit.ENABLED = args.rate_limit
+            report = asyncio.run(go(httpx.ASGITransport(app=api.app), "http://load-test"))
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
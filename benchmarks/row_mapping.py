@@ -0,0 +1,86 @@
+"""
+Compares the storage row mapper against the previous sqlite3.Row mapping.
+
+Loads N particles for one author into an in-memory database, then maps them
+with the old per-row approach (sqlite3.Row, nine key lookups and a tag split
+into a new set) and with storage.get_all_particles_by_author, reporting rows
+per second and the memory held by the resulting list.
+
+    python -m benchmarks.row_mapping --particles 100000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+import storage
+from pim_types import Particle
+
+TAG_POOL = ["work", "home", "code", "ideas", "reading", "todo", "travel", "health"]
+
+
+def populate(conn, n: int, rng: random.Random) -> None:
+    rows = []
+    for i in range(n):
+        tags = ",".join(sorted(rng.sample(TAG_POOL, rng.randint(0, 3))))
+        rows.append((f"id-{i}", 1, i + 1, f"Title {i}", "body " * 40, tags,
+                     "2025-01-01T00:00:00", "2025-01-01T00:00:00", "bench"))
+    conn.executemany(
+        "INSERT INTO particles (id, user_id, user_facing_id, title, body, tags, created_at, updated_at, author) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+
+def legacy_all_particles(conn, author: str):
+    """The mapping storage used before the shared row factory."""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM particles WHERE author = ? ORDER BY created_at DESC", (author,))
+    particles = []
+    for row in cur.fetchall():
+        particles.append(Particle(
+            id=row["id"],
+            user_id=row["user_id"],
+            user_facing_id=row["user_facing_id"],
+            title=row["title"],
+            body=row["body"],
+            author=row["author"],
+            tags=set(row["tags"].split(",")) if row["tags"] else set(),
+            created_at=row["created_at"],
+            updated_at=row["updated_at"]
+        ))
+    return particles
+
+
+def measure(label: str, fn, conn, n: int, repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(conn, "bench")
+        best = min(best, time.perf_counter() - start)
+
+    storage.decode_tags.cache_clear()
+    tracemalloc.start()
+    result = fn(conn, "bench")
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    print(f"{label:<8} {n / best:>12,.0f} rows/s   {held / 1e6:8.1f} MB per {n:,} particles")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--particles", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    conn = storage.make_connection(":memory:")
+    populate(conn, args.particles, random.Random(1))
+    measure("legacy", legacy_all_particles, conn, args.particles, args.repeat)
+    measure("mapper", storage.get_all_particles_by_author, conn, args.particles, args.repeat)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures the cost of the sampling profiler on search throughput.
+
+Runs search.query in a loop on a synthetic database (benchmarks.datagen)
+with the profiler off and then on at several intervals, reporting queries
+per second, the slowdown, and the overhead the profiler measured itself.
+The hottest stacks of the last run are printed so the result can be
+sanity-checked against where search time is expected to go.
+
+    python -m benchmarks.sampler_overhead --seconds 5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import search
+import storage
+from benchmarks.datagen import DataSpec, generate
+from sampler import SamplingProfiler
+
+QUERIES = ["kaka", "kalo mi", "tag:work lo", '"ka lo"', "ne OR ru"]
+
+
+def run(path: str, seconds: float) -> float:
+    conn = storage.make_connection(path)
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        search.query(conn, "author0", QUERIES[done % len(QUERIES)])
+        done += 1
+    conn.close()
+    return done / seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--particles", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = storage.make_connection(path)
+        conn.execute("PRAGMA synchronous = OFF")
+        generate(conn, DataSpec(authors=1, particles_per_author=args.particles))
+        conn.close()
+
+        baseline = run(path, args.seconds)
+        print(f"{'profiler off':<20} {baseline:8.1f} queries/s")
+        profiler = SamplingProfiler()
+        for interval in (0.01, 0.005, 0.001):
+            profiler.start(interval=interval, duration=args.seconds * 2)
+            qps = run(path, args.seconds)
+            profiler.stop()
+            status = profiler.status()
+            print(f"{f'every {interval * 1000:g}ms':<20} {qps:8.1f} queries/s  "
+                  f"slowdown={1 - qps / baseline:+.1%}  measured overhead={status['overhead']:.2%}  "
+                  f"samples={status['samples']} final interval={status['interval_ms']}ms")
+
+        print("\nhottest stacks (last run):")
+        for line in profiler.collapsed().splitlines()[:5]:
+            stack, count = line.rsplit(" ", 1)
+            print(f"{count:>6}  ...{stack[-150:]}")
+
+
+if __name__ == "__main__":
+    main()
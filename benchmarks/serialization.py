@@ -0,0 +1,65 @@
+"""
+Compares search response encoding: the previous pydantic path against the
+serialize module.
+
+The old /search route built a SearchResponse model per hit, after which
+FastAPI validated the list against response_model and ran jsonable_encoder
+before json.dumps. The new route encodes the QueryHit tuples directly.
+
+    python -m benchmarks.serialization
+"""
+
+import argparse
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from api import SearchResponse
+from pim_types import QueryHit
+from serialize import hits_json
+
+_adapter = TypeAdapter(List[SearchResponse])
+
+
+def make_hits(n: int) -> List[QueryHit]:
+    return [
+        QueryHit(f"id-{i}", i, "2025-01-01T00:00:00", f"Note {i}", float(i % 7),
+                 "...some matched <b>context</b> around the term " * 2, ((14, 21),))
+        for i in range(n)
+    ]
+
+
+def legacy(hits: List[QueryHit]) -> bytes:
+    models = [SearchResponse(**h._asdict()) for h in hits]
+    validated = _adapter.validate_python(models)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def measure(fn, hits, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(hits)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 200, 2000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'hits':>6} {'legacy ms':>10} {'direct ms':>10} {'speed-up':>9}")
+    for n in args.sizes:
+        hits = make_hits(n)
+        assert json.loads(legacy(hits)) == json.loads(hits_json(hits))
+        old, new = measure(legacy, hits, args.repeat), measure(hits_json, hits, args.repeat)
+        print(f"{n:>6} {old:>10.3f} {new:>10.3f} {old / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures particle write throughput with one database file versus several shards.
+
+Runs one writer thread per author, each saving particles on its own
+connection for a fixed duration. With a single file every writer contends
+for the same write lock; with sharding.ShardRouter the authors are spread
+over N files and only writers on the same shard contend.
+
+    python -m benchmarks.shard_write_throughput --authors 8 --shards 4
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import storage
+from pim_types import Particle
+from sharding import ShardRouter
+
+
+def writer(path: str, author: str, stop: threading.Event, counts: dict) -> None:
+    conn = storage.make_connection(path)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    body = "<p>" + "lorem ipsum " * 100 + "</p>"
+    n = 0
+    while not stop.is_set():
+        n += 1
+        particle = Particle(f"{author}-{n}", 1, n, f"Title {n}", body, author, frozenset({"bench"}),
+                            "2025-01-01T00:00:00", "2025-01-01T00:00:00")
+        try:
+            storage.save_particle(conn, particle)
+        except sqlite3.OperationalError:  # "database is locked" past the busy timeout
+            n -= 1
+    counts[author] = n
+    conn.close()
+
+
+def run_case(label: str, paths_by_author: dict, duration: float) -> None:
+    counts: dict = {}
+    stop = threading.Event()
+    threads = [threading.Thread(target=writer, args=(path, author, stop, counts))
+               for author, path in paths_by_author.items()]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    total = sum(counts.values())
+    print(f"{label:<12} files={len(set(paths_by_author.values()))} writes={total:>7} "
+          f"throughput={total / duration:9.0f}/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--authors", type=int, default=8)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+    authors = [f"author{i}" for i in range(args.authors)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single = os.path.join(tmp, "single.db")
+        storage.make_connection(single).close()
+        run_case("single file", {a: single for a in authors}, args.duration)
+
+        router = ShardRouter(os.path.join(tmp, "dir.db"),
+                             [os.path.join(tmp, f"shard{i}.db") for i in range(args.shards)])
+        directory = router.directory()
+        paths = {a: router.shard_for(directory, a) for a in authors}
+        directory.close()
+        for path in set(paths.values()):
+            storage.make_connection(path).close()
+        run_case("sharded", paths, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Runs the benchmark suite for storage, search, authentication and export.
+
+Generates a synthetic data set (see benchmarks.datagen) in a temporary
+database file, then measures:
+
+- search latency percentiles per query shape (common, rare and multi-word
+  keywords, phrases, tag filters, fuzzy matches, the empty-query listing);
+- create and update throughput through edit_particles;
+- login and session check latency through authorise;
+- export time for one author (load, convert and encode as /export does).
+
+Results are written as JSON together with the commit, Python and SQLite
+versions and the data spec. --compare reports the change against an
+earlier results file and exits non-zero when a metric regressed by more
+than --threshold.
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --output new.json --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import authorise
+import edit_particles
+import search
+import storage
+from benchmarks.datagen import PASSWORD, DataSpec, Dataset, generate
+from serialize import particle_dict
+
+# Latency metrics (ending in _ms) are better when lower; throughputs when higher.
+LOWER_IS_BETTER = ("_ms",)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds for a list of durations in seconds."""
+    samples = sorted(samples)
+    pct = lambda p: round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+    return {"n": len(samples), "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3)}
+
+
+def timed(fn: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def search_queries(data: Dataset) -> Dict[str, str]:
+    """One query per shape, built from the data set's vocabulary."""
+    vocab = data.vocabulary
+    common, medium, rare = vocab[0], vocab[len(vocab) // 20], vocab[-1]
+    typo = medium[:-1] + ("a" if medium[-1] != "a" else "e")
+    return {
+        "empty": "",
+        "common_word": common,
+        "medium_word": medium,
+        "rare_word": rare,
+        "two_words": f"{vocab[1]} {medium}",
+        "phrase": f'"{vocab[0]} {vocab[1]}"',
+        "tag": "tag:work",
+        "tag_and_word": f"tag:work {medium}",
+        "or_not": f"({common} OR {medium}) NOT {vocab[2]}",
+        "fuzzy": typo,
+    }
+
+
+def bench_search(conn: sqlite3.Connection, data: Dataset, repeat: int) -> Dict[str, Dict]:
+    results = {}
+    author = data.authors[0]
+    for name, q in search_queries(data).items():
+        fuzzy = name == "fuzzy"
+        search.query(conn, author, q, fuzzy=fuzzy)  # warm the page cache and term dictionary
+        results[f"search.{name}"] = summarize(timed(lambda: search.query(conn, author, q, fuzzy=fuzzy), repeat))
+    return results
+
+
+def bench_writes(conn: sqlite3.Connection, data: Dataset, count: int) -> Dict[str, Dict]:
+    rng = random.Random(data.spec.seed)
+    user = authorise.User(conn.execute("SELECT id FROM users WHERE username = ?", (data.authors[-1],)).fetchone()[0],
+                          data.authors[-1])
+    body = "<p>" + " ".join(rng.choices(data.vocabulary[:500], k=data.spec.body_words)) + "</p>"
+
+    created = []
+    start = time.perf_counter()
+    for i in range(count):
+        created.append(edit_particles.create_particle(conn, user, f"Benchmark note {i}", body, {"bench"}).id)
+    create_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, pid in enumerate(created):
+        edit_particles.update_particle_body(conn, user.username, pid, body + f"<p>edit {i}</p>")
+    update_s = time.perf_counter() - start
+    return {"create": {"n": count, "ops_per_s": round(count / create_s, 1)},
+            "update": {"n": count, "ops_per_s": round(count / update_s, 1)}}
+
+
+def bench_auth(conn: sqlite3.Connection, data: Dataset, repeat: int) -> Dict[str, Dict]:
+    author = data.authors[0]
+    login = timed(lambda: authorise.login(conn, author, PASSWORD), repeat)
+    session = authorise.login(conn, author, PASSWORD).session
+    whoami = timed(lambda: authorise.whoami(conn, session), repeat * 50)
+    return {"auth.login": summarize(login), "auth.whoami": summarize(whoami)}
+
+
+def bench_export(conn: sqlite3.Connection, data: Dataset, repeat: int) -> Dict[str, Dict]:
+    author = data.authors[0]
+
+    def export() -> str:
+        particles = storage.get_all_particles_by_author(conn, author)
+        return json.dumps([particle_dict(p) for p in particles], indent=2)
+
+    result = summarize(timed(export, repeat))
+    result["bytes"] = len(export())
+    return {"export": result}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(spec: DataSpec, repeat: int = 50, writes: int = 200) -> Dict:
+    """Runs every benchmark against a freshly generated database; returns the results document."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = storage.make_connection(path)
+        conn.execute("PRAGMA synchronous = OFF")  # generation only; measured connections use the defaults
+        start = time.perf_counter()
+        data = generate(conn, spec)
+        generate_s = time.perf_counter() - start
+        conn.close()
+
+        conn = storage.make_connection(path)
+        results = {}
+        results.update(bench_search(conn, data, repeat))
+        results.update(bench_export(conn, data, max(1, repeat // 10)))
+        results.update(bench_auth(conn, data, max(1, repeat // 10)))
+        results.update(bench_writes(conn, data, writes))
+        conn.close()
+        size = os.path.getsize(path)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "spec": spec._asdict(),
+            "database_bytes": size,
+            "generate_s": round(generate_s, 2),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Prints each metric's change against the baseline and returns the names
+    of metrics that got worse by more than `threshold` (a fraction).
+    """
+    regressions = []
+    for name, metrics in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        for key, value in metrics.items():
+            if key in ("n", "bytes") or not old.get(key):
+                continue
+            change = (value - old[key]) / old[key]
+            worse = change if key.endswith(LOWER_IS_BETTER) else -change
+            flag = "  REGRESSION" if worse > threshold else ""
+            print(f"{name + '.' + key:<32} {old[key]:>12} -> {value:>12} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{name}.{key}")
+    return regressions
+
+
+def main() -> None:
+    defaults = DataSpec()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--authors", type=int, default=defaults.authors)
+    parser.add_argument("--particles", type=int, default=defaults.particles_per_author, help="particles per author")
+    parser.add_argument("--body-words", type=int, default=defaults.body_words)
+    parser.add_argument("--vocabulary", type=int, default=defaults.vocabulary)
+    parser.add_argument("--zipf", type=float, default=defaults.zipf)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=50, help="samples per latency measurement")
+    parser.add_argument("--writes", type=int, default=200, help="particles created and updated")
+    parser.add_argument("--output", help="write the results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="an earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="regression threshold (fraction)")
+    args = parser.parse_args()
+
+    spec = DataSpec(authors=args.authors, particles_per_author=args.particles, body_words=args.body_words,
+                    vocabulary=args.vocabulary, zipf=args.zipf, seed=args.seed)
+    document = run(spec, args.repeat, args.writes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["spec"] != document["meta"]["spec"]:
+            print("warning: data specs differ; results are not directly comparable", file=sys.stderr)
+        regressions = compare(document, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+This module keeps images pasted into notes in a content-addressed blob store.
+
+The editor embeds pasted images in the body as base64 data URIs, so one
+screenshot can add megabytes to every read, search scan and export of its
+note. extract_images() moves each embedded image into a file named by the
+SHA-256 of its bytes, under BLOB_DIR/<first two hex digits>/, and rewrites
+the reference to /blobs/<sha256>.<ext>. The same image pasted twice, in one
+note or in many, is stored once.
+
+Blob URLs are capabilities: anyone holding the 256-bit hash can fetch the
+image, as the browser must to load an <img> without a session. Because a
+name can only ever refer to the same bytes, responses are cacheable forever.
+Blobs that no note references any more are not deleted.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+
+BLOB_DIR = "blobs"
+MIN_BYTES = 1024  # smaller images stay inline: a request costs more than they do
+
+# Raster formats only: an SVG served from this origin could run script.
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/webp": "webp"}
+MEDIA_TYPES = {ext: media_type for media_type, ext in EXTENSIONS.items()}
+
+_DATA_URI_RE = re.compile(
+    r'(?P<attr>\bsrc=")data:(?P<type>image/(?:png|jpeg|gif|webp));base64,(?P<data>[A-Za-z0-9+/=\s]+)"', re.I)
+_NAME_RE = re.compile(r"(?P<digest>[0-9a-f]{64})\.(?P<ext>png|jpg|gif|webp)")
+
+
+def path_for(name: str) -> Optional[str]:
+    """The file holding blob `name` (<sha256>.<ext>), or None if the name is malformed."""
+    m = _NAME_RE.fullmatch(name)
+    if not m:
+        return None
+    return os.path.join(BLOB_DIR, m["digest"][:2], name)
+
+
+def media_type(name: str) -> str:
+    return MEDIA_TYPES[name.rsplit(".", 1)[1]]
+
+
+def put(data: bytes, media_type: str) -> str:
+    """Stores data unless an identical blob exists, and returns its name."""
+    name = f"{hashlib.sha256(data).hexdigest()}.{EXTENSIONS[media_type]}"
+    path = path_for(name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name and renamed, so a reader never sees a partial blob.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return name
+
+
+def extract_images(body: str) -> str:
+    """The body with each embedded image of at least MIN_BYTES moved to the store and referenced by URL."""
+    if "data:image/" not in body:
+        return body
+
+    def replace(m: re.Match) -> str:
+        try:
+            data = base64.b64decode(m["data"], validate=False)
+        except (binascii.Error, ValueError):
+            return m.group(0)  # not valid base64: leave it as the editor sent it
+        if len(data) < MIN_BYTES:
+            return m.group(0)
+        return f'{m["attr"]}/blobs/{put(data, m["type"].lower())}"'
+
+    return _DATA_URI_RE.sub(replace, body)
@@ -0,0 +1,80 @@
+"""
+This module converts particle bodies between their stored and in-memory forms.
+
+A body is stored either as TEXT, exactly as written, or, when it is at
+least COMPRESS_MIN_BYTES of UTF-8 and compression saves at least
+MIN_SAVING of it, as a BLOB: one codec marker byte followed by the
+compressed UTF-8. zstd is used when the zstandard package is installed,
+zlib otherwise; the marker tells decode_body which one wrote a row, so
+databases stay readable whichever codecs are available later (except
+zstd rows without zstandard).
+
+Search never decodes bodies. It reads a plain-text rendering of the body
+(HTML tags removed, entities resolved) from its own column, which holds
+NULL when the plain text is the stored TEXT body itself.
+"""
+
+import html
+import re
+import zlib
+from typing import Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_MIN_BYTES = 1024
+MIN_SAVING = 0.2  # compress only if it shrinks the body by at least this fraction
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+ZLIB = 1
+ZSTD = 2
+
+_BLOCK_END_RE = re.compile(r"<br\s*/?>|</(?:p|div|li|h[1-6]|blockquote|pre|tr)>", re.I)
+_TAG_RE = re.compile(r"</?[a-zA-Z][^>]*>")
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return bytes([ZSTD]) + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return bytes([ZLIB]) + zlib.compress(data, ZLIB_LEVEL)
+
+
+def encode_body(body: str) -> Union[str, bytes]:
+    """The value to store for a body: the text itself, or a marked compressed BLOB."""
+    data = body.encode("utf-8")
+    if len(data) < COMPRESS_MIN_BYTES:
+        return body
+    packed = _compress(data)
+    if len(packed) > len(data) * (1 - MIN_SAVING):
+        return body
+    return packed
+
+
+def decode_body(stored: Union[str, bytes, None]) -> Optional[str]:
+    """The body for a stored value written by encode_body (or by code predating it)."""
+    if stored is None or isinstance(stored, str):
+        return stored
+    codec, data = stored[0], memoryview(stored)[1:]
+    if codec == ZLIB:
+        return zlib.decompress(data).decode("utf-8")
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This body is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown body codec {codec}")
+
+
+def plain_text(body: str) -> str:
+    """The text of an HTML (Quill) body: tags removed, block ends as newlines, entities resolved."""
+    if "<" not in body and "&" not in body:
+        return body
+    return html.unescape(_TAG_RE.sub("", _BLOCK_END_RE.sub("\n", body)))
+
+
+def search_text(body: str, stored: Union[str, bytes]) -> Optional[str]:
+    """The value of the body_text column: the plain text, or None if that is the stored value itself."""
+    text = plain_text(body)
+    return None if text == stored else text
@@ -0,0 +1,112 @@
+"""
+This module provides response compression for the web application.
+
+CompressionMiddleware compresses complete (non-streaming) responses whose
+content type is textual and whose body is at least `minimum_size` bytes,
+using brotli when the client accepts it and the `brotli` package is
+installed, and gzip otherwise. Streaming responses and responses that
+already carry a Content-Encoding (such as precompressed static assets) are
+passed through untouched.
+"""
+
+import gzip
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def _quality(params: List[str]) -> float:
+    """The q value among a coding's parameters: 1 if absent, 0 (refused) if malformed."""
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks 'br' or 'gzip' from an Accept-Encoding header, or None. Codings with q=0 are refused."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        if _quality(params) > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    """Compresses a body with the given content coding ('br' or 'gzip')."""
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing buffered textual responses above a size threshold."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message  # held until we know whether to compress
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            eligible = (
+                not message.get("more_body", False)
+                and "content-encoding" not in headers
+                and is_compressible(headers.get("content-type", ""))
+                and len(body) >= self.minimum_size
+            )
+            if eligible:
+                body = compress(body, encoding, self.gzip_level, self.brotli_quality)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            else:
+                passthrough = True  # streaming or ineligible: send everything as-is
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,20 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import ratelimit
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits():
+    """Each test starts with full token buckets, so the suite's many logins are not throttled."""
+    ratelimit.buckets.reset()
+    yield
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A test client for the app backed by a fresh database file."""
+    monkeypatch.setattr(api, "DB_PATH", str(tmp_path / "pim.db"))
+    with TestClient(api.app) as c:
+        yield c
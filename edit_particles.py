@@ -11,6 +11,8 @@ from typing import Set
 from pim_types import Particle, ParticleId
 import sqlite3
 import storage 
+import events
+import blobs
 from authorise import User 
 
 def new_uuid() -> str:
@@ -21,8 +23,7 @@ def now_iso() -> str:
     """Returns the current time in ISO 8601 format."""
     return datetime.now().isoformat()
 
-def normalize_title(title: str) -> str:
-    return " ".join(title.lower().split())
+normalize_title = storage.normalize_title
 
 
 def create_particle(conn: sqlite3.Connection, user: User, title: str, body: str, tags: Set[str]) -> Particle:
@@ -33,7 +34,8 @@ def create_particle(conn: sqlite3.Connection, user: User, title: str, body: str,
         conn: An active SQLite database connection.
         user: The authenticated User object creating the particle.
         title: The title for the new particle.
-        body: The body content for the new particle.
+        body: The body content for the new particle. Embedded images are moved
+            to the blob store (see blobs.extract_images).
         tags: A set of tags for the new particle.
 
     Raises:
@@ -46,21 +48,8 @@ def create_particle(conn: sqlite3.Connection, user: User, title: str, body: str,
     if not title.strip() or (not body.strip() and "<p><br></p>" not in body):
         raise ValueError("Title and body cannot be empty")
 
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM particles WHERE lower(title) = ? AND author = ?", (title.lower(), user.username))
-    if cur.fetchone():
-        raise ValueError("You already have a particle with this title")
-
-    # 1. Query for the highest current ID for this specific user.
-    cur.execute("SELECT MAX(user_facing_id) FROM particles WHERE author = ?", (user.username,))
-    
-    # 2. Fetch the result. Might be None if the user has no particles yet.
-    #    If it's None, we default to 0.
-    max_id = cur.fetchone()[0] or 0
-    
-    # 3. The next ID is the highest existing ID plus one.
-    next_id = max_id + 1
-
+    # The next ID is the highest existing ID plus one (1 for a user's first particle).
+    next_id = storage.max_user_facing_id(conn, user.username) + 1
 
     p = Particle(
         id=new_uuid(),
@@ -69,11 +58,12 @@ def create_particle(conn: sqlite3.Connection, user: User, title: str, body: str,
         created_at=now_iso(),
         updated_at=now_iso(),
         title=title,
-        body=body,
+        body=blobs.extract_images(body),
         tags=tags,
         author=user.username
     )
     storage.save_particle(conn, p)
+    events.publish("created", p.id, p.author, p.updated_at)
     return p
 
 
@@ -99,11 +89,6 @@ def update_particle_title(conn: sqlite3.Connection, current_user: str, pid: Part
     if not new_title.strip():
         raise ValueError("Title cannot be empty")
 
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM particles WHERE lower(title) = ? AND author = ? AND id != ?", (new_title.lower(), current_user, pid))
-    if cur.fetchone():
-        raise ValueError("You already have a particle with this title")
-
     particle = storage.get_particle(conn, pid)
     if not particle:
         raise KeyError("Particle not found")
@@ -116,6 +101,7 @@ def update_particle_title(conn: sqlite3.Connection, current_user: str, pid: Part
         updated_at=datetime.now().isoformat()
     )
     storage.save_particle(conn, updated)
+    events.publish("updated", updated.id, updated.author, updated.updated_at)
     return updated
 
 
@@ -127,7 +113,7 @@ def update_particle_body(conn: sqlite3.Connection, current_user: str, pid: Parti
         conn: An active SQLite database connection.
         current_user: The username of the user making the request.
         pid: The ID of the particle to update.
-        new_body: The new body content.
+        new_body: The new body content. Embedded images are moved to the blob store.
 
     Raises:
         ValueError: If the new body is empty.
@@ -149,10 +135,11 @@ def update_particle_body(conn: sqlite3.Connection, current_user: str, pid: Parti
         raise PermissionError("You do not have permission to modify this particle.")
 
     updated = particle._replace(
-        body=new_body,
+        body=blobs.extract_images(new_body),
         updated_at=datetime.now().isoformat()
     )
     storage.save_particle(conn, updated)
+    events.publish("updated", updated.id, updated.author, updated.updated_at)
     return updated
 
 
@@ -170,6 +157,7 @@ def add_tags(conn: sqlite3.Connection, current_user: str, pid: ParticleId, tags:
         updated_at=datetime.now().isoformat()
     )
     storage.save_particle(conn, updated)
+    events.publish("updated", updated.id, updated.author, updated.updated_at)
     return updated
 
 
@@ -187,6 +175,7 @@ def remove_tags(conn: sqlite3.Connection, current_user: str, pid: ParticleId, ta
         updated_at=datetime.now().isoformat()
     )
     storage.save_particle(conn, updated)
+    events.publish("updated", updated.id, updated.author, updated.updated_at)
     return updated
 
 
@@ -213,24 +202,22 @@ def delete_particle(conn: sqlite3.Connection, current_user: str, pid: ParticleId
     if particle.author != current_user:
         raise PermissionError("You do not have permission to delete this particle.")
 
-    return storage.delete_particle(conn, pid)
+    deleted = storage.delete_particle(conn, pid)
+    if deleted:
+        events.publish("deleted", pid, current_user, now_iso())
+    return deleted
 
 def update_particle(conn, author: str, pid: str, new_title: str, new_body: str):
     """Updates the title and body of a particle if the author matches."""
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        UPDATE particles
-        SET title = ?, body = ?, updated_at = datetime('now')
-        WHERE id = ? AND author = ?
-        """,
-        (new_title, new_body, pid, author)
+    particle = storage.get_particle(conn, pid)
+    if particle is None or particle.author != author:
+        return None  # Indicates that no particle was updated
+
+    updated = particle._replace(
+        title=new_title,
+        body=blobs.extract_images(new_body),
+        updated_at=now_iso()
     )
-    conn.commit()
-    
-    if cursor.rowcount == 0:
-        return None  # Indicates that no row was updated
-    
-    # Return the updated particle
-    from storage import get_particle
-    return get_particle(conn, pid)
+    storage.save_particle(conn, updated)
+    events.publish("updated", updated.id, updated.author, updated.updated_at)
+    return updated
@@ -0,0 +1,159 @@
+"""
+This module is an in-process publish/subscribe hub for particle change events.
+
+The write paths in edit_particles publish a ChangeEvent after every create,
+update and delete; the /events endpoint subscribes per author and streams
+them to the browser as server-sent events.
+
+Publishing happens on worker threads and never blocks: every subscriber has
+a bounded buffer, and a subscriber that falls behind has its buffer dropped
+and receives a single RESYNC marker instead, telling the client to reload
+rather than letting a slow reader grow memory without bound.
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Set, Union
+
+DEFAULT_BUFFER_SIZE = 256
+HEARTBEAT_SECONDS = 15.0
+
+
+class ChangeEvent(NamedTuple):
+    kind: str  # "created", "updated" or "deleted"
+    id: str
+    author: str
+    version: str  # the particle's updated_at after the change
+
+
+class _Resync(NamedTuple):
+    """Marker delivered in place of events that were dropped on overflow."""
+
+
+RESYNC = _Resync()
+
+
+class Subscription:
+    """One subscriber's bounded event buffer. Consumed from the event loop it was created on."""
+
+    def __init__(self, broker: "Broker", author: str, maxsize: int, loop: asyncio.AbstractEventLoop):
+        self.broker = broker
+        self.author = author
+        self.maxsize = maxsize
+        self.dropped = 0  # events discarded because the buffer was full
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._buffer: deque = deque()
+        self._overflowed = False
+        self._ready = asyncio.Event()
+
+    def push(self, event: ChangeEvent) -> None:
+        """Adds an event without blocking; called from any thread."""
+        with self._lock:
+            if self._overflowed:
+                self.dropped += 1
+                return
+            if len(self._buffer) >= self.maxsize:
+                self.dropped += len(self._buffer) + 1
+                self._buffer.clear()
+                self._overflowed = True
+            else:
+                self._buffer.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:  # loop already closed: the subscriber is gone
+            pass
+
+    def drain(self) -> List[Union[ChangeEvent, _Resync]]:
+        """Takes everything buffered; a RESYNC first if events were dropped."""
+        with self._lock:
+            items: List[Union[ChangeEvent, _Resync]] = [RESYNC] if self._overflowed else []
+            items.extend(self._buffer)
+            self._buffer.clear()
+            self._overflowed = False
+            self._ready.clear()
+        return items
+
+    async def get(self, timeout: Optional[float] = None) -> List[Union[ChangeEvent, _Resync]]:
+        """Waits up to `timeout` seconds for events; returns [] on timeout."""
+        items = self.drain()
+        if items:
+            return items
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return self.drain()
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Routes published events to the subscriptions of the event's author."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, author: str, maxsize: int = DEFAULT_BUFFER_SIZE) -> Subscription:
+        """Subscribes to an author's events; must be called from a running event loop."""
+        sub = Subscription(self, author, maxsize, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(author, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.author)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.author]
+
+    def publish(self, event: ChangeEvent) -> None:
+        with self._lock:
+            subs = list(self._subscribers.get(event.author, ()))
+        for sub in subs:
+            sub.push(event)
+
+    def subscriber_count(self, author: Optional[str] = None) -> int:
+        with self._lock:
+            if author is not None:
+                return len(self._subscribers.get(author, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+
+broker = Broker()
+
+
+def publish(kind: str, pid: str, author: str, version: str) -> None:
+    """Publishes a change to the process-wide broker."""
+    broker.publish(ChangeEvent(kind, pid, author, version))
+
+
+def format_sse(item: Union[ChangeEvent, _Resync]) -> str:
+    """Encodes an event (or the RESYNC marker) as a server-sent event frame."""
+    if item is RESYNC:
+        return "event: resync\ndata: {}\n\n"
+    data = json.dumps({"id": item.id, "version": item.version}, separators=(",", ":"))
+    return f"event: {item.kind}\ndata: {data}\n\n"
+
+
+async def event_stream(sub: Subscription, is_disconnected, heartbeat: float = HEARTBEAT_SECONDS):
+    """
+    Yields SSE frames for a subscription until the client disconnects,
+    sending a comment line as a heartbeat when idle. Unsubscribes on exit.
+    """
+    try:
+        yield "retry: 3000\n\n"
+        while not await is_disconnected():
+            items = await sub.get(timeout=heartbeat)
+            if not items:
+                yield ": keep-alive\n\n"
+            for item in items:
+                yield format_sse(item)
+    finally:
+        sub.close()
@@ -0,0 +1,265 @@
+"""
+This module provides typo-tolerant term matching for search.
+
+It keeps a per-author dictionary of the distinct words in that author's
+particles and finds dictionary terms within a small edit distance of a query
+word using a symmetric-delete index, so a lookup only touches terms that share
+a deletion variant with the query instead of comparing against every term.
+
+Dictionaries are kept up to date from the sync change log: each one
+remembers the log position it reflects and the terms every particle added,
+so a write costs re-indexing that one particle instead of a rebuild. A
+lookup spends at most UPDATE_BUDGET seconds catching up and otherwise uses
+the dictionary as far as it got, finishing on later lookups, so even the
+first build of a large dictionary never stalls a search. At most
+MAX_CACHED dictionaries are kept, least recently used dropped first.
+"""
+
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+import metrics
+import storage
+from codec import plain_text
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7  # deletes are only generated for the first N characters
+MAX_EXPANSIONS = 8  # fuzzy variants kept per query word
+MAX_CACHED = 32  # (database, author) dictionaries kept in memory
+UPDATE_BUDGET = 0.05  # seconds a lookup may spend applying changes to a dictionary
+_CHANGES_PAGE = 100
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases text, drops HTML tags and returns its alphanumeric words."""
+    return _WORD_RE.findall(_TAG_RE.sub(" ", text).lower())
+
+
+def distance_for(term: str) -> int:
+    """The edit distance tolerated for a word of this length (short words must match exactly)."""
+    if len(term) <= 3:
+        return 0
+    if len(term) <= 7:
+        return 1
+    return MAX_DISTANCE
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance between a and b (Levenshtein plus
+    adjacent transpositions), bounded by max_distance.
+
+    Returns max_distance + 1 as soon as the distance is known to exceed the
+    bound, so callers only pay for the rows they need.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if a == b:
+        return 0
+
+    prev_prev: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, prev_prev[j - 2] + 1)
+            cur[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return max_distance + 1
+        prev_prev, prev = prev, cur
+    return min(prev[-1], max_distance + 1)
+
+
+def _deletes(word: str, max_distance: int) -> Set[str]:
+    """All strings obtained by deleting up to max_distance characters from word."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+class TermDictionary:
+    """
+    A symmetric-delete index over a set of terms.
+
+    Every term is registered under each variant of its prefix with up to
+    max_distance characters deleted. A lookup generates the same variants for
+    the query word; any term within the edit distance shares at least one
+    variant with it, so only those candidates are verified.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, prefix_length: int = PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.counts: Dict[str, int] = {}  # term -> number of occurrences (particles containing it, in term_dictionary)
+        self._index: Dict[str, List[str]] = {}  # delete variant -> terms
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.counts
+
+    def remove(self, term: str, count: int = 1) -> None:
+        """Removes occurrences of a term, dropping it from the index once none are left."""
+        left = self.counts.get(term, 0) - count
+        if left > 0:
+            self.counts[term] = left
+            return
+        if self.counts.pop(term, None) is None:
+            return
+        for variant in _deletes(term[:self.prefix_length], self.max_distance):
+            terms = self._index[variant]
+            terms.remove(term)
+            if not terms:
+                del self._index[variant]
+
+    def add(self, term: str, count: int = 1) -> None:
+        """Adds a term (or more occurrences of an existing one) to the dictionary."""
+        if term in self.counts:
+            self.counts[term] += count
+            return
+        self.counts[term] = count
+        for variant in _deletes(term[:self.prefix_length], self.max_distance):
+            self._index.setdefault(variant, []).append(term)
+
+    def lookup(self, word: str, max_distance: int = None) -> List[Tuple[str, int]]:
+        """
+        Finds dictionary terms within max_distance edits of word.
+
+        Returns:
+            (term, distance) pairs ordered by distance, then by how common the
+            term is, then alphabetically.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        max_distance = min(max_distance, self.max_distance)
+
+        seen: Set[str] = set()
+        found: List[Tuple[str, int]] = []
+        for variant in _deletes(word[:self.prefix_length], max_distance):
+            for term in self._index.get(variant, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = edit_distance(word, term, max_distance)
+                if distance <= max_distance:
+                    found.append((term, distance))
+
+        # .get: a concurrent catch-up may have removed a term since it was found.
+        found.sort(key=lambda item: (item[1], -self.counts.get(item[0], 0), item[0]))
+        return found
+
+
+class _Entry:
+    """An author's dictionary, the terms each particle added to it and the change log position it reflects."""
+
+    def __init__(self):
+        self.dictionary = TermDictionary()
+        self.terms: Dict[str, FrozenSet[str]] = {}  # particle id -> its distinct terms
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def catch_up(self, conn: sqlite3.Connection, author: str, deadline: float) -> bool:
+        """
+        Applies the author's changes after self.seq, in log order, until there
+        are none left or the deadline has passed. Returns whether any were applied.
+        """
+        applied = False
+        while True:
+            changes, has_more = storage.get_changes(conn, author, self.seq, _CHANGES_PAGE)
+            for change in changes:
+                for term in self.terms.pop(change.particle_id, ()):
+                    self.dictionary.remove(term)
+                if not change.deleted:
+                    p = change.particle
+                    terms = frozenset(tokenize(p.title) + tokenize(plain_text(p.body)))
+                    for term in terms:
+                        self.dictionary.add(term)
+                    self.terms[p.id] = terms
+                self.seq = change.seq
+                applied = True
+                if time.perf_counter() > deadline:
+                    return True
+            if not has_more:
+                return applied
+
+
+# (database path, author) -> entry, least recently used first
+_cache: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _database_path(conn: sqlite3.Connection) -> str:
+    """The file backing the connection's main database ('' for in-memory databases), or the backend's location."""
+    if not isinstance(conn, sqlite3.Connection):
+        return conn.location()
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path or ""
+    return ""
+
+
+def build_term_dictionary(conn: sqlite3.Connection, author: str) -> TermDictionary:
+    """
+    Builds a term dictionary from all of an author's titles and bodies.
+    A term's count is the number of particles it occurs in.
+    """
+    entry = _Entry()
+    entry.catch_up(conn, author, math.inf)
+    return entry.dictionary
+
+
+def term_dictionary(conn: sqlite3.Connection, author: str, budget: float = UPDATE_BUDGET) -> TermDictionary:
+    """
+    Returns the author's term dictionary after applying the changes made
+    since it was last used, for up to `budget` seconds (see the module docstring).
+
+    Dictionaries for in-memory databases are built in full and not cached,
+    since those databases cannot be told apart once their connection is gone.
+    """
+    path = _database_path(conn)
+    if not path:
+        return build_term_dictionary(conn, author)
+
+    key = (path, author)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            entry = _cache[key] = _Entry()
+            while len(_cache) > MAX_CACHED:
+                _cache.popitem(last=False)
+        else:
+            _cache.move_to_end(key)
+    # Lookups read the dictionary without this lock; TermDictionary.lookup tolerates terms vanishing.
+    with entry.lock:
+        applied = entry.catch_up(conn, author, time.perf_counter() + budget)
+    metrics.observe_cache("term_dictionary", hit=not applied)
+    return entry.dictionary
+
+
+def expand(dictionary: TermDictionary, word: str) -> List[str]:
+    """
+    Returns the dictionary terms a query word may have been a typo of, nearest
+    first, excluding the word itself and capped at MAX_EXPANSIONS.
+    """
+    distance = distance_for(word)
+    if not distance:
+        return []
+    return [term for term, _ in dictionary.lookup(word, distance) if term != word][:MAX_EXPANSIONS]
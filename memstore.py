@@ -0,0 +1,444 @@
+"""
+This module implements an in-memory storage backend (see backend.Backend).
+
+MemoryStore holds all users, sessions and particles in process memory with
+the indexes the SQLite schema has: each author's particles ordered by
+creation time and by user-facing id, an (author, normalized title) index
+that keeps titles unique, an (author, tag) index and the sync change log.
+A particle's plain text and snippet are computed once, when it is saved, so
+listings and searches never parse HTML or decompress anything, and no read
+does I/O.
+
+Durability comes from a snapshot plus an append-only journal. A write is
+validated, appended to <path>.journal as one JSON line and only then
+applied. Every SNAPSHOT_EVERY writes, and on close(), the whole state is
+written to <path> under a temporary name and renamed over it, and the
+journal is emptied. Opening a store loads the snapshot and replays the
+journal records numbered after it. A record counts once its newline is
+written, so the torn last line a crash can leave is dropped. Journal
+writes are flushed to the OS, which survives the process crashing; set
+FSYNC to also survive power loss, at the cost of a disk sync per write.
+
+A store belongs to one process: two processes opening the same path would
+overwrite each other's snapshots.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+import codec
+from backend import CandidateRow
+from pim_types import Change, Particle, ParticleId, ParticleSummary
+from query_language import And, DateFilter, Node, Not, QueryPlan, TagFilter, Term, date_bounds, describe, matches
+from storage import DuplicateTitleError, body_snippet, decode_tags, normalize_title
+
+SNAPSHOT_EVERY = 10_000  # journal records between snapshots
+FSYNC = False
+_BUDGET_CHECK_EVERY = 256  # candidates scanned between time budget checks
+
+
+class _Record(NamedTuple):
+    """A stored particle with what search and listings need, computed when it is saved."""
+    particle: Particle
+    text: str  # plain text of the body (codec.plain_text)
+    title_lower: str
+    text_lower: str
+    tags_lower: FrozenSet[str]
+    snippet: str
+
+
+def _record(p: Particle) -> _Record:
+    text = codec.plain_text(p.body)
+    return _Record(p, text, p.title.lower(), text.lower(), frozenset(t.lower() for t in p.tags),
+                   body_snippet(text))
+
+
+def _dump(p: Particle) -> list:
+    return [p.id, p.user_id, p.user_facing_id, p.title, p.body, p.author, sorted(p.tags), p.created_at, p.updated_at]
+
+
+def _load(row: list) -> Particle:
+    # Tags go through the same encoding as a SQLite row, so both backends return equal particles.
+    return Particle(*row[:6], decode_tags(",".join(row[6])), row[7], row[8])
+
+
+class MemoryStore:
+    """
+    The in-memory backend. Thread-safe: every public method holds a lock,
+    except that a search holds it only to copy its candidate ids. Records
+    are immutable and looking one up is a single dict.get, so they are
+    scored without it.
+
+    Args:
+        path: The snapshot file, with the journal next to it, or None for a
+            store that lives and dies with the process.
+        snapshot_every: Journal records between snapshots.
+    """
+
+    def __init__(self, path: Optional[str] = None, snapshot_every: int = SNAPSHOT_EVERY):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        self._users: Dict[str, Tuple[int, str]] = {}  # username -> (id, password hash)
+        self._sessions: Dict[str, str] = {}  # token -> username
+        self._records: Dict[ParticleId, _Record] = {}
+        self._by_created: Dict[str, List[Tuple[str, ParticleId]]] = {}  # author -> sorted (created_at, id)
+        self._by_number: Dict[str, List[Tuple[int, ParticleId]]] = {}  # author -> sorted (user_facing_id, id)
+        self._titles: Dict[Tuple[str, str], ParticleId] = {}  # (author, normalized title) -> id
+        self._tags: Dict[Tuple[str, str], Set[ParticleId]] = {}  # (author, lowercased tag) -> ids
+        # author -> id -> (seq, deleted), in seq order: an entry moves to the end when it changes.
+        self._changes: Dict[str, Dict[ParticleId, Tuple[int, bool]]] = {}
+        self._seq = 0
+        self._ops = 0  # number of the last journal record written or replayed
+        self._snapshot_ops = 0  # the same, as of the snapshot on disk
+        self._journal = None
+        if path:
+            self._open()
+
+    # Users and sessions
+
+    def add_user(self, username: str, password_hash: str) -> bool:
+        with self._lock:
+            if username in self._users:
+                return False
+            self._write("add_user", username, password_hash)
+            return True
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        with self._lock:
+            user = self._users.get(username)
+            return user[1] if user else None
+
+    def add_session(self, token: str, username: str) -> None:
+        with self._lock:
+            self._write("add_session", token, username)
+
+    def delete_session(self, token: str) -> bool:
+        with self._lock:
+            if token not in self._sessions:
+                return False
+            self._write("delete_session", token)
+            return True
+
+    def get_session_user(self, token: str) -> Optional[Tuple[int, str]]:
+        with self._lock:
+            username = self._sessions.get(token)
+            user = self._users.get(username) if username is not None else None
+            return (user[0], username) if user else None
+
+    # Particles
+
+    def save_particle(self, p: Particle) -> None:
+        """
+        Insert or update a particle. As in SQLite, an update changes only the
+        title, body, tags and updated_at.
+
+        Raises:
+            DuplicateTitleError: If another of the author's particles has the same normalized title.
+        """
+        with self._lock:
+            existing = self._records.get(p.id)
+            if existing is not None:
+                p = existing.particle._replace(title=p.title, body=p.body, tags=p.tags, updated_at=p.updated_at)
+            elif self._number_taken(p.author, p.user_facing_id):
+                raise ValueError(f"{p.author} already has a particle numbered {p.user_facing_id}")
+            if self._titles.get((p.author, normalize_title(p.title)), p.id) != p.id:
+                raise DuplicateTitleError("You already have a particle with this title")
+            self._write("save_particle", _dump(p))
+
+    def delete_particle(self, pid: ParticleId) -> bool:
+        with self._lock:
+            if pid not in self._records:
+                return False
+            self._write("delete_particle", pid)
+            return True
+
+    def get_particle(self, pid: ParticleId) -> Optional[Particle]:
+        with self._lock:
+            record = self._records.get(pid)
+            return record.particle if record else None
+
+    def get_particles(self, pids: List[ParticleId]) -> Dict[ParticleId, Particle]:
+        with self._lock:
+            found = {}
+            for pid in pids:
+                record = self._records.get(pid)
+                if record is not None:
+                    found[pid] = record.particle
+            return found
+
+    def get_particle_by_title(self, author: str, title: str) -> Optional[Particle]:
+        with self._lock:
+            pid = self._titles.get((author, normalize_title(title)))
+            return self._records[pid].particle if pid is not None else None
+
+    def list_particles(self, author: str, limit: int) -> List[ParticleSummary]:
+        with self._lock:
+            summaries = []
+            for number, pid in islice(reversed(self._by_number.get(author, ())), limit):
+                r = self._records[pid]
+                summaries.append(ParticleSummary(pid, number, r.particle.created_at, r.particle.title, r.snippet))
+            return summaries
+
+    def get_all_particles_by_author(self, author: str) -> List[Particle]:
+        with self._lock:
+            return [self._records[pid].particle for _, pid in reversed(self._by_created.get(author, ()))]
+
+    def max_user_facing_id(self, author: str) -> int:
+        with self._lock:
+            numbers = self._by_number.get(author)
+            return numbers[-1][0] if numbers else 0
+
+    def get_changes(self, author: str, since: int, limit: int) -> Tuple[List[Change], bool]:
+        with self._lock:
+            newer = []  # walked back from the newest change, so only changes after `since` are visited
+            for pid, (seq, deleted) in reversed(self._changes.get(author, {}).items()):
+                if seq <= since:
+                    break
+                newer.append((seq, pid, deleted))
+            newer.reverse()
+            changes = [Change(seq, pid, deleted, None if deleted else self._records[pid].particle)
+                       for seq, pid, deleted in newer[:limit]]
+            return changes, len(newer) > limit
+
+    # Search
+
+    def search_candidates(self, author: str, plan: QueryPlan, variants: Dict[str, List[str]],
+                          budget: float) -> Tuple[List[CandidateRow], bool]:
+        """
+        The author's particles matching the plan, newest first. Candidates
+        come from the tag index when the query requires a tag, else from the
+        created_at order narrowed by any created: range, and each is checked
+        with query_language.matches. Stops after `budget` seconds.
+        """
+        deadline = time.perf_counter() + budget
+        with self._lock:
+            candidates, _ = self._candidates(author, plan.root)
+        records = self._records
+        rows: List[CandidateRow] = []
+        for i, pid in enumerate(candidates):
+            if i % _BUDGET_CHECK_EVERY == 0 and time.perf_counter() > deadline:
+                return rows, True
+            r = records.get(pid)
+            if r is None:
+                continue  # deleted since the candidates were taken
+            p = r.particle
+            if matches(plan.root, r.title_lower, r.text_lower, r.tags_lower,
+                       {"created_at": p.created_at, "updated_at": p.updated_at}, variants):
+                rows.append((pid, p.user_facing_id, p.title, r.text, p.created_at))
+        return rows, False
+
+    def explain(self, author: str, plan: QueryPlan, variants: Dict[str, List[str]]) -> List[str]:
+        """Describes the plan like query_language.explain, with match counts from a scan of the author's particles."""
+        with self._lock:
+            records = [self._records[pid] for _, pid in self._by_created.get(author, ())]
+            candidates, source = self._candidates(author, plan.root)
+        lines = ["plan:"]
+        conjuncts = plan.root.children if isinstance(plan.root, And) else (plan.root,)
+        for i, node in enumerate(conjuncts, 1):
+            start = time.perf_counter()
+            count = sum(1 for r in records if matches(
+                node, r.title_lower, r.text_lower, r.tags_lower,
+                {"created_at": r.particle.created_at, "updated_at": r.particle.updated_at}, variants))
+            elapsed = (time.perf_counter() - start) * 1000
+            lines.append(f"  {i}. {describe(node):<30} {_access_path(node):<36} matches={count} time={elapsed:.2f}ms")
+        lines.append(f"memory: {len(candidates)} of {len(records)} particles checked, from {source}")
+        return lines
+
+    def _candidates(self, author: str, root: Node) -> Tuple[List[ParticleId], str]:
+        """Ids of the particles that may match, newest first, and where they came from. Call with the lock held."""
+        conjuncts = root.children if isinstance(root, And) else (root,)
+        tags = [c.tag for c in conjuncts if isinstance(c, TagFilter)]
+        if tags:
+            sets = sorted((self._tags.get((author, tag), set()) for tag in tags), key=len)
+            pids = set(sets[0]).intersection(*sets[1:])
+            ordered = sorted(pids, key=lambda pid: self._records[pid].particle.created_at or "", reverse=True)
+            return ordered, "the tag index"
+        order = self._by_created.get(author, [])
+        lo, hi = 0, len(order)
+        for c in conjuncts:
+            if isinstance(c, DateFilter) and c.column == "created_at":
+                for op, bound in date_bounds(c):
+                    if op == ">=":
+                        lo = max(lo, bisect_left(order, (bound,)))
+                    elif op == ">":
+                        lo = max(lo, bisect_right(order, (bound, "\uffff")))
+                    else:  # "<"
+                        hi = min(hi, bisect_left(order, (bound,)))
+        source = "the created_at order" if (lo, hi) == (0, len(order)) else "a created_at range"
+        return [pid for _, pid in reversed(order[lo:hi])], source
+
+    # Writes: validated by the public methods above, then journaled, then applied
+
+    def _write(self, op: str, *args) -> None:
+        """Journals an operation and applies it. Call with the lock held."""
+        n = self._ops + 1
+        if self._journal is not None:
+            self._journal.write(json.dumps({"n": n, "op": op, "args": args}) + "\n")
+            self._journal.flush()
+            if FSYNC:
+                os.fsync(self._journal.fileno())
+        self._apply(op, args)
+        self._ops = n
+        if self._journal is not None and self._ops - self._snapshot_ops >= self.snapshot_every:
+            self.snapshot()
+
+    def _apply(self, op: str, args) -> None:
+        getattr(self, "_apply_" + op)(*args)
+
+    def _apply_add_user(self, username: str, password_hash: str) -> None:
+        self._users[username] = (len(self._users) + 1, password_hash)
+
+    def _apply_add_session(self, token: str, username: str) -> None:
+        self._sessions[token] = username
+
+    def _apply_delete_session(self, token: str) -> None:
+        self._sessions.pop(token, None)
+
+    def _apply_save_particle(self, row: list) -> None:
+        p = _load(row)
+        old = self._records.get(p.id)
+        if old is not None:
+            self._unindex(old)
+        self._index(_record(p))
+        self._log_change(p.author, p.id, False)
+
+    def _apply_delete_particle(self, pid: ParticleId) -> None:
+        record = self._records.get(pid)
+        if record is not None:
+            self._unindex(record)
+            self._log_change(record.particle.author, pid, True)
+
+    def _index(self, r: _Record) -> None:
+        p = r.particle
+        self._records[p.id] = r
+        insort(self._by_created.setdefault(p.author, []), (p.created_at or "", p.id))
+        insort(self._by_number.setdefault(p.author, []), (p.user_facing_id, p.id))
+        self._titles[(p.author, normalize_title(p.title))] = p.id
+        for tag in r.tags_lower:
+            self._tags.setdefault((p.author, tag), set()).add(p.id)
+
+    def _unindex(self, r: _Record) -> None:
+        p = r.particle
+        del self._records[p.id]
+        for index, key in ((self._by_created, (p.created_at or "", p.id)), (self._by_number, (p.user_facing_id, p.id))):
+            entries = index[p.author]
+            del entries[bisect_left(entries, key)]
+        del self._titles[(p.author, normalize_title(p.title))]
+        for tag in r.tags_lower:
+            self._tags[(p.author, tag)].discard(p.id)
+
+    def _number_taken(self, author: str, number: int) -> bool:
+        numbers = self._by_number.get(author, [])
+        i = bisect_left(numbers, (number,))
+        return i < len(numbers) and numbers[i][0] == number
+
+    def _log_change(self, author: str, pid: ParticleId, deleted: bool) -> None:
+        self._seq += 1
+        log = self._changes.setdefault(author, {})
+        log.pop(pid, None)
+        log[pid] = (self._seq, deleted)
+
+    # Persistence
+
+    def _journal_path(self) -> str:
+        return self.path + ".journal"
+
+    def _open(self) -> None:
+        """Loads the snapshot, replays the journal after it and opens the journal for appending."""
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self._seq = state["seq"]
+            self._users = {name: (uid, pw) for name, uid, pw in state["users"]}
+            self._sessions = state["sessions"]
+            for row in state["particles"]:
+                self._index(_record(_load(row)))
+            self._changes = {author: {pid: (seq, deleted) for pid, seq, deleted in log}
+                             for author, log in state["changes"].items()}
+            self._ops = self._snapshot_ops = state["n"]
+
+        path = self._journal_path()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            good = 0  # bytes of complete records
+            for line in data.splitlines(keepends=True):
+                if not line.endswith(b"\n"):
+                    break  # torn: the process died mid-write
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if good + len(line) < len(data):
+                        raise ValueError(f"{path}: corrupt record at byte {good}") from None
+                    break  # a torn last line the file system padded out
+                if record["n"] > self._ops:  # older records are already in the snapshot
+                    self._apply(record["op"], record["args"])
+                    self._ops = record["n"]
+                good += len(line)
+            if good < len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+        self._journal = open(path, "a", encoding="utf-8")
+
+    def snapshot(self) -> None:
+        """Writes the whole state to `path` and empties the journal."""
+        with self._lock:
+            if not self.path:
+                return
+            state = {
+                "n": self._ops,
+                "seq": self._seq,
+                "users": [[name, uid, pw] for name, (uid, pw) in self._users.items()],
+                "sessions": self._sessions,
+                "particles": [_dump(r.particle) for r in self._records.values()],
+                "changes": {author: [[pid, seq, deleted] for pid, (seq, deleted) in log.items()]
+                            for author, log in self._changes.items()},
+            }
+            # Written under a temporary name and renamed, so a crash leaves the old snapshot or the new one.
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self._snapshot_ops = self._ops
+            if self._journal is not None:
+                # A crash before this leaves records the snapshot already has; replay skips them by number.
+                self._journal.close()
+                self._journal = open(self._journal_path(), "w", encoding="utf-8")
+
+    def location(self) -> str:
+        return os.path.abspath(self.path) if self.path else ""
+
+    def close(self) -> None:
+        """Snapshots any journaled writes and closes the journal. The store must not be used afterwards."""
+        with self._lock:
+            if self._journal is None:
+                return
+            if self._ops > self._snapshot_ops:
+                self.snapshot()
+            self._journal.close()
+            self._journal = None
+
+
+def _access_path(node: Node) -> str:
+    if isinstance(node, TagFilter):
+        return "index (author, tag)"
+    if isinstance(node, DateFilter):
+        return "created_at order" if node.column == "created_at" else "filter on updated_at"
+    if isinstance(node, Term):
+        return "scan of title" if node.field == "title" else "scan of title and text"
+    if isinstance(node, Not):
+        return "filter (negation)"
+    return "filter (" + ("AND" if isinstance(node, And) else "OR") + " group)"
@@ -0,0 +1,256 @@
+"""
+This module collects operational metrics and renders them in the Prometheus
+text exposition format for the /metrics endpoint.
+
+Metrics are plain in-process objects: a Counter or Histogram update is a
+lock-protected add on a small dict, cheap enough for the request path.
+Values that are expensive to compute (table sizes) or kept elsewhere
+(functools cache statistics) are gathered only when /metrics is scraped,
+by collectors registered with add_collector().
+"""
+
+import bisect
+import functools
+import sqlite3
+import threading
+import time
+import urllib.parse
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import profiling
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 20, 50, 100, 250, 500, 1000, 5000)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]  # (metric name, labels, value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Labels, List[float]] = {}  # labels -> per-bucket counts + [+Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def count(self, *labels: str) -> int:
+        counts = self._values.get(labels)
+        return int(sum(counts[:-1])) if counts else 0
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in items:
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0.0
+            for bound, n in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                yield f"{self.name}_bucket", {**base, "le": le}, cumulative
+            yield f"{self.name}_sum", base, counts[-1]
+            yield f"{self.name}_count", base, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Iterable[Sample]]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Iterable[Sample]]]]) -> None:
+        """Adds a function yielding (name, kind, help, samples) families at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        families = [(m.name, m.kind, m.help, m.samples()) for m in self._metrics]
+        for collector in self._collectors:
+            families.extend(collector())
+        lines = []
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{sample}{_format_labels(labels)} {_format_value(value)}" for sample, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "pim_http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status")))
+HTTP_DURATION = registry.register(Histogram(
+    "pim_http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route")))
+DB_CONNECT = registry.register(Histogram(
+    "pim_db_connect_duration_seconds", "Time to open a request's database connection."))
+DB_SQL = registry.register(Histogram(
+    "pim_db_request_sql_seconds", "SQL execute and fetch time per request.", ("route",)))
+DB_QUERIES = registry.register(Counter(
+    "pim_db_queries_total", "Statements executed through request cursors."))
+DB_ROWS = registry.register(Counter(
+    "pim_db_rows_fetched_total", "Rows fetched by request cursors."))
+SEARCH_CANDIDATES = registry.register(Histogram(
+    "pim_search_candidates", "Candidate rows returned by SQL per search.", buckets=COUNT_BUCKETS))
+SEARCH_RESULTS = registry.register(Histogram(
+    "pim_search_results", "Hits returned per search.", buckets=COUNT_BUCKETS))
+BCRYPT = registry.register(Histogram(
+    "pim_bcrypt_seconds", "Time spent hashing or verifying a password.", ("operation",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0, 2.0)))
+CACHE_LOOKUPS = registry.register(Counter(
+    "pim_cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result")))
+
+
+def lru_cache_collector(name: str, cached_function) -> Callable:
+    """A collector reporting a functools.lru_cache's hits, misses and size as pim_lru_cache_* families."""
+    def collect():
+        info = cached_function.cache_info()
+        labels = {"cache": name}
+        yield ("pim_lru_cache_hits_total", "counter", "functools cache hits.", [("pim_lru_cache_hits_total", labels, info.hits)])
+        yield ("pim_lru_cache_misses_total", "counter", "functools cache misses.",
+               [("pim_lru_cache_misses_total", labels, info.misses)])
+        yield ("pim_lru_cache_entries", "gauge", "Entries held by a functools cache.",
+               [("pim_lru_cache_entries", labels, info.currsize)])
+    return collect
+
+
+def table_size_collector(db_path: Callable[[], Optional[str]],
+                         tables: Sequence[str] = ("particles", "users", "sessions")) -> Callable:
+    """
+    A collector reporting row counts of `tables` in the database at db_path()
+    as pim_table_rows. The file is opened read-only, so a scrape never creates
+    it; nothing is reported while it is missing or db_path() returns None.
+    """
+    def collect():
+        samples = []
+        path = db_path()
+        if path:
+            try:
+                conn = sqlite3.connect(f"file:{urllib.parse.quote(path)}?mode=ro", uri=True)
+            except sqlite3.OperationalError:  # database not created yet
+                conn = None
+            if conn is not None:
+                try:
+                    samples = [("pim_table_rows", {"table": t},
+                                conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]) for t in tables]
+                except sqlite3.OperationalError:  # schema not created yet
+                    samples = []
+                finally:
+                    conn.close()
+        yield "pim_table_rows", "gauge", "Rows per table, counted at scrape time.", samples
+    return collect
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them per route template
+    (e.g. /particles/{pid}), plus the connect and SQL totals of the request
+    profile. Must run inside ProfilingMiddleware to see those.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_DURATION.observe(time.perf_counter() - start, method, route)
+            profile = profiling.current_profile()
+            if profile is not None:
+                if "connect" in profile.phases:
+                    DB_CONNECT.observe(profile.phases["connect"])
+                if profile.queries:
+                    DB_SQL.observe(profile.sql_seconds, route)
+                    DB_QUERIES.inc(amount=profile.queries)
+                    DB_ROWS.inc(amount=profile.rows)
+
+
+def render() -> str:
+    return registry.render()
+
+
+def time_histogram(histogram: Histogram, *labels: str):
+    """Decorator observing the wall time of each call in a histogram."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorate
+
+
+def observe_cache(name: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(name, "hit" if hit else "miss")
@@ -3,7 +3,7 @@ pim_types defines the core data structures used throughout the PIM application,
 using NamedTuple allows for creating immutable, lightweight, and readable data objects.
 """
 
-from typing import NamedTuple, Dict, Set, List, Optional
+from typing import NamedTuple, Dict, Set, List, Optional, Tuple, AbstractSet
 
 
 class Particle(NamedTuple):
@@ -14,11 +14,20 @@ class Particle(NamedTuple):
     title: str
     body: str
     author: str
-    tags: Set[str]
+    tags: AbstractSet[str]  # a frozenset when loaded from storage
     created_at: str
     updated_at: str
 
 
+class ParticleSummary(NamedTuple):
+    """a particle as shown in a listing: no body, only its snippet"""
+    id: str
+    user_facing_id: int
+    created_at: str
+    title: str
+    snippet: str
+
+
 class QueryHit(NamedTuple):
     """represents a single search result item"""
     id: str
@@ -27,6 +36,21 @@ class QueryHit(NamedTuple):
     title: str
     score: float
     snippet: str
+    highlights: Tuple[Tuple[int, int], ...] = ()  # (start, end) offsets into snippet
+
+
+class Change(NamedTuple):
+    """an entry of the incremental sync change log"""
+    seq: int
+    particle_id: str
+    deleted: bool
+    particle: Optional[Particle]  # None for a deletion tombstone
+
+
+class SearchResult(NamedTuple):
+    """search hits plus the query cost limits that cut the search short, if any"""
+    hits: List[QueryHit]
+    truncated: Tuple[str, ...] = ()  # "length", "terms", "phrase" or "time"
 
 
 class Storage(NamedTuple):
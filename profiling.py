@@ -0,0 +1,248 @@
+"""
+This module records where the time of each web request goes.
+
+ProfilingMiddleware starts a RequestProfile for every HTTP request and
+stores it in a context variable, which FastAPI carries into the threadpool
+threads running sync dependencies and endpoints. While the request runs:
+
+- phase("auth") and similar blocks add wall time to named phases;
+- connections opened with factory=ProfiledConnection time every statement
+  (execute plus fetches) and count the rows fetched, and their trace hook
+  counts the statements SQLite actually ran, including trigger programs.
+
+The totals are returned to the client in a Server-Timing header (visible in
+the browser's network panel) and, for requests slower than
+SLOW_REQUEST_MS, written as one JSON line to the "pim.slow_requests" log.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import querylog
+
+SLOW_REQUEST_MS = 500.0
+
+slow_log = logging.getLogger("pim.slow_requests")
+
+
+class RequestProfile:
+    """Timings collected for one request. Mutated from the request's threads, one at a time."""
+
+    __slots__ = ("phases", "statements", "queries", "sql_seconds", "rows", "slowest_sql", "slowest_seconds")
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}  # phase name -> seconds
+        self.statements = 0  # statements run by SQLite, including triggers (trace hook)
+        self.queries = 0  # statements executed through a cursor
+        self.sql_seconds = 0.0
+        self.rows = 0  # rows fetched
+        self.slowest_sql: Optional[str] = None
+        self.slowest_seconds = 0.0
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, sql: str, seconds: float, rows: int) -> None:
+        self.queries += 1
+        self.sql_seconds += seconds
+        self.rows += rows
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_sql = sql
+
+    def server_timing(self, total: float) -> str:
+        """A Server-Timing header value (durations in milliseconds)."""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        parts.append(f'sql;dur={self.sql_seconds * 1000:.2f};desc="{self.queries} queries, '
+                     f'{self.statements} statements, {self.rows} rows"')
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """The profile of the request being handled, or None outside a request."""
+    return _current.get()
+
+
+@contextmanager
+def profiled():
+    """Collects a RequestProfile for the block, e.g. to profile a search outside the web app."""
+    profile = RequestProfile()
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def phase(name: str):
+    """Adds the wall time of the block to the current request's phase `name`."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - start)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    A cursor that charges each statement's execute and fetch time, and the
+    rows fetched, to the current request, and sends statements slower than
+    querylog.SLOW_QUERY_MS to the slow query log. A statement is recorded
+    once its rows are exhausted, or when the cursor runs another statement
+    or is closed. Rows read by iterating the cursor directly are not
+    counted; the storage code fetches with fetchone/fetchmany/fetchall.
+    """
+
+    _sql = ""
+    _params = ()
+    _seconds = 0.0
+    _rows = 0
+
+    def _flush(self, log: bool = True) -> None:
+        if self._sql:
+            profile = _current.get()
+            if profile is not None:
+                profile.add_query(self._sql, self._seconds, self._rows)
+            if log and self._seconds * 1000 >= querylog.SLOW_QUERY_MS:
+                querylog.record(self.connection, self._sql, self._params, self._seconds, self._rows)
+            self._sql = ""
+
+    def execute(self, sql, parameters=()):
+        self._flush()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql, self._params, self._seconds, self._rows = sql, parameters, time.perf_counter() - start, 0
+            if self.description is None:  # no result set to fetch: record it now
+                self._flush()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._flush()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # The parameter sequence may be a consumed iterator, so no shape or plan is logged.
+            self._sql, self._params, self._seconds, self._rows = sql, None, time.perf_counter() - start, 0
+            self._flush()
+
+    def _fetched(self, start: float, rows: int) -> None:
+        self._seconds += time.perf_counter() - start
+        self._rows += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        if row is None:
+            self._flush()
+        return row
+
+    def fetchmany(self, size: int = 1):
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows))
+        if len(rows) < size:
+            self._flush()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        self._flush()
+        return rows
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def __del__(self):
+        # A cursor dropped mid-result still counts towards the request, but
+        # finalizers run during garbage collection, so no query log (EXPLAIN) work here.
+        self._flush(log=False)
+
+
+def _count_statement(_sql: str) -> None:
+    profile = _current.get()
+    if profile is not None:
+        profile.statements += 1
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """A connection whose cursors are ProfiledCursors; pass as make_connection's factory."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_count_statement)
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware adding Server-Timing to every response and logging requests slower than SLOW_REQUEST_MS."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        streaming = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                streaming = headers.get("content-type", "").startswith("text/event-stream")
+                headers.append("Server-Timing", profile.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        with profiled() as profile:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if elapsed_ms >= SLOW_REQUEST_MS and not streaming:
+                    slow_log.warning(json.dumps({
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status,
+                        "total_ms": round(elapsed_ms, 2),
+                        "phases_ms": {name: round(s * 1000, 2) for name, s in profile.phases.items()},
+                        "sql_ms": round(profile.sql_seconds * 1000, 2),
+                        "queries": profile.queries,
+                        "statements": profile.statements,
+                        "rows": profile.rows,
+                        "slowest_sql": profile.slowest_sql,
+                        "slowest_sql_ms": round(profile.slowest_seconds * 1000, 2),
+                    }))
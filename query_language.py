@@ -0,0 +1,460 @@
+"""
+This module implements the search query language and its planner.
+
+Grammar (operators are upper case; juxtaposition means AND):
+
+    expr     := or_expr
+    or_expr  := and_expr ("OR" and_expr)*
+    and_expr := not_expr ("AND"? not_expr)*
+    not_expr := "NOT" not_expr | atom
+    atom     := "(" expr ")" | field ":" [op] value | "quoted phrase" | word
+
+    field    := title | tag | created | updated
+    op       := > | >= | < | <= | =        (created/updated only)
+
+A parsed query is compiled into a QueryPlan: a SQL WHERE clause in which
+every AND evaluates its most selective clauses first (tag index lookups,
+then date ranges on the (author, created_at) index, then title and full
+text LIKE scans, negations last), plus the steps needed to explain it.
+"""
+
+import operator
+import re
+import sqlite3
+import time
+from typing import AbstractSet, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from storage import SEARCH_TEXT
+
+# Query AST
+
+class Term(NamedTuple):
+    """A keyword or quoted phrase, matched in title and body (or title only)."""
+    text: str
+    phrase: bool
+    field: str  # "" for title + body, "title" for title only
+
+
+class TagFilter(NamedTuple):
+    tag: str
+
+
+class DateFilter(NamedTuple):
+    column: str  # "created_at" or "updated_at"
+    op: str
+    value: str
+
+
+class And(NamedTuple):
+    children: Tuple["Node", ...]
+
+
+class Or(NamedTuple):
+    children: Tuple["Node", ...]
+
+
+class Not(NamedTuple):
+    child: "Node"
+
+
+Node = Union[Term, TagFilter, DateFilter, And, Or, Not]
+
+
+class QueryPlan(NamedTuple):
+    """A compiled query: the reordered tree and the SQL WHERE clause for it."""
+    root: Node
+    where: str
+    params: Tuple
+
+
+# Tokenizer and parser
+
+_TOKEN_RE = re.compile(r'''
+    (?P<lparen>\() |
+    (?P<rparen>\)) |
+    (?P<field>title|tag|created|updated):(?P<op>[<>]=?|=)?(?:"(?P<fphrase>[^"]*)"|(?P<fvalue>[^\s()"]+))? |
+    "(?P<phrase>[^"]+)" |
+    (?P<word>[^\s()"]+)
+''', re.VERBOSE | re.IGNORECASE)
+
+_DATE_RE = re.compile(r"^\d{4}(-\d{2}(-\d{2}([T ][\d:.]+)?)?)?$")
+_OPERATORS = {"AND", "OR", "NOT"}
+
+
+def tokenize(q: str) -> List[Tuple[str, object]]:
+    """Splits a query into (kind, value) tokens: lparen, rparen, op, field, phrase, word."""
+    tokens: List[Tuple[str, object]] = []
+    for m in _TOKEN_RE.finditer(q):
+        if m.group("lparen"):
+            tokens.append(("lparen", "("))
+        elif m.group("rparen"):
+            tokens.append(("rparen", ")"))
+        elif m.group("field"):
+            value = m.group("fphrase") if m.group("fphrase") is not None else m.group("fvalue")
+            if value:
+                tokens.append(("field", (m.group("field").lower(), m.group("op") or "", value,
+                                         m.group("fphrase") is not None)))
+            else:
+                tokens.append(("word", m.group(0)))
+        elif m.group("phrase"):
+            tokens.append(("phrase", m.group("phrase")))
+        elif m.group("word") in _OPERATORS:
+            tokens.append(("op", m.group("word")))
+        else:
+            tokens.append(("word", m.group("word")))
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive-descent parser over the token list. It is deliberately
+    forgiving, since its input comes straight from a search box: stray
+    closing parentheses and dangling operators are ignored and unclosed
+    parentheses are closed at the end of the query.
+    """
+
+    def __init__(self, tokens: List[Tuple[str, object]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[Tuple[str, object]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> Optional[Node]:
+        nodes = []
+        while self.peek():
+            node = self.parse_or()
+            if node is not None:
+                nodes.append(node)
+            elif self.peek():
+                self.pos += 1  # skip a token that cannot start an expression
+        return _combine(And, nodes)
+
+    def parse_or(self) -> Optional[Node]:
+        nodes = [self.parse_and()]
+        while self.peek() == ("op", "OR"):
+            self.pos += 1
+            nodes.append(self.parse_and())
+        return _combine(Or, [n for n in nodes if n is not None])
+
+    def parse_and(self) -> Optional[Node]:
+        nodes = []
+        while True:
+            token = self.peek()
+            if token is None or token[0] == "rparen" or token == ("op", "OR"):
+                break
+            if token == ("op", "AND"):
+                self.pos += 1
+                continue
+            node = self.parse_not()
+            if node is not None:
+                nodes.append(node)
+        return _combine(And, nodes)
+
+    def parse_not(self) -> Optional[Node]:
+        if self.peek() == ("op", "NOT"):
+            self.pos += 1
+            child = self.parse_not()
+            return Not(child) if child is not None else None
+        return self.parse_atom()
+
+    def parse_atom(self) -> Optional[Node]:
+        token = self.peek()
+        if token is None:
+            return None
+        kind, value = token
+        self.pos += 1
+        if kind == "lparen":
+            node = self.parse_or()
+            if self.peek() and self.peek()[0] == "rparen":
+                self.pos += 1
+            return node
+        if kind == "phrase":
+            return Term(value.lower(), True, "")
+        if kind == "word":
+            return Term(value.lower(), False, "")
+        if kind == "field":
+            return _field_node(*value)
+        return None  # a dangling operator or stray ")"
+
+
+def _combine(kind, nodes: List[Node]) -> Optional[Node]:
+    """Builds an And/Or of the nodes, collapsing empty and single-child groups."""
+    if not nodes:
+        return None
+    if len(nodes) == 1:
+        return nodes[0]
+    return kind(tuple(nodes))
+
+
+def _field_node(field: str, op: str, value: str, quoted: bool) -> Node:
+    """Builds the node for a `field:value` token."""
+    if field == "tag":
+        return TagFilter(value.lower())
+    if field == "title":
+        return Term(value.lower(), quoted, "title")
+    if _DATE_RE.match(value) and not quoted:
+        return DateFilter(field + "_at", op or "=", value)
+    # Not a valid date: search for the text literally rather than failing.
+    return Term(f"{field}:{op}{value}".lower(), quoted, "")
+
+
+def parse(q: str) -> Optional[Node]:
+    """Parses a query string into an AST, or None if it contains no clauses."""
+    return _Parser(tokenize(q)).parse()
+
+
+# Query cost limits
+
+MAX_TERMS = 16  # keywords and phrases (each one or two LIKE scans) per query
+MAX_PHRASE_LENGTH = 100  # characters
+
+
+def limit_query(node: Optional[Node], max_terms: int = MAX_TERMS,
+                max_phrase_length: int = MAX_PHRASE_LENGTH) -> Tuple[Optional[Node], List[str]]:
+    """
+    Bounds the cost of a parsed query: repeated clauses in an AND or OR are
+    kept once, phrases are cut to max_phrase_length characters (at a word
+    boundary) and keywords and phrases after the first max_terms are dropped.
+
+    Returns:
+        The limited tree and the limits that changed it ("phrase", "terms").
+    """
+    reasons: List[str] = []
+    budget = [max_terms]
+
+    def walk(n: Node) -> Optional[Node]:
+        if isinstance(n, Term):
+            if budget[0] <= 0:
+                if "terms" not in reasons:
+                    reasons.append("terms")
+                return None
+            budget[0] -= 1
+            if n.phrase and len(n.text) > max_phrase_length:
+                if "phrase" not in reasons:
+                    reasons.append("phrase")
+                cut = n.text[:max_phrase_length]
+                n = n._replace(text=cut.rsplit(" ", 1)[0] if " " in cut else cut)
+            return n
+        if isinstance(n, Not):
+            child = walk(n.child)
+            return Not(child) if child is not None else None
+        if isinstance(n, (And, Or)):
+            children = [c for c in (walk(c) for c in dict.fromkeys(n.children)) if c is not None]
+            return _combine(type(n), list(dict.fromkeys(children)))
+        return n
+
+    return (walk(node) if node is not None else None), reasons
+
+
+def positive_terms(node: Optional[Node]) -> List[Term]:
+    """The terms a matching particle must or may contain (terms under NOT excluded)."""
+    if isinstance(node, Term):
+        return [node]
+    if isinstance(node, (And, Or)):
+        return [t for child in node.children for t in positive_terms(child)]
+    return []
+
+
+# Planner
+
+# Evaluation order inside an AND: cheapest and most selective first.
+_RANK_TAG, _RANK_DATE, _RANK_TITLE, _RANK_TEXT, _RANK_NOT = 1, 2, 3, 4, 10
+
+
+def rank(node: Node) -> int:
+    """Estimated cost rank of evaluating a clause; lower runs first."""
+    if isinstance(node, TagFilter):
+        return _RANK_TAG
+    if isinstance(node, DateFilter):
+        return _RANK_DATE
+    if isinstance(node, Term):
+        return _RANK_TITLE if node.field == "title" else _RANK_TEXT
+    if isinstance(node, Not):
+        return _RANK_NOT + rank(node.child)
+    if isinstance(node, And):
+        return min(rank(c) for c in node.children)
+    return max(rank(c) for c in node.children)  # an OR is as slow as its slowest branch
+
+
+def _reorder(node: Node) -> Node:
+    """Recursively sorts the children of every AND by rank (stable)."""
+    if isinstance(node, And):
+        return And(tuple(sorted((_reorder(c) for c in node.children), key=rank)))
+    if isinstance(node, Or):
+        return Or(tuple(_reorder(c) for c in node.children))
+    if isinstance(node, Not):
+        return Not(_reorder(node.child))
+    return node
+
+
+def date_bounds(node: DateFilter) -> List[Tuple[str, str]]:
+    """
+    (operator, value) comparisons for a date filter. Dates match as
+    prefixes, so `created:2025-01` covers all of January and `>2025-01`
+    starts in February. '~' sorts after every character of an ISO timestamp.
+    """
+    v, end = node.value, node.value + "~"
+    return {
+        ">": [(">", end)],
+        ">=": [(">=", v)],
+        "<": [("<", v)],
+        "<=": [("<", end)],
+        "=": [(">=", v), ("<", end)],
+    }[node.op]
+
+
+def _like(text: str) -> str:
+    """A LIKE pattern matching `text` anywhere, with its wildcards escaped (use with ESCAPE '\\')."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def compile_sql(node: Node, author: str, variants: Dict[str, List[str]]) -> Tuple[str, List]:
+    """
+    Compiles a node into a SQL boolean expression over the particles table.
+    `variants` maps keywords to fuzzy alternatives that also satisfy them.
+    """
+    if isinstance(node, TagFilter):
+        return ("id IN (SELECT particle_id FROM particle_tags WHERE author = ? AND tag = ?)",
+                [author, node.tag])
+    if isinstance(node, DateFilter):
+        parts = [f"{node.column} {op} ?" for op, _ in date_bounds(node)]
+        return " AND ".join(parts), [value for _, value in date_bounds(node)]
+    if isinstance(node, Term):
+        words = [node.text] + variants.get(node.text, []) if not node.phrase else [node.text]
+        clauses, params = [], []
+        for word in words:
+            if node.field == "title":
+                clauses.append("lower(title) LIKE ? ESCAPE '\\'")
+                params.append(_like(word))
+            else:
+                clauses.append(f"(lower(title) LIKE ? ESCAPE '\\' OR lower({SEARCH_TEXT}) LIKE ? ESCAPE '\\')")
+                params.extend([_like(word), _like(word)])
+        return " OR ".join(clauses), params
+    if isinstance(node, Not):
+        sql, params = compile_sql(node.child, author, variants)
+        return f"NOT ({sql})", params
+    joiner = " AND " if isinstance(node, And) else " OR "
+    parts, params = [], []
+    for child in node.children:
+        sql, child_params = compile_sql(child, author, variants)
+        parts.append(f"({sql})")
+        params.extend(child_params)
+    return joiner.join(parts), params
+
+
+_COMPARE = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+
+def matches(node: Node, title_lower: str, text_lower: str, tags: AbstractSet[str],
+            dates: Mapping[str, str], variants: Dict[str, List[str]]) -> bool:
+    """
+    Evaluates a node for one particle in Python, as its compile_sql clause
+    does in SQLite, for backends without SQL. `tags` are the particle's
+    lowercased tags and `dates` maps created_at and updated_at to its timestamps.
+    """
+    if isinstance(node, TagFilter):
+        return node.tag in tags
+    if isinstance(node, DateFilter):
+        value = dates[node.column]
+        return value is not None and all(_COMPARE[op](value, bound) for op, bound in date_bounds(node))
+    if isinstance(node, Term):
+        words = [node.text] + variants.get(node.text, []) if not node.phrase else [node.text]
+        if node.field == "title":
+            return any(word in title_lower for word in words)
+        return any(word in title_lower or word in text_lower for word in words)
+    if isinstance(node, Not):
+        return not matches(node.child, title_lower, text_lower, tags, dates, variants)
+    test = all if isinstance(node, And) else any
+    return test(matches(c, title_lower, text_lower, tags, dates, variants) for c in node.children)
+
+
+def plan_query(node: Node, author: str, variants: Optional[Dict[str, List[str]]] = None) -> QueryPlan:
+    """Orders the query tree by selectivity and compiles it to a WHERE clause."""
+    root = _reorder(node)
+    # A top-level AND is flattened into the WHERE clause so SQLite sees each
+    # conjunct separately and can drive the scan from an indexed one.
+    conjuncts = root.children if isinstance(root, And) else (root,)
+    parts, params = [], []
+    for child in conjuncts:
+        sql, child_params = compile_sql(child, author, variants or {})
+        parts.append(f"({sql})")
+        params.extend(child_params)
+    return QueryPlan(root, " AND ".join(parts), tuple(params))
+
+
+def score(node: Node, title_lower: str, body_lower: str, variants: Dict[str, List[str]]) -> int:
+    """
+    Scores a matching particle from the positive terms it contains: keywords
+    5 in the title and 2 in the body (3 and 1 when only a fuzzy variant
+    occurs), phrases 20 and 10. Tag and date filters do not add to the score.
+    """
+    total = 0
+    for term in positive_terms(node):
+        in_body = term.field != "title"
+        if term.phrase:
+            if term.text in title_lower: total += 20
+            if in_body and term.text in body_lower: total += 10
+        elif term.text in title_lower or (in_body and term.text in body_lower):
+            if term.text in title_lower: total += 5
+            if in_body and term.text in body_lower: total += 2
+        else:
+            if any(v in title_lower for v in variants.get(term.text, [])): total += 3
+            if in_body and any(v in body_lower for v in variants.get(term.text, [])): total += 1
+    return total
+
+
+# EXPLAIN
+
+def describe(node: Node) -> str:
+    """A compact, query-like rendering of a node."""
+    if isinstance(node, Term):
+        text = f'"{node.text}"' if node.phrase else node.text
+        return f"title:{text}" if node.field == "title" else text
+    if isinstance(node, TagFilter):
+        return f"tag:{node.tag}"
+    if isinstance(node, DateFilter):
+        return f"{node.column[:-3]}:{'' if node.op == '=' else node.op}{node.value}"
+    if isinstance(node, Not):
+        return f"NOT {describe(node.child)}"
+    joiner = " AND " if isinstance(node, And) else " OR "
+    return "(" + joiner.join(describe(c) for c in node.children) + ")"
+
+
+def _access_path(node: Node) -> str:
+    if isinstance(node, TagFilter):
+        return "index particle_tags(author, tag)"
+    if isinstance(node, DateFilter):
+        return "index particles(author, created_at)" if node.column == "created_at" else "filter on updated_at"
+    if isinstance(node, Term):
+        return "LIKE scan of title" if node.field == "title" else "LIKE scan of title and body"
+    if isinstance(node, Not):
+        return "filter (negation)"
+    return "filter (" + ("AND" if isinstance(node, And) else "OR") + " group)"
+
+
+def explain(conn: sqlite3.Connection, author: str, plan: QueryPlan, variants: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """
+    Describes how a plan is evaluated: the clause order with each clause's
+    access path, how many of the author's particles it matches and how long
+    that took on its own, followed by the SQL and SQLite's query plan.
+    """
+    variants = variants or {}
+    cur = conn.cursor()
+    lines = ["plan:"]
+    conjuncts = plan.root.children if isinstance(plan.root, And) else (plan.root,)
+    for i, node in enumerate(conjuncts, 1):
+        sql, params = compile_sql(node, author, variants)
+        start = time.perf_counter()
+        cur.execute(f"SELECT COUNT(*) FROM particles WHERE author = ? AND ({sql})", [author] + params)
+        count = cur.fetchone()[0]
+        elapsed = (time.perf_counter() - start) * 1000
+        lines.append(f"  {i}. {describe(node):<30} {_access_path(node):<36} matches={count} time={elapsed:.2f}ms")
+
+    where = f"author = ? AND {plan.where}"
+    lines.append(f"sql: WHERE {where}")
+    cur.execute(f"EXPLAIN QUERY PLAN SELECT id FROM particles WHERE {where} ORDER BY created_at DESC",
+                (author,) + plan.params)
+    lines.extend(f"sqlite: {row[-1]}" for row in cur.fetchall())
+    return lines
@@ -0,0 +1,176 @@
+"""
+This module keeps a log of slow SQL statements and summarizes it.
+
+Connections opened with profiling.ProfiledConnection (as every web request's
+connection is) time each statement, execute plus fetches. A statement that
+takes at least SLOW_QUERY_MS is appended as one JSON line to LOG_NAME in the
+directory of the database it ran on (or to LOG_PATH, if set) with:
+
+- its normalized SQL (literals and IN lists replaced, whitespace collapsed),
+  so the many variants the search planner generates group together;
+- the shape of its parameters (types, not values, so no note text is logged);
+- the rows fetched and the time taken;
+- SQLite's EXPLAIN QUERY PLAN for it.
+
+The log rotates at MAX_BYTES, keeping BACKUPS old files.
+
+    python -m querylog summary [--log slow_queries.log] [--top 10] [--by total|max|count]
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+SLOW_QUERY_MS = 50.0
+LOG_NAME = "slow_queries.log"
+LOG_PATH: Optional[str] = None  # overrides LOG_NAME next to the database
+MAX_BYTES = 5_000_000
+BACKUPS = 3
+
+_lock = threading.Lock()
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(sql: str) -> str:
+    """SQL with literals as ?, IN (?, ?, ...) as IN (...), and single spaces."""
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("IN (...)", sql)
+    return _SPACE_RE.sub(" ", sql).strip()
+
+
+def params_shape(params) -> str:
+    """Parameter types without values, e.g. 'str, int, str x3' or ':author str'."""
+    if isinstance(params, dict):
+        return ", ".join(f":{k} {type(v).__name__}" for k, v in params.items())
+    runs: List[List] = []
+    for p in params or ():
+        name = type(p).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return ", ".join(name if n == 1 else f"{name} x{n}" for name, n in runs)
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+    """SQLite's EXPLAIN QUERY PLAN lines for a statement ([] if it cannot be explained)."""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        return []
+    try:
+        cur = conn.cursor(sqlite3.Cursor)  # a plain cursor: explaining is not itself profiled
+        cur.row_factory = None
+        return [row[-1] for row in cur.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()]
+    except sqlite3.Error:  # e.g. the connection is busy or used from another thread
+        return []
+
+
+def log_path(conn: Optional[sqlite3.Connection]) -> Optional[str]:
+    """LOG_PATH, or LOG_NAME next to the connection's database file (None for in-memory databases)."""
+    if LOG_PATH or conn is None:
+        return LOG_PATH
+    try:
+        cur = conn.cursor(sqlite3.Cursor)
+        cur.row_factory = None
+        for _, name, path in cur.execute("PRAGMA database_list").fetchall():
+            if name == "main" and path:
+                return os.path.join(os.path.dirname(path), LOG_NAME)
+    except sqlite3.Error:
+        pass
+    return None
+
+
+def _rotate(path: str) -> None:
+    for i in range(BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def record(conn: Optional[sqlite3.Connection], sql: str, params, seconds: float, rows: int) -> None:
+    """
+    Appends a slow statement to the log, rotating it when it grows past
+    MAX_BYTES. Nothing is logged when there is no log path (see log_path).
+    """
+    path = log_path(conn)
+    if path is None:
+        return
+    entry = {
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "sql": normalize(sql),
+        "params": params_shape(params),
+        "ms": round(seconds * 1000, 2),
+        "rows": rows,
+        "plan": query_plan(conn, sql, params) if conn is not None else [],
+    }
+    line = json.dumps(entry) + "\n"
+    with _lock:
+        if os.path.exists(path) and os.path.getsize(path) + len(line) > MAX_BYTES:
+            _rotate(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_log(path: str) -> List[Dict]:
+    """All entries in a log and its rotated files, oldest first."""
+    entries = []
+    for name in [f"{path}.{i}" for i in range(BACKUPS, 0, -1)] + [path]:
+        if os.path.exists(name):
+            with open(name, encoding="utf-8") as f:
+                entries.extend(json.loads(line) for line in f if line.strip())
+    return entries
+
+
+def summarize(entries: Sequence[Dict], by: str = "total", top: int = 10) -> List[Dict]:
+    """Groups entries by normalized SQL, worst first by total, max or count."""
+    groups: Dict[str, Dict] = {}
+    for e in entries:
+        g = groups.setdefault(e["sql"], {"sql": e["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                         "rows": 0, "params": set(), "plan": []})
+        g["count"] += 1
+        g["total_ms"] += e["ms"]
+        g["max_ms"] = max(g["max_ms"], e["ms"])
+        g["rows"] += e["rows"]
+        g["params"].add(e["params"])
+        g["plan"] = e["plan"] or g["plan"]  # the most recent plan
+    key = {"total": "total_ms", "max": "max_ms", "count": "count"}[by]
+    worst = sorted(groups.values(), key=lambda g: g[key], reverse=True)[:top]
+    for g in worst:
+        g["mean_ms"] = round(g["total_ms"] / g["count"], 2)
+        g["mean_rows"] = round(g["rows"] / g["count"], 1)
+        g["total_ms"] = round(g["total_ms"], 2)
+        g["params"] = sorted(g["params"])
+    return worst
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Summarize the slow query log.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("summary", help="the worst statements in the log")
+    p.add_argument("--log", default=LOG_PATH or LOG_NAME)
+    p.add_argument("--top", type=int, default=10)
+    p.add_argument("--by", choices=("total", "max", "count"), default="total")
+    args = parser.parse_args(argv)
+
+    entries = read_log(args.log)
+    print(f"{len(entries)} slow statements in {args.log}")
+    for i, g in enumerate(summarize(entries, args.by, args.top), 1):
+        print(f"\n#{i} count={g['count']} total={g['total_ms']}ms mean={g['mean_ms']}ms "
+              f"max={g['max_ms']}ms rows/exec={g['mean_rows']}")
+        print(f"  sql:    {g['sql'][:400]}")
+        print(f"  params: {' | '.join(g['params'])}")
+        for line in g["plan"]:
+            print(f"  plan:   {line}")
+
+
+if __name__ == "__main__":
+    main()
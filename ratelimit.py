@@ -0,0 +1,218 @@
+"""
+This module throttles clients with token buckets.
+
+Every request is classified into a policy by its path (login, search,
+export or default) and draws a token from three buckets:
+
+- the global bucket, shared by all requests;
+- its client IP's bucket for the policy, holding IP_SHARE times a user's
+  tokens since several users may share an address. This bucket is charged
+  for every request, so rotating made-up session tokens does not help;
+- once the session has been validated (see check_user, called by the
+  auth dependency), the user's bucket for the policy.
+
+A bucket holds up to `burst` tokens and refills at `rate` tokens per
+second. A request that finds a bucket empty is answered 429 with a
+Retry-After header saying when a token will be available, and gets back
+the tokens it took from the other buckets.
+
+Buckets live in an OrderedDict in least-recently-used order, so taking a
+token is O(1). Every EVICT_EVERY operations, buckets idle long enough to
+have refilled completely are dropped from the old end. Such a bucket is
+indistinguishable from a new one, so evicting it never changes a decision.
+MAX_KEYS caps memory even under a flood of distinct keys: past it, all
+full buckets go first and only then the least recently used of the rest.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import metrics
+
+ENABLED = True
+MAX_KEYS = 100_000
+EVICT_EVERY = 1000
+IP_SHARE = 4  # an IP's bucket holds this many users' worth of tokens
+
+RATE_LIMITED = metrics.registry.register(metrics.Counter(
+    "pim_rate_limited_total", "Requests refused with 429 by policy.", ("policy",)))
+
+
+class Policy(NamedTuple):
+    rate: float  # tokens added per second
+    burst: int  # bucket capacity
+
+
+POLICIES: Dict[str, Policy] = {
+    "login": Policy(rate=0.2, burst=10),  # /login and /register, per IP: bcrypt is expensive
+    "search": Policy(rate=5.0, burst=20),
+    "export": Policy(rate=0.1, burst=3),
+    "default": Policy(rate=20.0, burst=60),
+}
+GLOBAL_POLICY = Policy(rate=500.0, burst=1000)
+
+# Paths that are never limited: cached static files and images, and operational endpoints.
+EXEMPT_PREFIXES = ("/static/", "/blobs/", "/metrics", "/admin/")
+
+
+def classify(path: str) -> Optional[str]:
+    """The policy name for a request path, or None if it is exempt."""
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if path in ("/login", "/register"):
+        return "login"
+    if path.startswith("/search"):
+        return "search"
+    if path == "/export":
+        return "export"
+    return "default"
+
+
+class TokenBuckets:
+    """Token buckets for many keys. Thread-safe."""
+
+    def __init__(self, max_keys: int = MAX_KEYS, evict_every: int = EVICT_EVERY,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.evict_every = evict_every
+        self.clock = clock
+        self._buckets: "OrderedDict[Tuple, list]" = OrderedDict()  # key -> [tokens, last refill, policy]
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Tuple, policy: Policy, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens from the key's bucket.
+
+        Returns:
+            0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(policy.burst), now, policy]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(policy.burst, bucket[0] + (now - bucket[1]) * policy.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                wait = 0.0
+            else:
+                wait = (cost - bucket[0]) / policy.rate
+            self._ops += 1
+            if self._ops >= self.evict_every or len(self._buckets) > self.max_keys:
+                self._ops = 0
+                self._evict(now)
+            return wait
+
+    def refund(self, key: Tuple, cost: float = 1.0) -> None:
+        """Returns tokens taken by a request that was refused by another bucket."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(bucket[2].burst, bucket[0] + cost)
+
+    def _evict(self, now: float) -> None:
+        """
+        Drops buckets that have refilled completely, oldest first. Over
+        max_keys, drops every full bucket and then, to 90% of max_keys so
+        the scan is not repeated for each new key, the least recently used
+        ones: a throttled client only loses its bucket when nothing else can go.
+        """
+        def full(bucket: list) -> bool:
+            tokens, last, policy = bucket
+            return tokens + (now - last) * policy.rate >= policy.burst
+
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if not full(bucket):
+                break  # every later bucket was used more recently
+            del self._buckets[key]
+        if len(self._buckets) > self.max_keys:
+            for key in [key for key, bucket in self._buckets.items() if full(bucket)]:
+                del self._buckets[key]
+            while len(self._buckets) > self.max_keys * 9 // 10:
+                self._buckets.popitem(last=False)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+buckets = TokenBuckets()
+
+
+def client_ip(scope: Scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _take_all(charges: List[Tuple[Tuple, Policy]]) -> float:
+    """Takes a token from each bucket in turn; if one is empty, refunds the others and returns its wait."""
+    taken = []
+    for key, policy in charges:
+        wait = buckets.take(key, policy)
+        if wait:
+            for key_taken in taken:
+                buckets.refund(key_taken)
+            return wait
+        taken.append(key)
+    return 0.0
+
+
+def check(scope: Scope) -> Tuple[Optional[str], float]:
+    """(policy name, seconds to wait) for a request by its IP; the wait is 0 if it may proceed."""
+    name = classify(scope["path"])
+    if name is None:
+        return None, 0.0
+    policy = POLICIES[name]
+    if name != "login":  # login is limited per IP only, at the user rate: sessions do not exist before it
+        policy = Policy(policy.rate * IP_SHARE, policy.burst * IP_SHARE)
+    return name, _take_all([((name, "ip:" + client_ip(scope)), policy), (("global",), GLOBAL_POLICY)])
+
+
+def check_user(path: str, username: str) -> Tuple[Optional[str], float]:
+    """(policy name, seconds to wait) for a request by a validated user; the wait is 0 if it may proceed."""
+    name = classify(path)
+    if not ENABLED or name is None or name == "login":
+        return name, 0.0
+    return name, buckets.take((name, "user:" + username), POLICIES[name])
+
+
+def retry_after(wait: float) -> str:
+    return str(max(1, math.ceil(wait)))
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with Retry-After when a request's IP bucket or the global bucket is empty."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        name, wait = check(scope)
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+        RATE_LIMITED.inc(name)
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send({"type": "http.response.start", "status": 429, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", retry_after(wait).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -1,7 +1,18 @@
 import sqlite3
 import re
+import time
+from operator import itemgetter
 from typing import List, Dict, Any, Tuple
-from pim_types import QueryHit
+import metrics
+from pim_types import QueryHit, SearchResult
+from fuzzy import term_dictionary, expand
+from storage import SNIPPET_WIDTH, SEARCH_TEXT, body_snippet, list_particles
+from query_language import parse, limit_query, plan_query, positive_terms, score, describe, explain
+
+MAX_QUERY_LENGTH = 1000  # characters; longer queries are cut
+SEARCH_TIME_BUDGET = 0.5  # seconds the candidate scan may run before it is interrupted
+_PROGRESS_STEPS = 1000  # SQLite VM instructions between time budget checks
+_FETCH_BATCH = 256
 
 def parse_query(q: str) -> Tuple[List[str], List[str]]:
     """
@@ -17,99 +28,234 @@ def parse_query(q: str) -> Tuple[List[str], List[str]]:
     
     return keywords, phrases
 
-def query(conn: sqlite3.Connection, author: str, q: str, limit: int = 20) -> List[QueryHit]:
+
+def make_snippet(body: str, terms: List[str], width: int = SNIPPET_WIDTH) -> Tuple[str, Tuple[Tuple[int, int], ...]]:
+    """
+    Picks the `width`-character window of the body that covers the most
+    distinct query terms and returns it with highlight offsets.
+
+    Term positions are collected in a single pass per term over the lowercased
+    body, then a sliding window over the sorted positions chooses the best
+    window (most distinct terms, then most matches, then earliest).
+    Falls back to the start of the body when no term occurs in it.
+
+    Returns:
+        (snippet, highlights) where highlights are (start, end) offsets into
+        the returned snippet string, sorted and non-overlapping.
+    """
+    body_lower = body.lower()
+    matches = []  # (start, end, term index)
+    for i, term in enumerate(terms):
+        if not term:
+            continue
+        pos = body_lower.find(term)
+        while pos != -1:
+            matches.append((pos, pos + len(term), i))
+            pos = body_lower.find(term, pos + 1)
+
+    if not matches:
+        return body_snippet(body, width), ()
+    matches.sort()
+
+    # Sliding window: for each left match, extend right while it still fits.
+    best = (-1, -1, 0, 0)  # (distinct terms, match count, left, right) - left/right index into matches
+    counts: Dict[int, int] = {}
+    right = 0
+    for left in range(len(matches)):
+        window_end = matches[left][0] + width
+        while right < len(matches) and matches[right][1] <= window_end:
+            counts[matches[right][2]] = counts.get(matches[right][2], 0) + 1
+            right += 1
+        if right > left:
+            candidate = (len(counts), right - left)
+            if candidate > best[:2]:
+                best = (candidate[0], candidate[1], left, right)
+            term_idx = matches[left][2]
+            counts[term_idx] -= 1
+            if not counts[term_idx]:
+                del counts[term_idx]
+        else:
+            right = left + 1
+
+    _, _, left, right = best
+    if right <= left:  # a single term longer than the window
+        right = left + 1
+    first_start = matches[left][0]
+    last_end = max(end for _, end, _ in matches[left:right])
+
+    # Centre the matched span, then snap the start forward to a word boundary.
+    lead = max(0, (width - (last_end - first_start)) // 2)
+    start = max(0, first_start - lead)
+    if start > 0:
+        space = body.find(" ", start, first_start)
+        if space != -1:
+            start = space + 1
+    end = min(len(body), start + width)
+
+    prefix = "..." if start > 0 else ""
+    snippet = prefix + body[start:end] + ("..." if end < len(body) else "")
+
+    highlights: List[Tuple[int, int]] = []
+    for m_start, m_end, _ in matches:
+        if m_start < start or m_end > end:
+            continue
+        h_start, h_end = m_start - start + len(prefix), m_end - start + len(prefix)
+        if highlights and h_start <= highlights[-1][1]:
+            highlights[-1] = (highlights[-1][0], max(highlights[-1][1], h_end))
+        else:
+            highlights.append((h_start, h_end))
+    return snippet, tuple(highlights)
+
+def query(conn: sqlite3.Connection, author: str, q: str, limit: int = 20, fuzzy: bool = False) -> List[QueryHit]:
     """
     Performs an optimized, multi-stage search without FTS5.
     - Handles multi-word AND logic, exact phrases, and improved scoring.
     - **FIXED**: Correctly returns all recent notes when the query string is empty.
+    - Supports AND/OR/NOT, parentheses and title:/tag:/created:/updated:
+      clauses (see query_language), evaluating the most selective first.
+    - With fuzzy=True, a keyword that is not one of the author's words also
+      matches the author's words within a small edit distance of it.
+    - Bounded in cost like run_query(), whose hits it returns.
     """
-    cur = conn.cursor()
+    return run_query(conn, author, q, limit, fuzzy).hits
+
+
+def run_query(conn: sqlite3.Connection, author: str, q: str, limit: int = 20, fuzzy: bool = False,
+              budget: float = SEARCH_TIME_BUDGET) -> SearchResult:
+    """
+    Searches like query(), with its cost bounded: the query string is cut to
+    MAX_QUERY_LENGTH, the parsed query is limited by query_language.limit_query
+    and the SQL scan is interrupted after `budget` seconds, in which case the
+    hits are ranked from the candidates found so far (the most recent first).
+    The result's `truncated` names every limit that applied.
+    """
+    truncated: List[str] = []
+    if len(q) > MAX_QUERY_LENGTH:
+        q = q[:MAX_QUERY_LENGTH]
+        truncated.append("length")
 
     # Handle the empty query case to show all notes 
     # If the search query is empty, fetch the most recent notes for the user.
+    # Bodies are not read: the listing comes from the covering index with precomputed snippets.
     if not q.strip():
-        cur.execute("""
-            SELECT id, user_facing_id, title, body, created_at
+        all_notes = [
+            QueryHit(id=p.id, user_facing_id=p.user_facing_id, created_at=p.created_at, title=p.title,
+                     score=0, snippet=p.snippet or "")
+            for p in list_particles(conn, author, limit)
+        ]
+        return SearchResult(all_notes, tuple(truncated))
+
+    # If the query is NOT empty, parse it and plan the most selective clauses first
+    tree, limited = limit_query(parse(q))
+    truncated += limited
+    if tree is None:
+        return SearchResult([], tuple(truncated))
+    variants = _fuzzy_variants(conn, author, tree) if fuzzy else {}
+    plan = plan_query(tree, author, variants)
+
+    # Candidate Selection (SQL): the plan's WHERE clause is exact, so every
+    # returned row matches and Python only has to score it. Rows come back as
+    # plain (id, user_facing_id, title, text, created_at) tuples, newest first
+    # (a backwards walk of the author index), so an interrupted scan keeps
+    # the most recent matches. text is the body's plain text, never compressed.
+    # Other backends evaluate the plan themselves and return the same rows.
+    if isinstance(conn, sqlite3.Connection):
+        cur = conn.cursor()
+        cur.row_factory = None
+        candidate_rows, timed_out = _fetch_within(conn, cur, f"""
+            SELECT id, user_facing_id, title, {SEARCH_TEXT}, created_at
             FROM particles
-            WHERE author = ?
-            ORDER BY user_facing_id DESC
-            LIMIT ?
-        """, (author, limit))
-        
-        all_notes = []
-        for row in cur.fetchall():
-            snippet = row["body"][:120] + ("..." if len(row["body"]) > 120 else "")
-            all_notes.append(QueryHit(
-                id=row["id"],
-                user_facing_id=row["user_facing_id"],
-                created_at=row["created_at"],
-                title=row["title"],
-                score=0, 
-                snippet=snippet
-            ))
-        return all_notes
-
-    # If the query is NOT empty, proceed 
-    keywords, phrases = parse_query(q)
-    all_terms = keywords + phrases
-    
-    if not all_terms:
-        return []
-
-    # Broad Candidate Selection (SQL) 
-    where_conditions = []
-    params = []
-    for term in all_terms:
-        like_term = f"%{term}%"
-        where_conditions.append("(lower(title) LIKE ? OR lower(body) LIKE ?)")
-        params.extend([like_term, like_term])
-    
-    sql_candidates = """
-        SELECT id, user_facing_id, title, body, created_at
-        FROM particles
-        WHERE author = ? AND ({})
-    """.format(" OR ".join(where_conditions))
-    
-    sql_params = tuple([author] + params)
-    cur.execute(sql_candidates, sql_params)
-    candidate_rows = cur.fetchall()
+            WHERE author = ? AND {plan.where}
+            ORDER BY created_at DESC
+        """, (author,) + plan.params, budget)
+    else:
+        candidate_rows, timed_out = conn.search_candidates(author, plan, variants, budget)
+    if timed_out:
+        truncated.append("time")
+    metrics.SEARCH_CANDIDATES.observe(len(candidate_rows))
 
-    # Precise Filtering & Scoring (Python) 
-    final_results = []
-    for row in candidate_rows:
-        title_lower = row["title"].lower()
-        body_lower = row["body"].lower()
+    # Scoring (Python)
+    scored = [
+        (score(plan.root, row[2].lower(), row[3].lower(), variants), row)
+        for row in candidate_rows
+    ]
+    scored.sort(key=itemgetter(0), reverse=True)
 
-        all_keywords_present = all(kw in title_lower or kw in body_lower for kw in keywords)
-        all_phrases_present = all(ph in title_lower or ph in body_lower for ph in phrases)
+    # Snippets are only built for the final top-k, never for discarded candidates.
+    snippet_terms = [t.text for t in positive_terms(plan.root) if t.field != "title"]
+    snippet_terms += [v for t in snippet_terms for v in variants.get(t, [])]
+    output: List[QueryHit] = []
+    for hit_score, (pid, user_facing_id, title, body, created_at) in scored[:limit]:
+        snippet, highlights = make_snippet(body, snippet_terms)
+        output.append(QueryHit(pid, user_facing_id, created_at, title, hit_score, snippet, highlights))
 
-        if not (all_keywords_present and all_phrases_present):
-            continue
+    metrics.SEARCH_RESULTS.observe(len(output))
+    return SearchResult(output, tuple(truncated))
 
-        score = 0
-        for kw in keywords:
-            if kw in title_lower: score += 5
-            if kw in body_lower: score += 2
-        for ph in phrases:
-            if ph in title_lower: score += 20
-            if ph in body_lower: score += 10
 
-        final_results.append({"row": row, "score": score})
+def query_key(q: str) -> Tuple:
+    """
+    A hashable key equal for query strings run_query treats identically,
+    e.g. differing only in case or spacing: the parsed query tree.
+    """
+    cut = len(q) > MAX_QUERY_LENGTH
+    q = q[:MAX_QUERY_LENGTH]
+    return (cut, parse(q)) if q.strip() else (cut, "")
 
-    sorted_results = sorted(final_results, key=lambda x: x["score"], reverse=True)
-    
-    output: List[QueryHit] = []
-    for result in sorted_results[:limit]:
-        row_data = result["row"]
-        snippet = row_data["body"][:120] + ("..." if len(row_data["body"]) > 120 else "")
-        output.append(QueryHit(
-            id=row_data["id"],
-            user_facing_id=row_data["user_facing_id"],
-            created_at=row_data["created_at"],
-            title=row_data["title"],
-            score=result["score"],
-            snippet=snippet
-        ))
-
-    return output
 
+def _fetch_within(conn: sqlite3.Connection, cur: sqlite3.Cursor, sql: str, params: tuple,
+                  budget: float) -> Tuple[List[tuple], bool]:
+    """
+    Runs a query, fetching in batches until done or until `budget` seconds
+    have passed, when SQLite's progress handler interrupts the scan.
+
+    Returns:
+        The rows fetched and whether the scan was interrupted.
+    """
+    deadline = time.perf_counter() + budget
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, _PROGRESS_STEPS)
+    rows: List[tuple] = []
+    try:
+        cur.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(_FETCH_BATCH)
+            if not batch:
+                return rows, False
+            rows.extend(batch)
+    except sqlite3.OperationalError:
+        if time.perf_counter() <= deadline:
+            raise  # a real error, not our interrupt
+        return rows, True
+    finally:
+        conn.set_progress_handler(None, 0)
+        cur.close()  # records the statement with profiling cursors, whether or not it finished
+
+
+def _fuzzy_variants(conn: sqlite3.Connection, author: str, tree) -> Dict[str, List[str]]:
+    """Typo tolerance: keyword -> near-miss terms from the author's dictionary."""
+    dictionary = term_dictionary(conn, author)
+    variants: Dict[str, List[str]] = {}
+    for term in positive_terms(tree):
+        if not term.phrase and term.text not in dictionary:
+            variants[term.text] = expand(dictionary, term.text)
+    return variants
+
+
+def explain_query(conn: sqlite3.Connection, author: str, q: str, fuzzy: bool = False) -> List[str]:
+    """
+    Returns an EXPLAIN-style description of how query() evaluates q: the
+    parsed query, the clause order chosen by the planner with per-clause
+    match counts and timings, the SQL and SQLite's own query plan.
+    """
+    tree, limited = limit_query(parse(q[:MAX_QUERY_LENGTH]))
+    if tree is None:
+        return [f"query: {q!r}", "plan: empty query lists the most recent particles"]
+    variants = _fuzzy_variants(conn, author, tree) if fuzzy else {}
+    plan = plan_query(tree, author, variants)
+    lines = [f"query: {q!r}", f"parsed: {describe(tree)}", f"ordered: {describe(plan.root)}"]
+    if limited:
+        lines.append(f"limited: {', '.join(limited)}")
+    lines += [f"fuzzy: {word} -> {', '.join(alts)}" for word, alts in variants.items() if alts]
+    if not isinstance(conn, sqlite3.Connection):
+        return lines + conn.explain(author, plan, variants)
+    return lines + explain(conn, author, plan, variants)
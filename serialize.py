@@ -0,0 +1,53 @@
+"""
+This module encodes Particle and QueryHit tuples straight to JSON bytes for
+API responses, skipping pydantic model construction, response validation and
+jsonable_encoder. Tags are emitted as sorted lists so output is stable.
+
+orjson is used when it is installed; the standard library json module (whose
+encoder is also C-accelerated) is the fallback.
+"""
+
+import json
+from typing import Any, Dict, Iterable, List
+
+from pim_types import Particle, QueryHit
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+_PARTICLE_FIELDS = Particle._fields
+_HIT_FIELDS = QueryHit._fields
+_TAGS = _PARTICLE_FIELDS.index("tags")
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON encoding of plain dicts, lists, strings and numbers."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def particle_dict(p: Particle) -> Dict[str, Any]:
+    """A Particle as a JSON-ready dict, with tags as a sorted list."""
+    values = list(p)
+    values[_TAGS] = sorted(p.tags)
+    return dict(zip(_PARTICLE_FIELDS, values))
+
+
+def hit_dict(h: QueryHit) -> Dict[str, Any]:
+    """A QueryHit as a JSON-ready dict (tuples, such as highlights, encode as arrays)."""
+    return dict(zip(_HIT_FIELDS, h))
+
+
+def particle_json(p: Particle) -> bytes:
+    return dumps(particle_dict(p))
+
+
+def particles_json(particles: Iterable[Particle]) -> bytes:
+    return dumps([particle_dict(p) for p in particles])
+
+
+def hits_json(hits: List[QueryHit]) -> bytes:
+    return dumps([hit_dict(h) for h in hits])
@@ -0,0 +1,172 @@
+"""
+This module spreads authors' particles over several SQLite database files.
+
+A small directory database holds users, sessions and the shard each author
+is assigned to; every author's particles live entirely in one shard file, so
+storage, search and edit_particles work unchanged on the shard connection and
+writers for authors on different shards never wait on the same lock.
+
+New authors are placed by rendezvous (highest random weight) hashing on the
+username, so adding a shard only moves the authors that hash to it.
+Assignments are persisted, and rebalance() moves authors whose hashed shard
+no longer matches their assignment after the shard list changes.
+
+    python -m sharding rebalance --directory dir.db --shards s0.db s1.db s2.db
+"""
+
+import argparse
+import hashlib
+import sqlite3
+from typing import List, Optional, Tuple
+
+import storage
+
+
+def rendezvous_shard(author: str, shards: List[str]) -> str:
+    """The shard with the highest hash weight for this author (stable across processes)."""
+    def weight(shard: str) -> int:
+        return int.from_bytes(hashlib.blake2b(f"{shard}:{author}".encode(), digest_size=8).digest(), "big")
+    return max(shards, key=weight)
+
+
+def _create_assignments(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS shard_assignments (
+        username TEXT PRIMARY KEY,
+        shard TEXT NOT NULL
+    )
+    """)
+    conn.commit()
+
+
+class ShardRouter:
+    """Routes an author to the database file holding their particles."""
+
+    def __init__(self, directory_path: str, shard_paths: List[str]):
+        if not shard_paths:
+            raise ValueError("At least one shard is required")
+        self.directory_path = directory_path
+        self.shard_paths = list(shard_paths)
+        self._assignments_created = False
+
+    def _ensure_assignments(self, directory: sqlite3.Connection) -> None:
+        # Once per router: the API keeps one router for all requests.
+        if not self._assignments_created:
+            _create_assignments(directory)
+            self._assignments_created = True
+
+    def directory(self) -> sqlite3.Connection:
+        """A connection to the directory database (users, sessions, assignments)."""
+        conn = storage.make_connection(self.directory_path)
+        self._ensure_assignments(conn)
+        return conn
+
+    def shard_for(self, directory: sqlite3.Connection, author: str) -> str:
+        """The author's shard path, assigning one by hashing on first use."""
+        self._ensure_assignments(directory)
+        row = directory.execute("SELECT shard FROM shard_assignments WHERE username = ?", (author,)).fetchone()
+        if row:
+            return row[0]
+        shard = rendezvous_shard(author, self.shard_paths)
+        directory.execute("INSERT OR IGNORE INTO shard_assignments (username, shard) VALUES (?, ?)", (author, shard))
+        directory.commit()
+        # Re-read in case another process assigned the author concurrently.
+        return directory.execute("SELECT shard FROM shard_assignments WHERE username = ?", (author,)).fetchone()[0]
+
+    def connect(self, directory: sqlite3.Connection, author: str, **connect_args) -> sqlite3.Connection:
+        """Opens the shard connection holding the author's particles (connect_args go to make_connection)."""
+        return storage.make_connection(self.shard_for(directory, author), **connect_args)
+
+
+def move_author(author: str, source_path: str, target_path: str) -> int:
+    """
+    Moves an author's particles (and deletion tombstones) from one shard to
+    another. The target's change log sequence is first raised above the
+    source's, so sync cursors the author's clients hold stay valid.
+
+    Returns:
+        The number of particles moved.
+    """
+    target = storage.make_connection(target_path)
+    try:
+        target.execute("ATTACH DATABASE ? AS src", (source_path,))
+        target.execute("BEGIN IMMEDIATE")
+        source_seq = target.execute("SELECT COALESCE(MAX(seq), 0) FROM src.particle_changes").fetchone()[0]
+        raised = target.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'particle_changes'", (source_seq,))
+        if raised.rowcount == 0:  # no AUTOINCREMENT row yet (sqlite_sequence has no unique key)
+            target.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('particle_changes', ?)", (source_seq,))
+
+        cur = target.cursor()
+        cur.row_factory = storage.particle_row
+        particles = cur.execute(
+            f"SELECT {storage.PARTICLE_COLUMNS} FROM src.particles WHERE author = ? ORDER BY created_at", (author,)
+        ).fetchall()
+        tombstones = target.execute(
+            "SELECT particle_id FROM src.particle_changes WHERE author = ? AND deleted = 1 ORDER BY seq", (author,)
+        ).fetchall()
+        target.commit()
+        for p in particles:
+            storage.save_particle(target, p)
+        target.executemany(
+            "INSERT OR IGNORE INTO particle_changes (particle_id, author, deleted) VALUES (?, ?, 1)",
+            [(pid, author) for (pid,) in tombstones])
+        target.commit()
+        target.execute("DETACH DATABASE src")
+    finally:
+        target.close()
+
+    source = storage.make_connection(source_path)
+    try:
+        source.execute("DELETE FROM particles WHERE author = ?", (author,))
+        source.execute("DELETE FROM particle_changes WHERE author = ?", (author,))
+        source.commit()
+    finally:
+        source.close()
+    return len(particles)
+
+
+def rebalance(router: ShardRouter, dry_run: bool = False) -> List[Tuple[str, str, str]]:
+    """
+    Moves every author whose assigned shard differs from their hashed shard
+    under the router's current shard list (e.g. after adding or removing a
+    shard). Run it while the application is stopped or read-only.
+
+    Returns:
+        (author, from_shard, to_shard) for each author moved (or to move).
+    """
+    directory = router.directory()
+    try:
+        moves = []
+        for author, current in directory.execute("SELECT username, shard FROM shard_assignments").fetchall():
+            desired = rendezvous_shard(author, router.shard_paths)
+            if desired != current:
+                moves.append((author, current, desired))
+        if dry_run:
+            return moves
+        for author, current, desired in moves:
+            move_author(author, current, desired)
+            directory.execute("UPDATE shard_assignments SET shard = ? WHERE username = ?", (desired, author))
+            directory.commit()
+        return moves
+    finally:
+        directory.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Manage per-author database shards.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("rebalance", help="move authors to their hashed shard for a new shard list")
+    p.add_argument("--directory", required=True)
+    p.add_argument("--shards", nargs="+", required=True)
+    p.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    moves = rebalance(ShardRouter(args.directory, args.shards), dry_run=args.dry_run)
+    for author, current, desired in moves:
+        print(f"{author}: {current} -> {desired}")
+    print(f"{len(moves)} author(s) {'to move' if args.dry_run else 'moved'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+This module coalesces identical concurrent work ("single flight").
+
+The first caller of Group.do(key, fn) runs fn; callers arriving with the
+same key while it runs wait for it and receive the same result, or the same
+exception. Nothing is cached: once the call finishes, the next caller with
+that key runs fn again, so coalescing never returns data older than a
+request that was already in flight.
+
+Endpoints run on threadpool threads, so waiting is a threading.Event wait.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import metrics
+
+COALESCED = metrics.registry.register(metrics.Counter(
+    "pim_coalesced_requests_total", "Requests served by another request's in-flight computation.", ("kind",)))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class Group:
+    """In-flight calls by key. Thread-safe."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """fn(), or the result of the in-flight fn() of an earlier caller with the same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+        if not leader:
+            COALESCED.inc(self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def waiters(self, key: Hashable) -> int:
+        """Callers currently waiting on the in-flight call for key."""
+        with self._lock:
+            call = self._calls.get(key)
+            return call.waiters if call is not None else 0
@@ -54,6 +54,24 @@ async function fetchParticleById(particleId, token) {
   return await response.json();
 }
 
+/**
+ * Fetches several particles in one request.
+ * @param {string[]} particleIds - The IDs of the particles to fetch (at most 100).
+ * @param {string} token - The user's session token.
+ * @returns {Promise<object[]|null>} - One {id, status, particle?} entry per ID, in order, or null on failure.
+ */
+async function fetchParticlesByIds(particleIds, token) {
+  const response = await fetch(`/particles/batch?session=${token}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ids: particleIds }),
+  });
+  if (!response.ok) {
+    return null;
+  }
+  return (await response.json()).results;
+}
+
 /**
  * Makes a POST request to a given endpoint.
  * @param {string} endpoint - The API endpoint to call.
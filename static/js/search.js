@@ -5,8 +5,27 @@ function initializeSearchPage(token) {
   const searchForm = document.querySelector('.searchbar');
   const searchInput = searchForm.querySelector('.input');
   const createButton = searchForm.querySelector('a.btn');
+  const tableBody = document.querySelector('.table tbody');
+  let currentQuery = '';
+
+  const renderRow = (p) => {
+    const row = document.createElement('tr');
+    row.dataset.id = p.id;
+    const formattedDate = new Date(p.created_at).toLocaleDateString();
+    row.innerHTML = `
+      <td>#${p.user_facing_id}</td>
+      <td>${formattedDate}</td>
+      <td class="table__title">${p.title}</td>
+      <td class="table__actions">
+        <a class="btn btn--success" href="/viewer.html?id=${p.id}">View</a>
+        <a class="btn" href="/editor.html?id=${p.id}">Edit</a>
+      </td>
+    `;
+    return row;
+  };
 
   const displayParticles = async (query = '') => {
+    currentQuery = query;
     const response = await fetch(`/search?q=${encodeURIComponent(query)}&session=${token}`);
     if (!response.ok) {
       alert('Session expired. Please log in again.');
@@ -16,24 +35,66 @@ function initializeSearchPage(token) {
     }
     
     const particles = await response.json();
-    const tableBody = document.querySelector('.table tbody');
     tableBody.innerHTML = ''; // Clear existing results
-    particles.forEach(p => {
-      const row = document.createElement('tr');
-      const formattedDate = new Date(p.created_at).toLocaleDateString();
-      row.innerHTML = `
-        <td>#${p.user_facing_id}</td>
-        <td>${formattedDate}</td>
-        <td class="table__title">${p.title}</td>
-        <td class="table__actions">
-          <a class="btn btn--success" href="/viewer.html?id=${p.id}">View</a>
-          <a class="btn" href="/editor.html?id=${p.id}">Edit</a>
-        </td>
-      `;
-      tableBody.appendChild(row);
+    particles.forEach(p => tableBody.appendChild(renderRow(p)));
+    if (response.headers.get('X-Search-Truncated')) {
+      // The server simplified the query or stopped scanning early.
+      const note = document.createElement('tr');
+      note.innerHTML = '<td colspan="4">Showing partial results: try a shorter or more specific search.</td>';
+      tableBody.appendChild(note);
+    }
+  };
+
+  // Live updates from other tabs: patch the listing row by row instead of
+  // polling /search. A filtered listing is re-run, since a change can move a
+  // note in or out of the results. Notes changed within BATCH_DELAY_MS of
+  // each other are fetched with one batch request.
+  const BATCH_DELAY_MS = 50;
+  const MAX_BATCH = 100; // the server's MAX_BATCH_SIZE
+  const pending = new Set();
+  let batchTimer = null;
+
+  const fetchPending = async () => {
+    batchTimer = null;
+    const ids = [...pending].slice(0, MAX_BATCH);
+    ids.forEach(id => pending.delete(id));
+    if (pending.size) batchTimer = setTimeout(fetchPending, 0);
+    const results = await fetchParticlesByIds(ids, token);
+    if (!results) return;
+    results.forEach(result => {
+      if (result.status !== 200) return; // deleted meanwhile
+      const existing = tableBody.querySelector(`tr[data-id="${result.id}"]`);
+      const row = renderRow(result.particle);
+      if (existing) {
+        existing.replaceWith(row);
+      } else {
+        tableBody.prepend(row);
+      }
     });
   };
 
+  const applyChange = (kind, change) => {
+    if (kind === 'deleted') {
+      pending.delete(change.id);
+      const existing = tableBody.querySelector(`tr[data-id="${change.id}"]`);
+      if (existing) existing.remove();
+      return;
+    }
+    if (currentQuery) {
+      displayParticles(currentQuery);
+      return;
+    }
+    pending.add(change.id);
+    if (!batchTimer) batchTimer = setTimeout(fetchPending, BATCH_DELAY_MS);
+  };
+
+  const liveEvents = new EventSource(`/events?session=${token}`);
+  ['created', 'updated', 'deleted'].forEach(kind => {
+    liveEvents.addEventListener(kind, (e) => applyChange(kind, JSON.parse(e.data)));
+  });
+  // Sent when this tab fell too far behind and events were dropped.
+  liveEvents.addEventListener('resync', () => displayParticles(currentQuery));
+
   searchForm.addEventListener('submit', (e) => {
     e.preventDefault();
     displayParticles(searchInput.value);
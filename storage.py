@@ -2,20 +2,72 @@
 This module handles all direct interactions with the SQLite database.
 It includes functions for creating the database schema and performing CRUD
 (Create, Read, Update, Delete) operations on particles.
+
+The data functions also accept any backend.Backend in place of the
+connection and then delegate to it (see _dispatch).
 """
 
+import os
 import sqlite3
-from typing import Optional, List
-from pim_types import Particle, ParticleId
+import threading
+from functools import lru_cache, wraps
+from typing import Optional, List, FrozenSet, Dict, Set, Tuple, Type, Union
+from pim_types import Particle, ParticleId, Change, ParticleSummary
+from codec import encode_body, decode_body, plain_text, search_text
+
+SCHEMA_VERSION = 7
+SNIPPET_WIDTH = 120
+
+# SQL for a particle's plain text, which search reads instead of the (maybe compressed) body.
+SEARCH_TEXT = "COALESCE(body_text, body)"
+
+
+def _dispatch(fn):
+    """
+    Lets a storage function be called with any backend.Backend in place of
+    a connection: the call then goes to the backend's method of the same
+    name. The function body is the SQLite implementation.
+    """
+    @wraps(fn)
+    def wrapper(conn, *args, **kwargs):
+        if isinstance(conn, sqlite3.Connection):
+            return fn(conn, *args, **kwargs)
+        return getattr(conn, fn.__name__)(*args, **kwargs)
+    return wrapper
+
+
+# Columns in Particle field order, so a fetched row maps onto Particle positionally.
+PARTICLE_COLUMNS = "id, user_id, user_facing_id, title, body, author, tags, created_at, updated_at"
 
+# Database files (absolute paths) whose schema make_connection has brought up to date in this process.
+_initialized: Set[str] = set()
+_initialize_lock = threading.Lock()
 
-def make_connection(db_path: str = "pim.db") -> sqlite3.Connection:
+
+def make_connection(db_path: str = "pim.db", check_same_thread: bool = True,
+                    factory: Type[sqlite3.Connection] = sqlite3.Connection) -> sqlite3.Connection:
     """
     Open (or create) a SQLite database and ensure tables exist.
+
+    The schema is created and migrated on the first connection to a file
+    in this process (and again if the file has gone); later connections,
+    such as one per web request, only connect.
+
+    Pass check_same_thread=False for a connection that is handed between
+    threads (but never used by two at once), as the web app's request
+    dependencies are, and a Connection subclass as `factory` to instrument
+    it (see profiling.ProfiledConnection).
     """
-    conn = sqlite3.connect(db_path)
+    key = None if db_path in ("", ":memory:") else os.path.abspath(db_path)
+    ready = key in _initialized and os.path.exists(key)
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, factory=factory)
     conn.row_factory = sqlite3.Row  # dict-like row access
-    _create_tables(conn)
+    if not ready:
+        with _initialize_lock:
+            _create_tables(conn)
+            _migrate(conn)
+        if key is not None:
+            _initialized.add(key)
     return conn
 
 
@@ -47,31 +99,222 @@ def _create_tables(conn: sqlite3.Connection) -> None:
         created_at TEXT,
         updated_at TEXT,
         author TEXT,
+        snippet TEXT,  -- body_snippet of the plain text, kept so listings never read bodies
+        body_text TEXT,  -- codec.search_text: plain text, NULL when body is that text
+        normalized_title TEXT,  -- normalize_title(title), unique per author
         FOREIGN KEY (user_id) REFERENCES users(id),
         UNIQUE(author, user_facing_id)
     )
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_particles_author_created ON particles(author, created_at)")
+    # One row per (particle, lowercased tag) so tag filters are index lookups
+    # instead of scans of the comma-joined particles.tags column.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS particle_tags (
+        particle_id TEXT NOT NULL,
+        author TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        PRIMARY KEY (particle_id, tag)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_particle_tags_author_tag ON particle_tags(author, tag)")
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS particles_tags_delete AFTER DELETE ON particles
+    BEGIN
+        DELETE FROM particle_tags WHERE particle_id = OLD.id;
+    END
+    """)
+    # Change log for incremental sync: one row per particle holding the
+    # sequence number of its latest change, or a tombstone once deleted.
+    # AUTOINCREMENT keeps sequence numbers strictly increasing, never reused.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS particle_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        particle_id TEXT NOT NULL UNIQUE,
+        author TEXT NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_particle_changes_author_seq ON particle_changes(author, seq)")
+    for name, event, row, deleted in (
+        ("particles_changes_insert", "AFTER INSERT ON particles", "NEW", 0),
+        # Only columns a client sees: backfills of derived columns (snippet,
+        # body_text, normalized_title) are not changes.
+        ("particles_changes_update", "AFTER UPDATE OF title, body, tags, author ON particles", "NEW", 0),
+        ("particles_changes_delete", "AFTER DELETE ON particles", "OLD", 1),
+    ):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name} {event}
+        BEGIN
+            DELETE FROM particle_changes WHERE particle_id = {row}.id;
+            INSERT INTO particle_changes (particle_id, author, deleted) VALUES ({row}.id, {row}.author, {deleted});
+        END
+        """)
+    conn.commit()
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Bring a database created by an older version up to SCHEMA_VERSION."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    cur = conn.cursor()
+    # Backfills rewrite rows without changing what a user sees (v4 re-encodes
+    # bodies), so they must not appear in the sync change log; _create_tables
+    # restores the trigger, in its current definition.
+    cur.execute("DROP TRIGGER IF EXISTS particles_changes_update")
+    if version < 1:
+        # particle_tags was added after particles: index the tags already stored.
+        cur.execute("SELECT id, author, tags FROM particles WHERE tags IS NOT NULL AND tags != ''")
+        for pid, author, tags in cur.fetchall():
+            _save_tags(cur, pid, author, set(tags.split(",")))
+    if version < 2:
+        # Seed the change log so a first sync from cursor 0 sees every particle.
+        cur.execute("""
+            INSERT OR IGNORE INTO particle_changes (particle_id, author)
+            SELECT id, author FROM particles ORDER BY created_at
+        """)
+    if version < 3:
+        # The snippet column and the listing index that covers it. Created
+        # here rather than in _create_tables, which runs before an older
+        # particles table has gained the column.
+        if "snippet" not in {row[1] for row in cur.execute("PRAGMA table_info(particles)").fetchall()}:
+            cur.execute("ALTER TABLE particles ADD COLUMN snippet TEXT")
+        cur.execute("SELECT id, body FROM particles WHERE snippet IS NULL")
+        cur.executemany("UPDATE particles SET snippet = ? WHERE id = ?",
+                        [(body_snippet(plain_text(body)), pid) for pid, body in cur.fetchall()])
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_particles_listing
+            ON particles(author, user_facing_id, created_at, title, snippet, id)
+        """)
+    if version < 4:
+        # Compress large bodies and split out the plain text search reads.
+        if "body_text" not in {row[1] for row in cur.execute("PRAGMA table_info(particles)").fetchall()}:
+            cur.execute("ALTER TABLE particles ADD COLUMN body_text TEXT")
+        cur.execute("SELECT id, body FROM particles")
+        for pid, body in cur.fetchall():
+            stored, text, snippet = body_columns(decode_body(body))
+            if stored != body or text is not None:
+                cur.execute("UPDATE particles SET body = ?, body_text = ?, snippet = ? WHERE id = ?",
+                            (stored, text, snippet, pid))
+    if version < 5:
+        if "normalized_title" not in {row[1] for row in cur.execute("PRAGMA table_info(particles)").fetchall()}:
+            cur.execute("ALTER TABLE particles ADD COLUMN normalized_title TEXT")
+        # Titles used to be unique only up to case, so two may normalize alike
+        # (e.g. "To do" and "To  do"); later ones get a " (2)"-style suffix
+        # that no other title uses, so titles that were unique keep theirs.
+        cur.execute("SELECT id, author, title FROM particles ORDER BY created_at, user_facing_id")
+        rows = cur.fetchall()
+        taken = {(author, normalize_title(title)) for _, author, title in rows}
+        kept = set()
+        for pid, author, title in rows:
+            new_title, n = title, 1
+            if (author, normalize_title(title)) in kept:
+                while (author, normalize_title(new_title)) in taken:
+                    n += 1
+                    new_title = f"{title} ({n})"
+                taken.add((author, normalize_title(new_title)))
+            kept.add((author, normalize_title(new_title)))
+            cur.execute("UPDATE particles SET normalized_title = ? WHERE id = ?", (normalize_title(new_title), pid))
+            if new_title != title:  # a visible change: sync clients must refetch it
+                cur.execute("UPDATE particles SET title = ? WHERE id = ?", (new_title, pid))
+                cur.execute("DELETE FROM particle_changes WHERE particle_id = ?", (pid,))
+                cur.execute("INSERT INTO particle_changes (particle_id, author) VALUES (?, ?)", (pid, author))
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_particles_author_normalized_title
+            ON particles(author, normalized_title)
+        """)
+    if version < 6:
+        # Per-author write counters, superseded by the change log.
+        for event in ("insert", "update", "delete"):
+            cur.execute(f"DROP TRIGGER IF EXISTS particles_generation_{event}")
+        cur.execute("DROP TABLE IF EXISTS author_generation")
+    # Version 7 only narrows particles_changes_update to the visible columns (recreated below).
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
+    _create_tables(conn)
+
+
+def _save_tags(cur: sqlite3.Cursor, pid: ParticleId, author: str, tags) -> None:
+    """Replace the particle_tags rows of a particle."""
+    cur.execute("DELETE FROM particle_tags WHERE particle_id = ?", (pid,))
+    cur.executemany(
+        "INSERT OR IGNORE INTO particle_tags (particle_id, author, tag) VALUES (?, ?, ?)",
+        [(pid, author, tag.lower()) for tag in tags if tag]
+    )
+
+
+class DuplicateTitleError(ValueError):
+    """The author already has a particle whose title normalizes to the same text."""
+
+
+def normalize_title(title: str) -> str:
+    """The form in which titles must be unique per author: lowercased, whitespace collapsed."""
+    return " ".join(title.lower().split())
+
+
+def body_snippet(body: str, width: int = SNIPPET_WIDTH) -> str:
+    """The leading `width` characters of the body, with an ellipsis if cut."""
+    return body[:width] + ("..." if len(body) > width else "")
+
 
+def body_columns(body: str) -> Tuple[Union[str, bytes], Optional[str], str]:
+    """The (body, body_text, snippet) column values stored for a body."""
+    stored = encode_body(body)
+    text = search_text(body, stored)
+    return stored, text, body_snippet(body if text is None else text)
 
 
+@_dispatch
 def save_particle(conn: sqlite3.Connection, p: Particle):
-    """Insert or update a particle."""
-    tags_str = ",".join(sorted(list(p.tags)))
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO particles (id, user_id, user_facing_id, title, body, tags, created_at, updated_at, author)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            title=excluded.title,
-            body=excluded.body,
-            tags=excluded.tags,
-            updated_at=excluded.updated_at
-    """, (p.id, p.user_id, p.user_facing_id, p.title, p.body, tags_str, p.created_at, p.updated_at, p.author))
+    """
+    Insert or update a particle.
 
+    Raises:
+        DuplicateTitleError: If another of the author's particles has the same normalized title.
+    """
+    try:
+        write_particle(conn, p)
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
 
 
+def write_particle(conn: sqlite3.Connection, p: Particle) -> None:
+    """
+    save_particle without the commit, for callers that make several writes
+    in one transaction (SQLite only).
+
+    Raises:
+        DuplicateTitleError: If another of the author's particles has the same normalized title.
+    """
+    tags_str = ",".join(sorted(list(p.tags)))
+    body, text, snippet = body_columns(p.body)
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO particles (id, user_id, user_facing_id, title, body, tags, created_at, updated_at, author,
+                                   body_text, snippet, normalized_title)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                title=excluded.title,
+                body=excluded.body,
+                tags=excluded.tags,
+                updated_at=excluded.updated_at,
+                body_text=excluded.body_text,
+                snippet=excluded.snippet,
+                normalized_title=excluded.normalized_title
+        """, (p.id, p.user_id, p.user_facing_id, p.title, body, tags_str, p.created_at, p.updated_at, p.author,
+              text, snippet, normalize_title(p.title)))
+    except sqlite3.IntegrityError as e:
+        if "normalized_title" in str(e):
+            raise DuplicateTitleError("You already have a particle with this title") from e
+        raise
+    _save_tags(cur, p.id, p.author, p.tags)
+
+
+@_dispatch
 def delete_particle(conn: sqlite3.Connection, pid: ParticleId) -> bool:
     """Delete a particle by id. Return True if deleted."""
     cur = conn.cursor()
@@ -80,63 +323,174 @@ def delete_particle(conn: sqlite3.Connection, pid: ParticleId) -> bool:
     return cur.rowcount > 0
 
 
+@lru_cache(maxsize=4096)
+def decode_tags(tags: Optional[str]) -> FrozenSet[str]:
+    """
+    Decode the comma-joined tags column. Memoized: notes tend to share a few
+    tag combinations, so rows with the same tags share one frozenset and the
+    split happens once per distinct value rather than once per row.
+    """
+    return frozenset(tags.split(",")) if tags else frozenset()
+
+
+def particle_row(cursor: sqlite3.Cursor, row: tuple) -> Particle:
+    """Row factory building a Particle from a raw `SELECT PARTICLE_COLUMNS` tuple, decompressing its body."""
+    return Particle(row[0], row[1], row[2], row[3], decode_body(row[4]), row[5], decode_tags(row[6]), row[7], row[8])
+
+
+def _particle_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """A cursor whose rows come back as Particles."""
+    cur = conn.cursor()
+    cur.row_factory = particle_row
+    return cur
+
+
+@_dispatch
 def get_particle(conn: sqlite3.Connection, pid: ParticleId) -> Optional[Particle]:
     """Fetch a particle by id. Return None if not found."""
+    cur = _particle_cursor(conn)
+    cur.execute(f"SELECT {PARTICLE_COLUMNS} FROM particles WHERE id = ?", (pid,))
+    return cur.fetchone()
+
+
+@_dispatch
+def get_particles(conn: sqlite3.Connection, pids: List[ParticleId]) -> Dict[ParticleId, Particle]:
+    """Fetch several particles by id in one query. Ids that do not exist are absent from the result."""
+    if not pids:
+        return {}
+    cur = _particle_cursor(conn)
+    placeholders = ",".join("?" * len(pids))
+    cur.execute(f"SELECT {PARTICLE_COLUMNS} FROM particles WHERE id IN ({placeholders})", tuple(pids))
+    return {p.id: p for p in cur.fetchall()}
+
+
+@_dispatch
+def get_changes(conn: sqlite3.Connection, author: str, since: int, limit: int) -> Tuple[List[Change], bool]:
+    """
+    Fetch an author's changes with a sequence number above `since`, oldest
+    first, at most `limit` of them. Each particle appears at most once, at
+    its latest change; deleted particles come back as tombstones.
+
+    Returns:
+        (changes, has_more) where has_more says whether more changes follow.
+    """
     cur = conn.cursor()
-    cur.execute("SELECT * FROM particles WHERE id = ?", (pid,))
-    row = cur.fetchone()
-    if not row:
-        return None
-    return Particle(
-        id=row["id"],
-        user_id=row["user_id"],
-        user_facing_id=row["user_facing_id"],
-        title=row["title"],
-        body=row["body"],
-        author=row["author"],
-        tags=set(row["tags"].split(",")) if row["tags"] else set(),
-        created_at=row["created_at"],
-        updated_at=row["updated_at"]
-    )
+    cur.row_factory = None
+    columns = ", ".join(f"p.{c}" for c in PARTICLE_COLUMNS.split(", "))
+    cur.execute(f"""
+        SELECT c.seq, c.particle_id, c.deleted, {columns}
+        FROM particle_changes c
+        LEFT JOIN particles p ON p.id = c.particle_id AND c.deleted = 0
+        WHERE c.author = ? AND c.seq > ?
+        ORDER BY c.seq
+        LIMIT ?
+    """, (author, since, limit + 1))
+    rows = cur.fetchall()
+    changes = [
+        Change(row[0], row[1], bool(row[2]), None if row[2] else particle_row(cur, row[3:]))
+        for row in rows[:limit]
+    ]
+    return changes, len(rows) > limit
+
+
+@_dispatch
+def get_particle_by_title(conn: sqlite3.Connection, author: str, title: str) -> Optional[Particle]:
+    """Fetch the author's particle with this title, compared as normalize_title does (one index lookup)."""
+    cur = _particle_cursor(conn)
+    cur.execute(f"SELECT {PARTICLE_COLUMNS} FROM particles WHERE author = ? AND normalized_title = ?",
+                (author, normalize_title(title)))
+    return cur.fetchone()
 
 
 def get_particle_by_user_id(conn: sqlite3.Connection, author: str, user_id: int) -> Optional[Particle]:
     """Fetch a particle by its user-facing ID and author."""
+    cur = _particle_cursor(conn)
+    cur.execute(f"SELECT {PARTICLE_COLUMNS} FROM particles WHERE author = ? AND user_id = ?", (author, user_id))
+    return cur.fetchone()
+
+@_dispatch
+def list_particles(conn: sqlite3.Connection, author: str, limit: int) -> List[ParticleSummary]:
+    """
+    Fetch an author's `limit` most recent particles (highest user-facing id
+    first) without their bodies. Served entirely from idx_particles_listing,
+    so the cost does not depend on body size.
+    """
     cur = conn.cursor()
-    cur.execute("SELECT * FROM particles WHERE author = ? AND user_id = ?", (author, user_id))
-    row = cur.fetchone()
-    if not row:
-        return None
-    return Particle(
-        id=row["id"],
-        user_id=row["user_id"],
-        user_facing_id=row["user_facing_id"],
-        title=row["title"],
-        body=row["body"],
-        author=row["author"],
-        tags=set(row["tags"].split(",")) if row["tags"] else set(),
-        created_at=row["created_at"],
-        updated_at=row["updated_at"]
-    )
+    cur.row_factory = lambda _, row: ParticleSummary(*row)
+    cur.execute("""
+        SELECT id, user_facing_id, created_at, title, snippet
+        FROM particles
+        WHERE author = ?
+        ORDER BY user_facing_id DESC
+        LIMIT ?
+    """, (author, limit))
+    return cur.fetchall()
+
 
+@_dispatch
 def get_all_particles_by_author(conn: sqlite3.Connection, author: str) -> List[Particle]:
     """Fetch all particles for a given author, ordered by most recent."""
+    cur = _particle_cursor(conn)
+    cur.execute(f"SELECT {PARTICLE_COLUMNS} FROM particles WHERE author = ? ORDER BY created_at DESC", (author,))
+    return cur.fetchall()
+
+
+@_dispatch
+def max_user_facing_id(conn: sqlite3.Connection, author: str) -> int:
+    """The highest user-facing id among the author's particles (0 if they have none)."""
+    cur = conn.cursor()
+    cur.execute("SELECT MAX(user_facing_id) FROM particles WHERE author = ?", (author,))
+    return cur.fetchone()[0] or 0
+
+
+# Users and sessions
+
+@_dispatch
+def add_user(conn: sqlite3.Connection, username: str, password_hash: str) -> bool:
+    """Add a user. Return False if the username is taken."""
+    try:
+        conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return False
+    conn.commit()
+    return True
+
+
+@_dispatch
+def get_password_hash(conn: sqlite3.Connection, username: str) -> Optional[str]:
+    """The user's bcrypt hash, or None if there is no such user."""
     cur = conn.cursor()
-    cur.execute("SELECT * FROM particles WHERE author = ? ORDER BY created_at DESC", (author,))
-
-    particles = []
-    for row in cur.fetchall():
-        particles.append(Particle(
-            id=row["id"],
-            user_id=row["user_id"],
-            user_facing_id=row["user_facing_id"],
-            title=row["title"],
-            body=row["body"],
-            author=row["author"],
-            tags=set(row["tags"].split(",")) if row["tags"] else set(),
-            created_at=row["created_at"],
-            updated_at=row["updated_at"]
-        ))
-    return particles
+    cur.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@_dispatch
+def add_session(conn: sqlite3.Connection, token: str, username: str) -> None:
+    """Store a new session token for the user."""
+    conn.execute("INSERT INTO sessions (token, username) VALUES (?, ?)", (token, username))
+    conn.commit()
+
+
+@_dispatch
+def delete_session(conn: sqlite3.Connection, token: str) -> bool:
+    """Remove a session. Return True if it existed."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM sessions WHERE token = ?", (token,))
+    conn.commit()
+    return cur.rowcount > 0
 
 
+@_dispatch
+def get_session_user(conn: sqlite3.Connection, token: str) -> Optional[Tuple[int, str]]:
+    """(user id, username) of the session's user, or None if the session does not exist."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT u.id, u.username
+        FROM users u
+        JOIN sessions s ON u.username = s.username
+        WHERE s.token = ?
+    """, (token,))
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else None
@@ -0,0 +1,241 @@
+import asyncio
+import base64
+import re
+import time
+import httpx
+import pytest
+import api
+import blobs
+from search import query_key
+import ratelimit
+
+
+@pytest.fixture
+def session(client):
+    """A logged-in session token for 'testuser'."""
+    client.post("/register", json={"username": "testuser", "password": "pw"})
+    return client.post("/login", json={"username": "testuser", "password": "pw"}).json()["session"]
+
+
+def create(client, session, title, body="Some body", tags=()):
+    resp = client.post(f"/particles?session={session}", json={"title": title, "body": body, "tags": list(tags)})
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_particle_round_trip(client, session):
+    """Tests that created particles come back as JSON with sorted tag lists."""
+    created = create(client, session, "First", tags=["b", "a"])
+    assert created["tags"] == ["a", "b"]
+
+    resp = client.get(f"/particles/{created['id']}?session={session}")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/json"
+    assert resp.json() == created
+
+
+def test_duplicate_titles_are_conflicts(client, session):
+    """Tests that every way of creating or renaming onto a taken title answers 409."""
+    create(client, session, "Groceries")
+    pid = create(client, session, "Bank")["id"]
+    conflict = {"detail": "You already have a particle with this title"}
+
+    resp = client.post(f"/particles?session={session}", json={"title": "groceries", "body": "x", "tags": []})
+    assert (resp.status_code, resp.json()) == (409, conflict)
+    resp = client.put(f"/particles/{pid}?session={session}", json={"title": "GROCERIES", "body": "x"})
+    assert (resp.status_code, resp.json()) == (409, conflict)
+    resp = client.put(f"/particles/{pid}/title?session={session}", json={"new_title": "Groceries "})
+    assert (resp.status_code, resp.json()) == (409, conflict)
+    assert client.get(f"/particles/{pid}?session={session}").json()["title"] == "Bank"
+
+
+def test_search_returns_hits(client, session):
+    create(client, session, "Gardening", body="Plant tomatoes in spring")
+    resp = client.get(f"/search?q=tomatoes&session={session}")
+    assert resp.status_code == 200
+    [hit] = resp.json()
+    assert hit["title"] == "Gardening"
+    assert [hit["snippet"][s:e] for s, e in hit["highlights"]] == ["tomatoes"]
+
+
+def test_listing_snippets_follow_edits(client, session):
+    """Tests that the empty-query listing shows snippets kept up to date on every write path."""
+    pid = create(client, session, "Draft", body="first version")["id"]
+    client.put(f"/particles/{pid}?session={session}", json={"title": "Draft", "body": "second version"})
+    assert [hit["snippet"] for hit in client.get(f"/search?q=&session={session}").json()] == ["second version"]
+    client.put(f"/particles/{pid}/body?session={session}", json={"new_body": "third version"})
+    assert [hit["snippet"] for hit in client.get(f"/search?q=&session={session}").json()] == ["third version"]
+
+
+def test_pasted_images_are_served_from_the_blob_store(client, session, tmp_path, monkeypatch):
+    """Tests that embedded images leave the body and come back as immutable, rangeable blobs."""
+    monkeypatch.setattr(blobs, "BLOB_DIR", str(tmp_path / "blobs"))
+    png = bytes(range(256)) * 20
+    uri = "data:image/png;base64," + base64.b64encode(png).decode()
+    created = create(client, session, "Screenshot", body=f'<p><img src="{uri}"></p>')
+    assert "base64" not in created["body"]
+    url = created["body"].split('src="')[1].split('"')[0]
+
+    resp = client.get(url)
+    assert resp.status_code == 200 and resp.content == png
+    assert resp.headers["content-type"] == "image/png"
+    assert "immutable" in resp.headers["cache-control"]
+    assert client.get(url, headers={"If-None-Match": resp.headers["etag"]}).status_code == 304
+
+    part = client.get(url, headers={"Range": "bytes=10-19"})
+    assert part.status_code == 206 and part.content == png[10:20]
+    assert client.get("/blobs/" + "0" * 64 + ".png").status_code == 404
+
+
+def test_lookup_by_exact_title(client, session):
+    created = create(client, session, "Weekly  Review")
+    resp = client.get(f"/particles/by-title?title=weekly%20review&session={session}")
+    assert resp.status_code == 200 and resp.json() == created
+    assert client.get(f"/particles/by-title?title=weekly&session={session}").status_code == 404
+
+
+def test_export_downloads_all_particles(client, session):
+    first, second = create(client, session, "First", tags=["b", "a"]), create(client, session, "Second")
+    resp = client.get(f"/export?session={session}")
+    assert resp.headers["content-disposition"] == "attachment; filename=pim_export.json"
+    assert sorted(resp.json(), key=lambda p: p["title"]) == [first, second]
+
+
+def test_invalid_session_rejected(client):
+    assert client.get("/search?q=x&session=nope").status_code == 401
+    assert client.get("/events?session=nope").status_code == 401
+
+
+def test_template_references_fingerprinted_assets(client):
+    """Tests that pages link immutable, fingerprinted assets and revalidate via ETag."""
+    page = client.get("/index.html")
+    assert page.status_code == 200
+    assert page.headers["cache-control"] == "no-cache"
+    [css_url] = [u for u in re.findall(r'href="([^"]+)"', page.text) if "base." in u]
+    assert re.fullmatch(r"/static/css/base\.[0-9a-f]{8}\.css", css_url)
+
+    asset = client.get(css_url)
+    assert asset.status_code == 200
+    assert "immutable" in asset.headers["cache-control"]
+
+    again = client.get("/index.html", headers={"If-None-Match": page.headers["etag"]})
+    assert again.status_code == 304
+    assert again.content == b""
+
+
+def test_static_assets_precompressed(client):
+    resp = client.get("/static/js/common.js", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert "function guard" in resp.text  # decoded transparently by the client
+    assert client.get("/static/missing.js").status_code == 404
+
+
+def test_large_json_compressed_small_json_not(client, session):
+    created = create(client, session, "Big", body="lorem ipsum " * 200)
+    big = client.get(f"/particles/{created['id']}?session={session}", headers={"Accept-Encoding": "gzip"})
+    assert big.headers["content-encoding"] == "gzip"
+    assert big.headers["vary"] == "Accept-Encoding"
+    small = client.get(f"/whoami?session={session}", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_batch_fetch_preserves_per_id_status(client, session):
+    """Tests that a batch returns particles in request order with 404/403 per id."""
+    mine = create(client, session, "Mine")
+    client.post("/register", json={"username": "other", "password": "pw"})
+    other_session = client.post("/login", json={"username": "other", "password": "pw"}).json()["session"]
+    theirs = create(client, other_session, "Theirs")
+
+    resp = client.post(f"/particles/batch?session={session}", json={"ids": [theirs["id"], mine["id"], "nope"]})
+    assert resp.status_code == 200
+    assert resp.json()["results"] == [
+        {"id": theirs["id"], "status": 403},
+        {"id": mine["id"], "status": 200, "particle": mine},
+        {"id": "nope", "status": 404},
+    ]
+
+
+def test_batch_fetch_limits(client, session):
+    too_many = {"ids": [str(i) for i in range(api.MAX_BATCH_SIZE + 1)]}
+    assert client.post(f"/particles/batch?session={session}", json=too_many).status_code == 400
+    assert client.post("/particles/batch?session=bad", json={"ids": []}).status_code == 401
+
+
+def test_changes_since_cursor(client, session):
+    """Tests that a client holding a cursor only receives later changes."""
+    first = create(client, session, "First")
+    page = client.get(f"/changes?session={session}").json()
+    assert [c["id"] for c in page["changes"]] == [first["id"]]
+    cursor = page["cursor"]
+
+    second = create(client, session, "Second")
+    client.delete(f"/particles/{first['id']}?session={session}")
+    page = client.get(f"/changes?session={session}&since={cursor}").json()
+    assert page["changes"][0]["particle"] == second
+    assert page["changes"][1] == {"seq": page["cursor"], "id": first["id"], "deleted": True}
+    assert page["has_more"] is False
+    assert client.get(f"/changes?session={session}&limit=0").status_code == 400
+
+
+def test_concurrent_requests(client, session, monkeypatch):
+    """Tests that request connections survive FastAPI moving them between threadpool threads."""
+    monkeypatch.setattr(ratelimit, "ENABLED", False)  # 30 searches exceed one session's burst
+    create(client, session, "Shared", body="concurrent body")
+
+    async def burst():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.get(f"/search?q=concurrent&session={session}") for _ in range(30)))
+
+    assert [r.status_code for r in asyncio.run(burst())] == [200] * 30
+
+
+def concurrent_gets(urls):
+    async def burst():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.get(url) for url in urls))
+    return asyncio.run(burst())
+
+
+def counting(group, key, original, waiters):
+    """Wraps a storage function to count calls, holding the first until `waiters` requests have joined its flight."""
+    calls = []
+
+    def wrapper(conn, *args, **kwargs):
+        calls.append(args)
+        deadline = time.monotonic() + 5
+        while group.waiters(key) < waiters and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return original(conn, *args, **kwargs)
+    return wrapper, calls
+
+
+def test_concurrent_identical_searches_run_once(client, session, monkeypatch):
+    """Tests that duplicate searches in flight together, even if spelled differently, share one execution."""
+    create(client, session, "Fox", body="quick brown fox")
+    wrapper, calls = counting(api.search_flights, ("testuser", False, query_key("quick fox")), api.run_query, 7)
+    monkeypatch.setattr(api, "run_query", wrapper)
+    spellings = ["quick fox", "QUICK  fox", "quick Fox", "quick   FOX"] * 2
+    responses = concurrent_gets(f"/search?q={q}&session={session}" for q in spellings)
+    assert len(calls) == 1
+    assert all(r.status_code == 200 and r.json() == responses[0].json() for r in responses)
+    assert len(responses[0].json()) == 1
+
+    client.get(f"/search?q=quick+fox&session={session}")
+    assert len(calls) == 2  # nothing is cached once the flight lands
+
+
+def test_concurrent_identical_reads_run_once(client, session, monkeypatch):
+    pid = create(client, session, "Shared")["id"]
+    wrapper, calls = counting(api.particle_flights, ("testuser", pid), api.get_particle, 5)
+    monkeypatch.setattr(api, "get_particle", wrapper)
+    responses = concurrent_gets([f"/particles/{pid}?session={session}"] * 6)
+    assert len(calls) == 1
+    assert [r.status_code for r in responses] == [200] * 6
+    assert all(r.json()["title"] == "Shared" for r in responses)
+
+
+def test_search_flags_truncated_queries(client, session):
+    create(client, session, "Fox", body="fox")
+    assert "x-search-truncated" not in client.get(f"/search?q=fox&session={session}").headers
+    resp = client.get(f"/search?q={' '.join(f'w{i}' for i in range(40))}&session={session}")
+    assert resp.status_code == 200 and resp.headers["x-search-truncated"] == "terms"
@@ -0,0 +1,127 @@
+import pytest
+import storage
+import backup
+from pim_types import Particle
+
+
+@pytest.fixture
+def live_db(tmp_path):
+    """A database file with one user and a helper to save particles into it."""
+    path = str(tmp_path / "pim.db")
+    conn = storage.make_connection(path)
+    conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'testuser', 'hash')")
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+def particle(pid: str, ufid: int, title: str) -> Particle:
+    return Particle(pid, 1, ufid, title, "body", "testuser", frozenset({"t"}), "2025-01-01", "2025-01-01")
+
+
+def titles(path: str) -> dict:
+    conn = storage.make_connection(path)
+    try:
+        return {p.id: p.title for p in storage.get_all_particles_by_author(conn, "testuser")}
+    finally:
+        conn.close()
+
+
+def test_full_and_incremental_restore(live_db, tmp_path):
+    """Tests that full + incremental backups restore creates, updates and deletes."""
+    path, conn = live_db
+    backups = str(tmp_path / "backups")
+    storage.save_particle(conn, particle("p1", 1, "One"))
+    storage.save_particle(conn, particle("p2", 2, "Two"))
+    full = backup.full_backup(path, backups, pages=1, pause=0)
+    assert full.to_seq > 0
+
+    storage.save_particle(conn, particle("p1", 1, "One v2"))
+    storage.delete_particle(conn, "p2")
+    storage.save_particle(conn, particle("p3", 3, "Three"))
+    incr = backup.incremental_backup(path, backups)
+    assert incr.from_seq == full.to_seq
+
+    target = str(tmp_path / "restored.db")
+    chain = backup.restore(backups, target)
+    assert [e.kind for e in chain] == ["full", "incremental"]
+    assert titles(target) == {"p1": "One v2", "p3": "Three"}
+
+
+def test_restore_applies_swapped_titles(live_db, tmp_path):
+    """Tests that a title freed and taken again between backups restores, whatever order rows are applied in."""
+    path, conn = live_db
+    backups = str(tmp_path / "backups")
+    storage.save_particle(conn, particle("a", 1, "Alpha"))
+    storage.save_particle(conn, particle("b", 2, "Beta"))
+    backup.full_backup(path, backups)
+    storage.save_particle(conn, particle("b", 2, "Gamma"))
+    storage.save_particle(conn, particle("a", 1, "Beta"))  # applied first on restore, while b is still "Beta"
+    backup.incremental_backup(path, backups)
+
+    target = str(tmp_path / "restored.db")
+    backup.restore(backups, target)
+    assert titles(target) == {"a": "Beta", "b": "Gamma"}
+
+
+def test_failed_restore_removes_target(live_db, tmp_path, monkeypatch):
+    path, conn = live_db
+    backups = str(tmp_path / "backups")
+    storage.save_particle(conn, particle("p1", 1, "One"))
+    backup.full_backup(path, backups)
+    storage.save_particle(conn, particle("p1", 1, "One v2"))
+    backup.incremental_backup(path, backups)
+
+    def fail(conn, p):
+        raise storage.DuplicateTitleError("You already have a particle with this title")
+    monkeypatch.setattr(storage, "write_particle", fail)
+    target = tmp_path / "restored.db"
+    with pytest.raises(storage.DuplicateTitleError):
+        backup.restore(backups, str(target))
+    assert not target.exists()
+
+
+def test_point_in_time_restore_stops_at_until(live_db, tmp_path):
+    path, conn = live_db
+    backups = str(tmp_path / "backups")
+    storage.save_particle(conn, particle("p1", 1, "One"))
+    full = backup.full_backup(path, backups)
+    storage.save_particle(conn, particle("p2", 2, "Two"))
+    backup.incremental_backup(path, backups)
+
+    target = str(tmp_path / "restored.db")
+    backup.restore(backups, target, until=full.created_at)
+    assert titles(target) == {"p1": "One"}
+
+
+def test_restore_refuses_to_overwrite_and_needs_full(live_db, tmp_path):
+    path, _ = live_db
+    backups = str(tmp_path / "backups")
+    with pytest.raises(ValueError):
+        backup.incremental_backup(path, backups)
+    backup.full_backup(path, backups)
+    with pytest.raises(FileExistsError):
+        backup.restore(backups, path)
+
+
+def test_copy_survives_concurrent_writes(live_db, tmp_path):
+    """Tests that writes during a paged copy restart it, and it still completes."""
+    path, conn = live_db
+    for i in range(200):
+        storage.save_particle(conn, particle(f"p{i}", i, f"{i} " + "x" * 2000))
+    src = storage.make_connection(path)
+    writes = iter(range(1000, 1010))
+    original_sleep = backup.time.sleep
+
+    def write_between_steps(seconds):
+        i = next(writes, None)
+        if i is not None:
+            storage.save_particle(conn, particle(f"p{i}", i, f"new {i}"))
+
+    backup.time.sleep = write_between_steps
+    try:
+        backup.copy_database(src, str(tmp_path / "copy.db"), pages=5, pause=0.001, max_restarts=2)
+    finally:
+        backup.time.sleep = original_sleep
+        src.close()
+    assert len(titles(str(tmp_path / "copy.db"))) >= 200
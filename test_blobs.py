@@ -0,0 +1,45 @@
+import base64
+import os
+
+import pytest
+
+import blobs
+
+
+@pytest.fixture(autouse=True)
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobs, "BLOB_DIR", str(tmp_path / "blobs"))
+
+
+def image(size=4096, seed=1):
+    return bytes((i * seed * 31 + i // 7) % 256 for i in range(size))
+
+
+def data_uri(data, media_type="image/png"):
+    return f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+
+
+def test_images_are_extracted_and_deduplicated():
+    png = image()
+    body = f'<p>a</p><p><img src="{data_uri(png)}"></p><p><img src="{data_uri(png)}"></p>'
+    out = blobs.extract_images(body)
+    name = out.split('src="/blobs/')[1].split('"')[0]
+    assert out == f'<p>a</p><p><img src="/blobs/{name}"></p><p><img src="/blobs/{name}"></p>'
+    assert name.endswith(".png")
+    with open(blobs.path_for(name), "rb") as f:
+        assert f.read() == png
+    assert len(os.listdir(os.path.dirname(blobs.path_for(name)))) == 1
+
+
+def test_small_unsupported_and_invalid_images_stay_inline():
+    small = f'<img src="{data_uri(b"tiny")}">'
+    svg = f'<img src="{data_uri(image(), "image/svg+xml")}">'
+    broken = '<img src="data:image/png;base64,abc">'
+    for body in (small, svg, broken, "<p>no images</p>"):
+        assert blobs.extract_images(body) == body
+
+
+def test_path_for_rejects_malformed_names():
+    assert blobs.path_for("../../etc/passwd") is None
+    assert blobs.path_for("a" * 64 + ".svg") is None
+    assert blobs.path_for("a" * 64 + ".png").endswith(os.path.join("aa", "a" * 64 + ".png"))
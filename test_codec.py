@@ -0,0 +1,36 @@
+import random
+import zlib
+
+import pytest
+
+import codec
+
+
+def test_small_bodies_are_stored_as_text():
+    assert codec.encode_body("<p>short</p>") == "<p>short</p>"
+
+
+def test_large_bodies_round_trip_compressed():
+    body = "<p>" + "a compressible sentence. " * 200 + "</p>"
+    stored = codec.encode_body(body)
+    assert isinstance(stored, bytes) and len(stored) < len(body) / 5
+    assert stored[0] in (codec.ZLIB, codec.ZSTD)
+    assert codec.decode_body(stored) == body
+
+
+def test_incompressible_bodies_stay_text():
+    rng = random.Random(1)
+    body = "".join(chr(rng.randrange(32, 127)) for _ in range(4000))
+    assert codec.encode_body(body) == body
+
+
+def test_zlib_rows_decode_and_unknown_codecs_fail():
+    assert codec.decode_body(bytes([codec.ZLIB]) + zlib.compress("héllo".encode())) == "héllo"
+    with pytest.raises(ValueError):
+        codec.decode_body(b"\x09junk")
+
+
+def test_plain_text_strips_html():
+    assert codec.plain_text("<p>Fish &amp; <strong>chips</strong></p><p>line<br>two</p>") == "Fish & chips\nline\ntwo\n"
+    assert codec.plain_text("no markup here") == "no markup here"
+    assert codec.search_text("no markup here", "no markup here") is None
@@ -0,0 +1,18 @@
+import pytest
+import compression
+from compression import choose_encoding
+
+
+@pytest.mark.parametrize("header", ["gzip;q=0", "gzip;q=0.0", "gzip; q=0", "gzip ; Q=0", "gzip;q=0.000",
+                                    "gzip;q=bogus", "deflate, gzip;q=0"])
+def test_refused_codings_are_not_chosen(header):
+    assert choose_encoding(header) is None
+
+
+def test_accepted_codings(monkeypatch):
+    assert choose_encoding("gzip;q=0.5, deflate") == "gzip"
+    assert choose_encoding("GZIP") == "gzip"
+    assert choose_encoding("") is None
+    monkeypatch.setattr(compression, "brotli", object())  # only checked for presence here
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("gzip, br; q=0.0") == "gzip"
@@ -1,5 +1,5 @@
-import sqlite3
 import pytest
+import storage
 from unittest.mock import MagicMock, patch
 from edit_particles import (
     normalize_title,
@@ -8,7 +8,8 @@ from edit_particles import (
     update_particle_body,
     add_tags,
     remove_tags,
-    delete_particle
+    delete_particle,
+    update_particle
 )
 from authorise import User
 from pim_types import Particle
@@ -16,31 +17,10 @@ from pim_types import Particle
 # A pytest fixture to create a fresh in-memory database for each test
 @pytest.fixture
 def db_connection():
-    """Provides an in-memory SQLite database connection for tests."""
-    # Using ":memory:" creates a temporary database that exists only for the duration of the test
-    conn = sqlite3.connect(":memory:")
-    # We need to create the necessary tables for our tests to interact with
-    conn.execute("""
-        CREATE TABLE particles (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            user_facing_id INTEGER,
-            title TEXT,
-            body TEXT,
-            tags TEXT,
-            created_at TEXT,
-            updated_at TEXT,
-            author TEXT,
-            UNIQUE(author, user_facing_id)
-        );
-    """)
-    conn.execute("""
-        CREATE TABLE users (
-            id INTEGER PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash BLOB NOT NULL
-        );
-    """)
+    """Provides an in-memory SQLite database connection with the real schema."""
+    # Using ":memory:" creates a temporary database that exists only for the duration of the test.
+    # The real schema matters: title uniqueness is enforced by its index.
+    conn = storage.make_connection(":memory:")
     yield conn
     conn.close()
 
@@ -131,15 +111,13 @@ def test_create_particle_duplicate_title_fails(db_connection, test_user):
     """
     Tests that creating a particle with a duplicate title for the same user raises a ValueError.
     """
-    # Arrange: Simulate an existing particle with a title that will cause a conflict
-    db_connection.execute(
-        "INSERT INTO particles (id, user_id, title, author) VALUES (?, ?, ?, ?)",
-        ("some-id", test_user.id, "duplicate title", test_user.username)
-    )
-    db_connection.commit()
+    # Arrange: An existing particle with a title that will cause a conflict
+    create_particle(db_connection, test_user, "duplicate  title", "Some body", set())
     # Act & Assert: Expect a ValueError when trying to create another particle with the same title
     with pytest.raises(ValueError, match="You already have a particle with this title"):
         create_particle(db_connection, test_user, "Duplicate Title", "Some body", set())
+    # The failed insert left nothing behind
+    assert db_connection.execute("SELECT COUNT(*) FROM particles").fetchone()[0] == 1
 
 
 @patch("storage.get_particle")
@@ -162,6 +140,18 @@ def test_update_particle_title_success(mock_save, mock_get, db_connection, test_
     assert updated.id == sample_particle.id
     assert updated.updated_at != sample_particle.updated_at
 
+def test_rename_to_an_existing_title_fails(db_connection, test_user):
+    """Tests that the title index rejects renames onto another particle's title, but not onto the particle's own."""
+    create_particle(db_connection, test_user, "Groceries", "milk", set())
+    other = create_particle(db_connection, test_user, "Errands", "bank", set())
+    with pytest.raises(ValueError, match="You already have a particle with this title"):
+        update_particle_title(db_connection, test_user.username, other.id, "  GROCERIES ")
+    with pytest.raises(ValueError, match="You already have a particle with this title"):
+        update_particle(db_connection, test_user.username, other.id, "groceries", "bank")
+    assert update_particle_title(db_connection, test_user.username, other.id, "ERRANDS").title == "ERRANDS"
+    assert storage.get_particle(db_connection, other.id).title == "ERRANDS"
+
+
 @patch("storage.get_particle")
 def test_update_particle_title_permission_denied(mock_get, db_connection, sample_particle):
     """
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import events
+from events import Broker, ChangeEvent, RESYNC, format_sse, event_stream
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_publish_reaches_only_the_authors_subscribers():
+    async def scenario():
+        broker = Broker()
+        mine, theirs = broker.subscribe("alice"), broker.subscribe("bob")
+        broker.publish(ChangeEvent("created", "p1", "alice", "v1"))
+        assert await mine.get(timeout=1) == [ChangeEvent("created", "p1", "alice", "v1")]
+        assert await theirs.get(timeout=0.01) == []
+    run(scenario())
+
+
+def test_publish_from_worker_thread_wakes_subscriber():
+    """Tests that a write on a worker thread wakes a subscriber waiting on the loop."""
+    async def scenario():
+        broker = Broker()
+        sub = broker.subscribe("alice")
+        threading.Timer(0.05, broker.publish, [ChangeEvent("updated", "p1", "alice", "v2")]).start()
+        assert [e.kind for e in await sub.get(timeout=2)] == ["updated"]
+    run(scenario())
+
+
+def test_overflow_drops_buffer_and_sends_resync():
+    """Tests that a slow subscriber gets a bounded buffer and one resync marker."""
+    async def scenario():
+        broker = Broker()
+        sub = broker.subscribe("alice", maxsize=3)
+        for i in range(10):
+            broker.publish(ChangeEvent("updated", f"p{i}", "alice", "v"))
+        assert await sub.get(timeout=1) == [RESYNC]
+        assert sub.dropped == 10
+        broker.publish(ChangeEvent("deleted", "p1", "alice", "v"))
+        assert [e.kind for e in await sub.get(timeout=1)] == ["deleted"]
+    run(scenario())
+
+
+def test_event_stream_formats_and_unsubscribes():
+    async def scenario():
+        broker = Broker()
+        sub = broker.subscribe("alice")
+        broker.publish(ChangeEvent("created", "p1", "alice", "v1"))
+        disconnected = iter([False, True])
+
+        async def is_disconnected():
+            return next(disconnected)
+
+        frames = [frame async for frame in event_stream(sub, is_disconnected, heartbeat=0.01)]
+        assert frames[1] == 'event: created\ndata: {"id":"p1","version":"v1"}\n\n'
+        assert broker.subscriber_count() == 0
+    run(scenario())
+
+
+def test_format_resync():
+    assert format_sse(RESYNC) == "event: resync\ndata: {}\n\n"
+
+
+def test_edit_particles_publishes_changes(monkeypatch):
+    """Tests that the create path publishes a 'created' event for the author."""
+    import storage
+    from edit_particles import create_particle, delete_particle
+    from authorise import User
+
+    published = []
+    monkeypatch.setattr(events, "publish", lambda *args: published.append(args))
+    conn = storage.make_connection(":memory:")
+    p = create_particle(conn, User(1, "alice"), "Title", "Body", set())
+    delete_particle(conn, "alice", p.id)
+    assert [(kind, pid, author) for kind, pid, author, _ in published] == [
+        ("created", p.id, "alice"), ("deleted", p.id, "alice")
+    ]
@@ -0,0 +1,93 @@
+import fuzzy
+import storage
+from fuzzy import TermDictionary, edit_distance, expand, tokenize, term_dictionary
+from pim_types import Particle
+
+
+def test_tokenize_strips_html_and_lowercases():
+    """Tests that tags are dropped and words are lowercased."""
+    assert tokenize("<p>Hello <b>World</b> 42</p>") == ["hello", "world", "42"]
+
+def test_edit_distance_bounded():
+    """Tests substitutions, transpositions and the early exit above the bound."""
+    assert edit_distance("python", "python", 2) == 0
+    assert edit_distance("python", "pythn", 2) == 1
+    assert edit_distance("python", "pyhton", 2) == 1  # adjacent transposition
+    assert edit_distance("python", "java", 2) == 3  # bound + 1
+
+def test_lookup_finds_terms_within_distance():
+    """Tests that the symmetric-delete index returns near misses ordered by distance."""
+    d = TermDictionary()
+    for term in ["database", "databases", "date", "python"]:
+        d.add(term)
+    assert d.lookup("databse", 1) == [("database", 1)]
+    assert [t for t, _ in d.lookup("databse", 2)] == ["database", "databases"]
+    assert d.lookup("zzzzzz", 2) == []
+
+def test_expand_leaves_short_words_exact():
+    """Tests that words of three letters or fewer are never expanded."""
+    d = TermDictionary()
+    d.add("cat")
+    assert expand(d, "cot") == []
+
+def test_term_dictionary_rebuilds_after_write(tmp_path):
+    """Tests that the cached dictionary for a file database picks up new particles."""
+    conn = storage.make_connection(str(tmp_path / "pim.db"))
+    conn.execute("INSERT INTO particles (id, user_id, user_facing_id, title, body, author) VALUES ('a', 1, 1, 'Gardening', 'tomatoes', 'u')")
+    conn.commit()
+    first = term_dictionary(conn, "u")
+    assert "tomatoes" in first
+    assert term_dictionary(conn, "u") is first  # unchanged -> cached
+
+    conn.execute("INSERT INTO particles (id, user_id, user_facing_id, title, body, author) VALUES ('b', 1, 2, 'Cooking', 'potatoes', 'u')")
+    conn.commit()
+    assert "potatoes" in term_dictionary(conn, "u")
+    conn.close()
+
+
+def save(conn, pid, number, title, body):
+    storage.save_particle(conn, Particle(id=pid, user_id=1, user_facing_id=number, title=title, body=body,
+                                         author="u", tags=frozenset(), created_at="2025-01-01",
+                                         updated_at="2025-01-01"))
+
+
+def test_term_dictionary_applies_updates_and_deletes(tmp_path):
+    """Tests that an edit replaces a particle's old terms and a delete removes them, without a rebuild."""
+    conn = storage.make_connection(str(tmp_path / "pim.db"))
+    save(conn, "a", 1, "Garden", "tomatoes and basil")
+    save(conn, "b", 2, "Soup", "tomatoes")
+    first = term_dictionary(conn, "u")
+    assert first.counts["tomatoes"] == 2
+
+    save(conn, "a", 1, "Garden", "potatoes and basil")
+    storage.delete_particle(conn, "b")
+    d = term_dictionary(conn, "u")
+    assert d is first
+    assert "tomatoes" not in d and "soup" not in d
+    assert d.counts["potatoes"] == 1
+    assert d.lookup("potatos", 1) == [("potatoes", 1)]
+    conn.close()
+
+
+def test_term_dictionary_catches_up_within_budget(tmp_path):
+    """Tests that a lookup out of budget uses a partial dictionary and later lookups finish it."""
+    conn = storage.make_connection(str(tmp_path / "pim.db"))
+    for n, word in enumerate(["alpha", "bravo", "charlie"], 1):
+        save(conn, word, n, word, "")
+    assert len(term_dictionary(conn, "u", budget=0)) == 1
+    assert len(term_dictionary(conn, "u", budget=0)) == 2
+    assert sorted(term_dictionary(conn, "u").counts) == ["alpha", "bravo", "charlie"]
+    conn.close()
+
+
+def test_term_dictionary_cache_is_bounded(tmp_path, monkeypatch):
+    """Tests that only the MAX_CACHED most recently used dictionaries are kept."""
+    monkeypatch.setattr(fuzzy, "MAX_CACHED", 2)
+    monkeypatch.setattr(fuzzy, "_cache", fuzzy.OrderedDict())
+    conn = storage.make_connection(str(tmp_path / "pim.db"))
+    first = term_dictionary(conn, "a")
+    term_dictionary(conn, "b")
+    assert term_dictionary(conn, "a") is first
+    term_dictionary(conn, "c")
+    assert [author for _, author in fuzzy._cache] == ["a", "c"]
+    conn.close()
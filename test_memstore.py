@@ -0,0 +1,180 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import storage
+from backend import Backend
+from authorise import User, login, logout, register_user, whoami
+from edit_particles import create_particle, delete_particle, update_particle
+from memstore import MemoryStore
+from pim_types import Particle
+from search import explain_query, run_query
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def backend(request):
+    """The same tests run against a SQLite connection and a MemoryStore."""
+    conn = storage.make_connection(":memory:") if request.param == "sqlite" else MemoryStore()
+    yield conn
+    conn.close()
+
+
+USER = User(id=1, username="testuser")
+BASE = Particle(id="", user_id=1, user_facing_id=0, title="", body="", author="testuser",
+                tags=frozenset(), created_at="", updated_at="")
+NOTES = [
+    ("p1", 1, "Python tips", "<p>List comprehensions are <b>neat</b>.</p>", {"Work", "code"}, "2024-12-30T10:00:00"),
+    ("p2", 2, "Garden plan", "<p>Plant green tomatoes in spring.</p>", {"home", "garden"}, "2025-01-15T09:00:00"),
+    ("p3", 3, "Rust notes", "Ownership and borrowing, unlike python: snake_case, 100% safe.", {"code"}, "2025-02-01T08:00:00"),
+    ("p4", 4, "Soup", "Tomato soup with basil &amp; garlic.", {"garden", "recipes"}, "2025-02-10T12:00:00"),
+]
+
+
+def populate(conn):
+    for pid, ufid, title, body, tags, created in NOTES:
+        storage.save_particle(conn, BASE._replace(id=pid, user_facing_id=ufid, title=title, body=body,
+                                                  tags=frozenset(tags), created_at=created, updated_at=created))
+    storage.save_particle(conn, BASE._replace(id="x1", user_id=2, user_facing_id=1, title="Python tips",
+                                              body="someone else's tomato", author="other",
+                                              created_at="2025-01-01", updated_at="2025-01-01"))
+
+
+def test_memory_store_implements_backend():
+    assert isinstance(MemoryStore(), Backend)
+
+
+def test_auth_round_trip(backend):
+    assert register_user(backend, "alice", "pw")
+    assert not register_user(backend, "alice", "other")
+    assert login(backend, "alice", "wrong").message == "Invalid password"
+    assert login(backend, "bob", "pw").message == "User does not exist"
+    token = login(backend, "alice", "pw").session
+    assert whoami(backend, token).username == "alice"
+    assert logout(backend, token)
+    assert not logout(backend, token)
+    assert whoami(backend, token) is None
+
+
+def test_particle_lifecycle(backend):
+    first = create_particle(backend, USER, "First", "<p>one</p>", {"a"})
+    second = create_particle(backend, USER, "Second", "two", set())
+    assert (first.user_facing_id, second.user_facing_id) == (1, 2)
+    assert storage.get_particle(backend, first.id) == first
+    assert storage.get_particle_by_title(backend, "testuser", "  FIRST ") == first
+    assert [s.title for s in storage.list_particles(backend, "testuser", 10)] == ["Second", "First"]
+    assert storage.list_particles(backend, "testuser", 10)[1].snippet == "one\n"
+
+    updated = update_particle(backend, "testuser", first.id, "First!", "changed")
+    assert storage.get_particle(backend, first.id) == updated
+    assert update_particle(backend, "intruder", first.id, "Mine", "mine") is None
+
+    delete_particle(backend, "testuser", second.id)
+    assert storage.get_particles(backend, [first.id, second.id]) == {first.id: updated}
+    changes, has_more = storage.get_changes(backend, "testuser", 0, 10)
+    assert [(c.particle_id, c.deleted) for c in changes] == [(first.id, False), (second.id, True)]
+    assert not has_more
+    assert storage.max_user_facing_id(backend, "testuser") == 1
+
+
+def test_titles_are_unique_per_author(backend):
+    create_particle(backend, USER, "To do", "x", set())
+    pid = create_particle(backend, USER, "Done", "y", set()).id
+    with pytest.raises(storage.DuplicateTitleError):
+        create_particle(backend, USER, "to  DO", "z", set())
+    with pytest.raises(storage.DuplicateTitleError):
+        update_particle(backend, "testuser", pid, "TO DO", "y")
+    create_particle(backend, User(2, "other"), "To do", "x", set())
+
+
+QUERIES = [
+    "tomato", '"green tomatoes"', "python", "tag:garden", "tag:garden tomato", "tag:code tag:work",
+    "NOT tomato", "created:2025-01", "created:>2025-01-15", "created:<=2025-01", "updated:>=2025-02",
+    "title:plan OR soup", "(rust OR python) NOT title:tips", "neat", "b", "garlic &",
+    "%", "_", "1%", "a_c", "e_c", "100%", "snake_case", "\\",
+]
+
+
+@pytest.mark.parametrize("q", QUERIES)
+def test_search_matches_sqlite(q):
+    """Tests that the in-memory engine finds and ranks exactly what the SQL search does."""
+    sqlite_conn, memory = storage.make_connection(":memory:"), MemoryStore()
+    populate(sqlite_conn)
+    populate(memory)
+    expected = run_query(sqlite_conn, "testuser", q)
+    assert run_query(memory, "testuser", q) == expected
+    assert run_query(memory, "testuser", q, fuzzy=True) == run_query(sqlite_conn, "testuser", q, fuzzy=True)
+
+
+def test_fuzzy_search_and_explain():
+    memory = MemoryStore()
+    populate(memory)
+    assert [h.id for h in run_query(memory, "testuser", "tomatos", fuzzy=True).hits] == ["p4", "p2"]
+    lines = explain_query(memory, "testuser", "tag:garden tomato")
+    assert any("index (author, tag)" in line and "matches=2" in line for line in lines)
+    assert lines[-1] == "memory: 2 of 4 particles checked, from the tag index"
+
+
+def test_search_time_budget():
+    memory = MemoryStore()
+    populate(memory)
+    result = run_query(memory, "testuser", "python", budget=0)
+    assert result.hits == [] and result.truncated == ("time",)
+
+
+def test_journal_replay_without_close(tmp_path):
+    """Tests that every acknowledged write survives a crash (the store is never closed)."""
+    path = str(tmp_path / "pim.json")
+    store = MemoryStore(path)
+    populate(store)
+    register_user(store, "alice", "pw")
+    storage.delete_particle(store, "p3")
+
+    reopened = MemoryStore(path)
+    assert storage.get_all_particles_by_author(reopened, "testuser") == \
+        storage.get_all_particles_by_author(store, "testuser")
+    assert storage.get_changes(reopened, "testuser", 0, 100) == storage.get_changes(store, "testuser", 0, 100)
+    assert login(reopened, "alice", "pw").ok
+
+
+def test_snapshot_truncates_journal(tmp_path):
+    path = str(tmp_path / "pim.json")
+    store = MemoryStore(path, snapshot_every=3)
+    populate(store)  # 5 writes: a snapshot after the third
+    with open(path + ".journal") as f:
+        assert len(f.readlines()) == 2
+
+    reopened = MemoryStore(path)
+    assert sorted(p.id for p in storage.get_all_particles_by_author(reopened, "testuser")) == ["p1", "p2", "p3", "p4"]
+    assert storage.get_particle_by_title(reopened, "other", "python tips").id == "x1"
+
+    reopened.close()
+    with open(path + ".journal") as f:
+        assert f.read() == ""
+    assert len(storage.get_all_particles_by_author(MemoryStore(path), "testuser")) == 4
+
+
+def test_torn_journal_line_is_dropped(tmp_path):
+    path = str(tmp_path / "pim.json")
+    store = MemoryStore(path)
+    populate(store)
+    with open(path + ".journal", "a") as f:
+        f.write('{"n": 6, "op": "delete_par')  # the process died mid-write
+
+    reopened = MemoryStore(path)
+    assert storage.get_particle(reopened, "p1") is not None
+    storage.delete_particle(reopened, "p1")  # appended after the torn bytes were cut
+    assert storage.get_particle(MemoryStore(path), "p1") is None
+
+
+def test_api_runs_on_memory_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "DB_PATH", str(tmp_path / "unused.db"))
+    monkeypatch.setattr(api, "MEMORY_STORE", MemoryStore())
+    with TestClient(api.app) as client:
+        client.post("/register", json={"username": "alice", "password": "pw"})
+        session = client.post("/login", json={"username": "alice", "password": "pw"}).json()["session"]
+        created = client.post(f"/particles?session={session}",
+                              json={"title": "Garden", "body": "Plant tomatoes", "tags": ["home"]}).json()
+        assert client.get(f"/particles/{created['id']}?session={session}").json() == created
+        assert [h["id"] for h in client.get(f"/search?q=tomatoes&session={session}").json()] == [created["id"]]
+        assert client.get(f"/particles/by-title?title=garden&session={session}").json()["id"] == created["id"]
+    assert not (tmp_path / "unused.db").exists()
@@ -0,0 +1,60 @@
+import re
+import metrics
+from metrics import Counter, Histogram, Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    h = registry.register(Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        h.observe(value, "/x")
+    text = registry.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/x",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/x",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/x"} 4' in text
+    assert 'latency_seconds_sum{route="/x"} 4.05' in text
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.register(Counter("c_total", "C.", ("path",))).inc('a"b\\c')
+    assert 'c_total{path="a\\"b\\\\c"} 1' in registry.render()
+
+
+def sample(text, name, **labels):
+    """The value of one sample in an exposition, or None."""
+    label_re = ",".join(f'{k}="{re.escape(v)}"' for k, v in labels.items())
+    match = re.search(rf"^{name}{{{label_re}}} (\S+)$" if labels else rf"^{name} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_metrics_endpoint(client):
+    """Tests that requests, bcrypt, search and table sizes show up in /metrics."""
+    before = metrics.HTTP_REQUESTS.value("GET", "/particles/{pid}", "200")
+    client.post("/register", json={"username": "u", "password": "pw"})
+    session = client.post("/login", json={"username": "u", "password": "pw"}).json()["session"]
+    pid = client.post(f"/particles?session={session}", json={"title": "T", "body": "hello", "tags": []}).json()["id"]
+    client.get(f"/particles/{pid}?session={session}")
+    client.get(f"/search?q=hello&session={session}")
+
+    resp = client.get("/metrics")
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+    # Routes are labelled by template, not by the concrete path.
+    assert sample(text, "pim_http_requests_total", method="GET", route="/particles/{pid}", status="200") == before + 1
+    assert pid not in text
+    assert sample(text, "pim_bcrypt_seconds_count", operation="verify") >= 1
+    assert sample(text, "pim_search_results_count") >= 1
+    assert sample(text, "pim_table_rows", table="particles") == 1
+    assert sample(text, "pim_table_rows", table="sessions") == 1
+    assert sample(text, "pim_db_queries_total") > 0
+
+
+def test_table_sizes_never_create_the_database(tmp_path):
+    """Tests that scraping a missing database reports nothing and leaves no file behind."""
+    path = tmp_path / "missing.db"
+    for collect in (metrics.table_size_collector(lambda: str(path)), metrics.table_size_collector(lambda: None)):
+        assert [samples for *_, samples in collect()] == [[]]
+    assert not path.exists()
@@ -0,0 +1,57 @@
+import json
+import re
+import logging
+import pytest
+import profiling
+import storage
+from profiling import ProfiledConnection, phase, profiled
+
+
+def test_profiled_connection_counts_queries_rows_and_trigger_statements(tmp_path):
+    conn = storage.make_connection(str(tmp_path / "p.db"), factory=ProfiledConnection)
+    conn.execute("CREATE TABLE t (a)")
+    conn.execute("CREATE TABLE log (a)")
+    conn.execute("CREATE TRIGGER t_log AFTER INSERT ON t BEGIN INSERT INTO log VALUES (new.a); END")
+    with profiled() as profile:
+        conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+        assert len(conn.execute("SELECT * FROM t").fetchall()) == 5
+        cur = conn.cursor()
+        cur.execute("SELECT a FROM t WHERE a = 3")
+        assert tuple(cur.fetchone()) == (3,)
+        assert cur.fetchone() is None
+    assert profile.queries == 3
+    assert profile.rows == 6
+    assert profile.statements > profile.queries  # trigger programs and the implicit BEGIN
+    assert profile.slowest_sql is not None and profile.sql_seconds > 0
+
+
+def test_nothing_recorded_outside_a_profile(tmp_path):
+    conn = storage.make_connection(str(tmp_path / "p.db"), factory=ProfiledConnection)
+    with phase("idle"):
+        conn.execute("SELECT 1").fetchall()
+    assert profiling.current_profile() is None
+
+
+@pytest.fixture
+def client(client):
+    """The shared test client, logged in as 'u' (the token is in client.session)."""
+    client.post("/register", json={"username": "u", "password": "pw"})
+    client.session = client.post("/login", json={"username": "u", "password": "pw"}).json()["session"]
+    return client
+
+
+def test_server_timing_header(client):
+    client.post(f"/particles?session={client.session}", json={"title": "T", "body": "hello", "tags": []})
+    timing = client.get(f"/search?q=hello&session={client.session}").headers["server-timing"]
+    assert re.findall(r"(\w+);dur=", timing) == ["connect", "auth", "search", "serialize", "sql", "total"]
+    assert re.search(r'sql;dur=[\d.]+;desc="\d+ queries, \d+ statements, \d+ rows"', timing)
+
+
+def test_slow_requests_are_logged(client, monkeypatch, caplog):
+    monkeypatch.setattr(profiling, "SLOW_REQUEST_MS", 0.0)
+    with caplog.at_level(logging.WARNING, logger="pim.slow_requests"):
+        client.get(f"/search?q=x&session={client.session}")
+    [record] = [r for r in caplog.records if r.name == "pim.slow_requests"]
+    entry = json.loads(record.getMessage())
+    assert entry["path"] == "/search" and entry["status"] == 200
+    assert entry["queries"] > 0 and "auth" in entry["phases_ms"] and entry["slowest_sql"]
@@ -0,0 +1,103 @@
+import pytest
+import storage
+from pim_types import Particle
+from query_language import (
+    And, Or, Not, Term, TagFilter, DateFilter, parse, plan_query, rank, limit_query
+)
+from search import query, explain_query
+
+
+@pytest.fixture
+def tagged_db():
+    """An in-memory database with tagged, dated particles saved through storage."""
+    conn = storage.make_connection(":memory:")
+    conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'testuser', 'hash')")
+    base = Particle(id="", user_id=1, user_facing_id=0, title="", body="", author="testuser",
+                    tags=set(), created_at="", updated_at="")
+    for pid, ufid, title, body, tags, created in [
+        ("p1", 1, "Python tips", "List comprehensions are neat.", {"Work", "code"}, "2024-12-30T10:00:00"),
+        ("p2", 2, "Garden plan", "Plant tomatoes in spring.", {"home"}, "2025-01-15T09:00:00"),
+        ("p3", 3, "Rust notes", "Ownership and borrowing, unlike python.", {"code"}, "2025-02-01T08:00:00"),
+    ]:
+        storage.save_particle(conn, base._replace(id=pid, user_facing_id=ufid, title=title, body=body,
+                                                  tags=tags, created_at=created, updated_at=created))
+    yield conn
+    conn.close()
+
+# Parser
+
+def test_parse_implicit_and_with_phrase():
+    """Tests that plain queries keep their old meaning: AND of keywords and phrases."""
+    assert parse('hello "big world"') == And((Term("hello", False, ""), Term("big world", True, "")))
+
+def test_parse_precedence_and_parentheses():
+    """Tests that AND binds tighter than OR and parentheses override it."""
+    assert parse("a b OR c") == Or((And((Term("a", False, ""), Term("b", False, ""))), Term("c", False, "")))
+    assert parse("a (b OR c)") == And((Term("a", False, ""), Or((Term("b", False, ""), Term("c", False, "")))))
+
+def test_parse_fields_and_not():
+    """Tests field-scoped clauses and negation."""
+    assert parse("tag:Work NOT title:draft created:>=2025-01-01") == And((
+        TagFilter("work"),
+        Not(Term("draft", False, "title")),
+        DateFilter("created_at", ">=", "2025-01-01"),
+    ))
+
+def test_parse_is_forgiving():
+    """Tests that malformed input degrades to something sensible instead of failing."""
+    assert parse("(a OR") == Term("a", False, "")
+    assert parse(") AND") is None
+    assert parse("created:yesterday") == Term("created:yesterday", False, "")
+
+def test_plan_orders_most_selective_first():
+    """Tests that index-backed clauses are placed before text scans and negations."""
+    plan = plan_query(parse("NOT spam python created:>2025-01 tag:code"), "u")
+    assert [rank(c) for c in plan.root.children] == sorted(rank(c) for c in plan.root.children)
+    assert isinstance(plan.root.children[0], TagFilter)
+    assert isinstance(plan.root.children[-1], Not)
+
+# Execution through search.query
+
+def test_query_tag_filter(tagged_db):
+    assert {h.id for h in query(tagged_db, "testuser", "tag:code")} == {"p1", "p3"}
+    assert {h.id for h in query(tagged_db, "testuser", "tag:WORK")} == {"p1"}
+
+def test_query_or_and_not(tagged_db):
+    assert {h.id for h in query(tagged_db, "testuser", "tomatoes OR rust")} == {"p2", "p3"}
+    assert {h.id for h in query(tagged_db, "testuser", "python NOT tag:work")} == {"p3"}
+
+def test_query_title_scope(tagged_db):
+    """Tests that title: ignores matches in the body."""
+    assert [h.id for h in query(tagged_db, "testuser", "title:python")] == ["p1"]
+
+def test_query_date_ranges(tagged_db):
+    assert {h.id for h in query(tagged_db, "testuser", "created:>2025-01-01")} == {"p2", "p3"}
+    assert {h.id for h in query(tagged_db, "testuser", "created:2025-01")} == {"p2"}
+    assert {h.id for h in query(tagged_db, "testuser", "created:<2025-01")} == {"p1"}
+
+def test_tags_index_follows_updates_and_deletes(tagged_db):
+    p1 = storage.get_particle(tagged_db, "p1")
+    storage.save_particle(tagged_db, p1._replace(tags={"home"}))
+    assert {h.id for h in query(tagged_db, "testuser", "tag:home")} == {"p1", "p2"}
+    storage.delete_particle(tagged_db, "p2")
+    assert tagged_db.execute("SELECT COUNT(*) FROM particle_tags WHERE particle_id = 'p2'").fetchone()[0] == 0
+
+def test_explain_query_reports_plan(tagged_db):
+    lines = explain_query(tagged_db, "testuser", "python tag:code")
+    assert lines[2] == "ordered: (tag:code AND python)"
+    assert any("index particle_tags" in line and "matches=2" in line for line in lines)
+    assert any(line.startswith("sqlite: ") for line in lines)
+
+
+def test_limit_query_deduplicates_clauses():
+    tree, reasons = limit_query(parse("fox fox (dog OR dog) tag:a tag:a"))
+    assert tree == And((Term("fox", False, ""), Term("dog", False, ""), TagFilter("a")))
+    assert reasons == []
+
+
+def test_limit_query_caps_terms_and_phrases():
+    tree, reasons = limit_query(parse('a b c d "one two three four"'), max_terms=3, max_phrase_length=9)
+    assert tree == And((Term("a", False, ""), Term("b", False, ""), Term("c", False, "")))
+    assert reasons == ["terms"]
+    tree, reasons = limit_query(parse('"one two three four"'), max_phrase_length=9)
+    assert tree == Term("one two", True, "") and reasons == ["phrase"]
@@ -0,0 +1,84 @@
+import json
+import pytest
+import querylog
+import storage
+from profiling import ProfiledConnection
+from querylog import normalize, params_shape, read_log, summarize
+from search import run_query
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    path = str(tmp_path / "slow.log")
+    monkeypatch.setattr(querylog, "LOG_PATH", path)
+    monkeypatch.setattr(querylog, "SLOW_QUERY_MS", 0.0)  # log everything
+    return path
+
+
+def test_normalize_groups_query_variants():
+    a = normalize("SELECT id FROM particles\n  WHERE author = 'bob' AND id IN (?, ?, ?) LIMIT 20")
+    b = normalize("SELECT id FROM particles WHERE author = 'alice' AND id IN (?) LIMIT 5")
+    assert a == b == "SELECT id FROM particles WHERE author = ? AND id IN (...) LIMIT ?"
+
+
+def test_params_shape_hides_values():
+    assert params_shape(("bob", "%x%", "%y%", 3)) == "str x3, int"
+    assert params_shape({"author": "bob"}) == ":author str"
+    assert params_shape(None) == ""
+
+
+def test_slow_statements_are_logged_with_plan(tmp_path, log):
+    conn = storage.make_connection(str(tmp_path / "p.db"), factory=ProfiledConnection)
+    conn.execute("SELECT id FROM particles WHERE author = ? AND title LIKE ?", ("bob", "%secret%")).fetchall()
+    entries = [e for e in read_log(log) if e["sql"].startswith("SELECT id FROM particles")]
+    [entry] = entries
+    assert entry["params"] == "str x2"
+    assert "secret" not in json.dumps(entry)
+    assert any("idx_particles_author" in line or "SCAN" in line or "SEARCH" in line for line in entry["plan"])
+
+
+def test_fast_statements_are_not_logged(tmp_path, log, monkeypatch):
+    monkeypatch.setattr(querylog, "SLOW_QUERY_MS", 10_000.0)
+    conn = storage.make_connection(str(tmp_path / "p.db"), factory=ProfiledConnection)
+    conn.execute("SELECT 1").fetchall()
+    assert read_log(log) == []
+
+
+def test_log_rotates(log, monkeypatch):
+    monkeypatch.setattr(querylog, "MAX_BYTES", 400)
+    for i in range(20):
+        querylog.record(None, f"SELECT {i} FROM t", (), 0.1, 1)
+    assert len(read_log(log)) < 20  # older files beyond BACKUPS were dropped
+    assert read_log(log)[-1]["sql"] == "SELECT ? FROM t"
+
+
+def test_summary_orders_worst_first():
+    entries = [{"sql": "A", "params": "", "ms": 10, "rows": 1, "plan": []}] * 5 + \
+              [{"sql": "B", "params": "str", "ms": 100, "rows": 50, "plan": ["SCAN particles"]}]
+    assert [g["sql"] for g in summarize(entries, by="total")] == ["B", "A"]
+    assert [g["sql"] for g in summarize(entries, by="count")] == ["A", "B"]
+    [b] = summarize(entries, top=1)
+    assert b["mean_rows"] == 50 and b["plan"] == ["SCAN particles"]
+
+
+def test_log_defaults_to_the_database_directory(tmp_path, monkeypatch):
+    """Tests that without LOG_PATH statements are logged next to the database, and not at all in memory."""
+    monkeypatch.setattr(querylog, "LOG_PATH", None)
+    monkeypatch.setattr(querylog, "SLOW_QUERY_MS", 0.0)
+    conn = storage.make_connection(str(tmp_path / "p.db"), factory=ProfiledConnection)
+    conn.execute("SELECT 1").fetchall()
+    assert read_log(str(tmp_path / querylog.LOG_NAME))[-1]["sql"] == "SELECT ?"
+    storage.make_connection(":memory:", factory=ProfiledConnection).execute("SELECT 1").fetchall()
+
+
+def test_search_is_logged_when_it_finishes(tmp_path, log):
+    """Tests that run_query records its scan itself, while a dropped cursor is never explained during GC."""
+    conn = storage.make_connection(str(tmp_path / "p.db"), factory=ProfiledConnection)
+    cur = conn.execute("SELECT 1 UNION ALL SELECT 2")
+    cur.fetchone()
+    del cur
+    assert not [e for e in read_log(log) if "UNION" in e["sql"]]
+
+    run_query(conn, "bob", "tomato")
+    [entry] = [e for e in read_log(log) if "SELECT id, user_facing_id, title" in e["sql"]]
+    assert entry["plan"]
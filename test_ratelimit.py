@@ -0,0 +1,98 @@
+import pytest
+
+import ratelimit
+from ratelimit import Policy, TokenBuckets
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    buckets = TokenBuckets(clock=clock)
+    policy = Policy(rate=2.0, burst=3)
+    assert [buckets.take(("k",), policy) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take(("k",), policy) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert buckets.take(("k",), policy) == 0
+    assert buckets.take(("other",), policy) == 0  # keys are independent
+
+
+def test_idle_full_buckets_are_evicted():
+    clock = FakeClock()
+    buckets = TokenBuckets(evict_every=10, clock=clock)
+    policy = Policy(rate=1.0, burst=2)
+    for i in range(9):
+        buckets.take((i,), policy)
+    clock.now += 1.0  # refilled completely
+    buckets.take(("busy",), policy)  # 10th operation triggers eviction
+    assert len(buckets) == 1
+
+
+def test_key_count_is_capped():
+    buckets = TokenBuckets(max_keys=5, clock=FakeClock())
+    for i in range(20):
+        buckets.take((i,), Policy(rate=1.0, burst=1))
+    assert len(buckets) <= 5
+
+
+def test_capping_keeps_throttled_buckets():
+    """Tests that trimming to max_keys drops full buckets before those of throttled clients."""
+    clock = FakeClock()
+    buckets = TokenBuckets(max_keys=10, clock=clock)
+    policy = Policy(rate=0.001, burst=1)
+    buckets.take(("abuser",), policy)  # empty, and the least recently used
+    for i in range(10):
+        buckets.take((i,), Policy(rate=1000.0, burst=1))  # full again almost at once
+        clock.now += 0.01
+    assert buckets.take(("abuser",), policy) > 0  # still throttled
+
+
+def test_refund_returns_tokens():
+    buckets = TokenBuckets(clock=FakeClock())
+    policy = Policy(rate=0.001, burst=1)
+    buckets.take(("k",), policy)
+    buckets.refund(("k",))
+    assert buckets.take(("k",), policy) == 0
+
+
+def test_login_is_limited_per_ip(client, monkeypatch):
+    monkeypatch.setitem(ratelimit.POLICIES, "login", Policy(rate=0.01, burst=2))
+    for _ in range(2):
+        assert client.post("/login", json={"username": "x", "password": "y"}).status_code == 401
+    response = client.post("/login", json={"username": "x", "password": "y"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert client.get("/").status_code == 200  # other policies still have tokens
+
+
+def test_global_refusal_costs_the_client_nothing(monkeypatch):
+    monkeypatch.setattr(ratelimit, "GLOBAL_POLICY", Policy(rate=0.001, burst=1))
+    scope = {"path": "/export", "client": ("1.2.3.4", 1)}
+    assert ratelimit.check(scope)[1] == 0
+    assert ratelimit.check(scope)[1] > 0  # refused by the global bucket
+    ip_bucket = ratelimit.buckets._buckets[("export", "ip:1.2.3.4")]
+    assert ip_bucket[0] == pytest.approx(ratelimit.POLICIES["export"].burst * ratelimit.IP_SHARE - 1, abs=0.01)
+
+
+def test_made_up_sessions_share_the_ip_bucket(client, monkeypatch):
+    """Tests that rotating fake session tokens from one IP cannot get past its bucket."""
+    monkeypatch.setitem(ratelimit.POLICIES, "search", Policy(rate=0.01, burst=2))
+    statuses = [client.get("/search", params={"session": f"fake{i}", "q": "x"}).status_code for i in range(12)]
+    assert statuses == [401] * 2 * ratelimit.IP_SHARE + [429] * (12 - 2 * ratelimit.IP_SHARE)
+
+
+def test_search_is_limited_per_session(client, monkeypatch):
+    monkeypatch.setitem(ratelimit.POLICIES, "search", Policy(rate=0.01, burst=1))
+    client.post("/register", json={"username": "a", "password": "pw"})
+    client.post("/register", json={"username": "b", "password": "pw"})
+    a = client.post("/login", json={"username": "a", "password": "pw"}).json()["session"]
+    b = client.post("/login", json={"username": "b", "password": "pw"}).json()["session"]
+    assert client.get("/search", params={"session": a, "q": "x"}).status_code == 200
+    assert client.get("/search", params={"session": a, "q": "x"}).status_code == 429
+    assert client.get("/search", params={"session": b, "q": "x"}).status_code == 200
@@ -0,0 +1,66 @@
+import threading
+import time
+import pytest
+import api
+import sampler
+from sampler import SamplingProfiler
+
+
+def busy_scoring_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_profiler_collects_collapsed_stacks():
+    profiler = SamplingProfiler()
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_scoring_loop, args=(stop,), name="busy worker")
+    worker.start()
+    assert profiler.start(interval=0.002, duration=5)
+    assert not profiler.start()  # one window at a time
+    time.sleep(0.3)
+    profiler.stop()
+    stop.set()
+    worker.join()
+
+    status = profiler.status()
+    assert not status["running"] and status["samples"] > 10
+    assert status["overhead"] < 0.5
+    lines = profiler.collapsed().splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    busy = [line for line in lines if "test_sampler:busy_scoring_loop" in line]
+    assert busy and busy[0].startswith("busy_worker;")
+
+
+def test_window_ends_after_duration():
+    profiler = SamplingProfiler()
+    profiler.start(interval=0.001, duration=0.05)
+    time.sleep(0.3)
+    assert not profiler.running
+
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setattr(api, "ADMIN_TOKEN", "s3cret")
+    yield client
+    sampler.profiler.stop()
+
+
+def test_admin_endpoints_require_token(client, monkeypatch):
+    assert client.get("/admin/profiler").status_code == 403
+    assert client.get("/admin/profiler", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    monkeypatch.setattr(api, "ADMIN_TOKEN", "")
+    assert client.get("/admin/profiler", headers={"X-Admin-Token": ""}).status_code == 404
+
+
+def test_admin_profiler_round_trip(client):
+    admin = {"X-Admin-Token": "s3cret"}
+    resp = client.post("/admin/profiler/start?interval_ms=1&duration_s=5&include_idle=true", headers=admin)
+    assert resp.status_code == 200 and resp.json()["running"]
+    assert client.post("/admin/profiler/start", headers=admin).status_code == 409
+    time.sleep(0.1)
+    assert not client.post("/admin/profiler/stop", headers=admin).json()["running"]
+    stacks = client.get("/admin/profiler/stacks", headers=admin)
+    assert stacks.headers["content-type"].startswith("text/plain")
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks.text.splitlines())
@@ -1,7 +1,8 @@
 import pytest
 import sqlite3
 import storage  # We need it to create the tables
-from search import parse_query, query
+from search import parse_query, query, run_query, make_snippet
+import search
 
 # Fixture to set up a database populated with specific test data 
 
@@ -118,3 +119,85 @@ def test_query_no_results(populated_db):
     """Tests that a search for a non-existent term returns an empty list."""
     results = query(populated_db, "testuser", "nonexistentword")
     assert len(results) == 0
+
+# Tests for snippet generation
+
+def test_make_snippet_picks_window_around_match():
+    """Tests that the snippet is taken from where the term occurs, not the start of the body."""
+    body = "filler " * 40 + "the important needle is here" + " trailing" * 40
+    snippet, highlights = make_snippet(body, ["needle"])
+    assert "needle" in snippet
+    assert snippet.startswith("...") and snippet.endswith("...")
+    assert [snippet[s:e] for s, e in highlights] == ["needle"]
+
+def test_make_snippet_prefers_window_with_most_terms():
+    """Tests that a window containing both terms beats an earlier window with only one."""
+    body = "alpha " + "x" * 200 + " alpha beta together " + "y" * 200
+    snippet, highlights = make_snippet(body, ["alpha", "beta"])
+    assert [snippet[s:e] for s, e in highlights] == ["alpha", "beta"]
+
+def test_make_snippet_no_match_falls_back_to_start():
+    """Tests that a body without the term (e.g. a title-only match) keeps the old snippet."""
+    body = "z" * 200
+    snippet, highlights = make_snippet(body, ["missing"])
+    assert snippet == "z" * 120 + "..."
+    assert highlights == ()
+
+def test_query_hits_carry_highlights(populated_db):
+    """Tests that query() returns highlight offsets pointing at the matched text."""
+    results = query(populated_db, "testuser", "sleeping")
+    hit = results[0]
+    assert [hit.snippet[s:e].lower() for s, e in hit.highlights] == ["sleeping"]
+
+# Tests for fuzzy search
+
+def test_query_fuzzy_matches_typo(populated_db):
+    """Tests that a misspelt keyword only matches when fuzzy search is enabled."""
+    assert query(populated_db, "testuser", "sleepng") == []
+    results = query(populated_db, "testuser", "sleepng", fuzzy=True)
+    assert [r.id for r in results] == ["p2"]
+
+def test_query_fuzzy_ranks_exact_above_typo(populated_db):
+    """Tests that fuzzy search does not widen keywords the author actually uses."""
+    results = query(populated_db, "testuser", "clever", fuzzy=True)
+    assert [r.id for r in results] == ["p4", "p1"]
+
+
+def test_run_query_reports_no_limits_for_normal_queries(populated_db):
+    result = run_query(populated_db, "testuser", "clever fox")
+    assert result.truncated == ()
+    assert {h.id for h in result.hits} == {"p1", "p4"}
+
+
+def test_run_query_limits_pasted_paragraphs(populated_db):
+    """Tests that a pasted paragraph is deduplicated and capped rather than scanned in full."""
+    paragraph = " ".join(["fox"] * 50 + [f"word{i}" for i in range(100)])
+    result = run_query(populated_db, "testuser", paragraph)
+    assert result.truncated == ("terms",)
+    assert result.hits == []  # word0.. are ANDed with fox and match nothing
+    assert run_query(populated_db, "testuser", "fox " * 400).truncated == ("length",)
+
+
+def test_run_query_time_budget_returns_partial_results(monkeypatch):
+    conn = storage.make_connection(":memory:")
+    conn.executemany(
+        "INSERT INTO particles (id, user_id, user_facing_id, title, body, tags, created_at, updated_at, author) "
+        "VALUES (?, 1, ?, ?, ?, '', ?, ?, 'u')",
+        [(f"p{i}", i, f"Note {i}", "needle " + "hay " * 200, f"2025-01-01T{i:06d}", "") for i in range(3000)])
+    conn.commit()
+    monkeypatch.setattr(search, "_FETCH_BATCH", 10)
+    assert run_query(conn, "u", "needle", budget=10).truncated == ()
+
+    result = run_query(conn, "u", "needle", budget=0.002)
+    assert result.truncated == ("time",)
+    # Whatever was scanned before the interrupt is ranked, newest first on ties.
+    assert all(h.title.startswith("Note") for h in result.hits)
+    # The handler is removed again, so later queries on the connection are unaffected.
+    assert conn.execute("SELECT COUNT(*) FROM particles").fetchone()[0] == 3000
+
+
+def test_query_wildcards_match_literally(populated_db):
+    """Tests that % and _ in a query are literal characters, not LIKE wildcards."""
+    assert query(populated_db, "testuser", "%") == []
+    assert query(populated_db, "testuser", "f_x") == []
+    assert query(populated_db, "testuser", "fox")
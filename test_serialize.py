@@ -0,0 +1,28 @@
+import json
+from pim_types import Particle, QueryHit
+from serialize import particle_json, hits_json, particle_dict
+
+
+def test_particle_json_sorts_tags():
+    """Tests that a particle encodes with every field and tags as a sorted list."""
+    p = Particle("id1", 1, 7, "Title", "Body", "testuser", frozenset({"b", "a"}), "2025-01-01", "2025-01-02")
+    data = json.loads(particle_json(p))
+    assert data == {
+        "id": "id1", "user_id": 1, "user_facing_id": 7, "title": "Title", "body": "Body",
+        "author": "testuser", "tags": ["a", "b"], "created_at": "2025-01-01", "updated_at": "2025-01-02",
+    }
+    assert particle_dict(p) == data
+
+def test_hits_json_matches_search_response_shape():
+    """Tests that hits encode as objects with highlights as arrays of pairs."""
+    hits = [QueryHit("id1", 3, "2025-01-01", "Title", 5.0, "a snippet", ((2, 9),))]
+    assert json.loads(hits_json(hits)) == [{
+        "id": "id1", "user_facing_id": 3, "created_at": "2025-01-01", "title": "Title",
+        "score": 5.0, "snippet": "a snippet", "highlights": [[2, 9]],
+    }]
+    assert hits_json([]) == b"[]"
+
+def test_non_ascii_round_trips():
+    """Tests that non-ASCII text is encoded as UTF-8 and decodes unchanged."""
+    p = Particle("id1", 1, 1, "Café ✓", "naïve", "u", frozenset(), "", "")
+    assert json.loads(particle_json(p).decode("utf-8"))["title"] == "Café ✓"
@@ -0,0 +1,111 @@
+from fastapi.testclient import TestClient
+import api
+import sharding
+import storage
+from pim_types import Particle
+from sharding import ShardRouter, rendezvous_shard, rebalance
+
+
+def particle(pid: str, author: str, ufid: int) -> Particle:
+    return Particle(pid, 1, ufid, f"Title {pid}", "body", author, frozenset({"t"}), "2025-01-01", "2025-01-01")
+
+
+def test_rendezvous_is_stable_and_moves_few_authors_on_growth():
+    """Tests that adding a shard only moves authors onto the new shard."""
+    authors = [f"user{i}" for i in range(1000)]
+    before = {a: rendezvous_shard(a, ["s0", "s1", "s2"]) for a in authors}
+    after = {a: rendezvous_shard(a, ["s0", "s1", "s2", "s3"]) for a in authors}
+    moved = [a for a in authors if before[a] != after[a]]
+    assert all(after[a] == "s3" for a in moved)
+    assert 150 < len(moved) < 350  # about a quarter
+    assert before == {a: rendezvous_shard(a, ["s0", "s1", "s2"]) for a in authors}
+
+
+def test_router_persists_assignment(tmp_path):
+    router = ShardRouter(str(tmp_path / "dir.db"), [str(tmp_path / "s0.db"), str(tmp_path / "s1.db")])
+    directory = router.directory()
+    shard = router.shard_for(directory, "alice")
+    # A different shard list does not silently move an assigned author.
+    grown = ShardRouter(router.directory_path, router.shard_paths + [str(tmp_path / "s2.db")])
+    assert grown.shard_for(directory, "alice") == shard
+    directory.close()
+
+
+def test_rebalance_moves_particles_and_keeps_cursors_monotonic(tmp_path):
+    shards = [str(tmp_path / f"s{i}.db") for i in range(2)]
+    router = ShardRouter(str(tmp_path / "dir.db"), shards)
+    directory = router.directory()
+    authors = [f"user{i}" for i in range(12)]
+    cursors = {}
+    for author in authors:
+        conn = router.connect(directory, author)
+        storage.save_particle(conn, particle(f"{author}-a", author, 1))
+        storage.save_particle(conn, particle(f"{author}-b", author, 2))
+        storage.delete_particle(conn, f"{author}-b")
+        cursors[author] = storage.get_changes(conn, author, 0, 10)[0][-1].seq
+        conn.close()
+    directory.close()
+
+    grown = ShardRouter(router.directory_path, shards + [str(tmp_path / "s2.db")])
+    moves = rebalance(grown)
+    assert moves and all(target == grown.shard_paths[2] for _, _, target in moves)
+
+    directory = grown.directory()
+    for author, source, _ in moves:
+        conn = grown.connect(directory, author)
+        assert [p.id for p in storage.get_all_particles_by_author(conn, author)] == [f"{author}-a"]
+        changes, _ = storage.get_changes(conn, author, cursors[author], 10)
+        assert {(c.particle_id, c.deleted) for c in changes} == {(f"{author}-a", False), (f"{author}-b", True)}
+        conn.close()
+        old = storage.make_connection(source)
+        assert storage.get_all_particles_by_author(old, author) == []
+        old.close()
+    directory.close()
+
+
+def test_api_routes_particles_to_shards(tmp_path, monkeypatch):
+    """Tests that the API keeps users in the directory and particles in shard files."""
+    shards = [str(tmp_path / "s0.db"), str(tmp_path / "s1.db")]
+    monkeypatch.setattr(api, "DB_PATH", str(tmp_path / "dir.db"))
+    monkeypatch.setattr(api, "SHARD_PATHS", shards)
+    with TestClient(api.app) as client:
+        client.post("/register", json={"username": "alice", "password": "pw"})
+        session = client.post("/login", json={"username": "alice", "password": "pw"}).json()["session"]
+        created = client.post(f"/particles?session={session}", json={"title": "T", "body": "B", "tags": []}).json()
+        assert client.get(f"/particles/{created['id']}?session={session}").json() == created
+        assert [h["id"] for h in client.get(f"/search?q=B&session={session}").json()] == [created["id"]]
+
+    directory = storage.make_connection(api.DB_PATH)
+    assert directory.execute("SELECT COUNT(*) FROM particles").fetchone()[0] == 0
+    home = ShardRouter(api.DB_PATH, shards).shard_for(directory, "alice")
+    directory.close()
+    shard = storage.make_connection(home)
+    assert storage.get_particle(shard, created["id"]) is not None
+    shard.close()
+
+
+def test_api_reuses_one_router(tmp_path, monkeypatch):
+    """Tests that requests share a router, create the assignments table once and whoami opens no shard."""
+    monkeypatch.setattr(api, "DB_PATH", str(tmp_path / "dir.db"))
+    monkeypatch.setattr(api, "SHARD_PATHS", [str(tmp_path / "s0.db"), str(tmp_path / "s1.db")])
+    calls = {"create": 0, "connect": 0}
+    create, connect = sharding._create_assignments, ShardRouter.connect
+
+    def counting_create(conn):
+        calls["create"] += 1
+        create(conn)
+
+    def counting_connect(self, *args, **kwargs):
+        calls["connect"] += 1
+        return connect(self, *args, **kwargs)
+
+    monkeypatch.setattr(sharding, "_create_assignments", counting_create)
+    monkeypatch.setattr(ShardRouter, "connect", counting_connect)
+    with TestClient(api.app) as client:
+        client.post("/register", json={"username": "alice", "password": "pw"})
+        session = client.post("/login", json={"username": "alice", "password": "pw"}).json()["session"]
+        assert client.get(f"/whoami?session={session}").json() == {"username": "alice"}
+        assert calls["connect"] == 0
+        for _ in range(3):
+            assert client.get(f"/search?q=x&session={session}").status_code == 200
+    assert calls == {"create": 1, "connect": 3}
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import Group
+
+
+def wait_for_waiters(group, key, n, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while group.waiters(key) < n:
+        assert time.monotonic() < deadline, "callers did not join the flight"
+        time.sleep(0.001)
+
+
+def run_concurrently(n, target):
+    results = [None] * n
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_duplicates_share_one_call():
+    group = Group("test")
+    calls = []
+
+    def work():
+        calls.append(1)
+        wait_for_waiters(group, "k", 7)
+        return {"answer": 42}
+
+    results = run_concurrently(8, lambda: group.do("k", work))
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_errors_are_shared_and_not_remembered():
+    group = Group("test")
+    calls = []
+
+    def fail():
+        calls.append(1)
+        wait_for_waiters(group, "k", 3)
+        raise ValueError("boom")
+
+    results = run_concurrently(4, lambda: group.do("k", fail))
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    assert group.do("k", lambda: "fresh") == "fresh"  # finished calls are not cached
+
+
+def test_different_keys_run_separately():
+    group = Group("test")
+    assert group.do("a", lambda: 1) == 1
+    assert group.do("b", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        group.do("a", lambda: {}["missing"])
@@ -1,5 +1,8 @@
+import os
 import sqlite3
 import pytest
+import profiling
+import search
 import storage
 from pim_types import Particle
 
@@ -100,8 +103,8 @@ def test_get_all_particles_by_author(db_connection, sample_particle):
     Tests that all particles for a specific author are returned, and not from others.
     """
     # Arrange: Create several particles, some for the target author, some for another
-    p1 = sample_particle._replace(id="p1", user_facing_id=201, created_at="2025-01-02T00:00:00")
-    p2 = sample_particle._replace(id="p2", user_facing_id=202, created_at="2025-01-01T00:00:00") # Older
+    p1 = sample_particle._replace(id="p1", user_facing_id=201, title="T1", created_at="2025-01-02T00:00:00")
+    p2 = sample_particle._replace(id="p2", user_facing_id=202, title="T2", created_at="2025-01-01T00:00:00") # Older
 
     # A particle from a different user
     db_connection.execute(
@@ -125,3 +128,217 @@ def test_get_all_particles_by_author(db_connection, sample_particle):
     assert all_user_particles[1].id == "p2"
     # 3. The other user's particle should not be in the list.
     assert "p3" not in [p.id for p in all_user_particles]
+
+def test_loaded_tags_are_shared_frozensets(db_connection, sample_particle):
+    """
+    Tests that tags come back as frozensets and that particles with the same
+    tags share one decoded object.
+    """
+    storage.save_particle(db_connection, sample_particle._replace(id="p1", user_facing_id=1, title="T1"))
+    storage.save_particle(db_connection, sample_particle._replace(id="p2", user_facing_id=2, title="T2"))
+
+    p1, p2 = storage.get_all_particles_by_author(db_connection, "testuser")
+    assert isinstance(p1, Particle)
+    assert p1.tags == frozenset({"tag1", "tag2"})
+    assert p1.tags is p2.tags
+
+def test_decode_tags_empty():
+    """Tests that missing or empty tag columns decode to an empty frozenset."""
+    assert storage.decode_tags(None) == frozenset()
+    assert storage.decode_tags("") == frozenset()
+
+def test_get_particles_batch(db_connection, sample_particle):
+    """Tests that a batch fetch returns found particles keyed by id and skips missing ones."""
+    storage.save_particle(db_connection, sample_particle._replace(id="p1", user_facing_id=1, title="T1"))
+    storage.save_particle(db_connection, sample_particle._replace(id="p2", user_facing_id=2, title="T2"))
+
+    found = storage.get_particles(db_connection, ["p1", "p2", "missing"])
+    assert set(found) == {"p1", "p2"}
+    assert found["p2"].user_facing_id == 2
+    assert storage.get_particles(db_connection, []) == {}
+
+def test_get_changes_pages_and_tombstones(db_connection, sample_particle):
+    """
+    Tests that the change log returns each particle once at its latest change,
+    pages by cursor, and reports deletions as tombstones.
+    """
+    for i in range(3):
+        storage.save_particle(db_connection, sample_particle._replace(id=f"p{i}", user_facing_id=i, title=f"T{i}"))
+    changes, has_more = storage.get_changes(db_connection, "testuser", 0, 2)
+    assert [c.particle_id for c in changes] == ["p0", "p1"] and has_more
+    cursor = changes[-1].seq
+
+    # Update p0 and delete p1 after the cursor was taken.
+    storage.save_particle(db_connection, sample_particle._replace(id="p0", user_facing_id=0, title="New"))
+    storage.delete_particle(db_connection, "p1")
+
+    changes, has_more = storage.get_changes(db_connection, "testuser", cursor, 10)
+    assert not has_more
+    assert [(c.particle_id, c.deleted) for c in changes] == [("p2", False), ("p0", False), ("p1", True)]
+    assert changes[1].particle.title == "New"
+    assert changes[2].particle is None
+    assert storage.get_changes(db_connection, "testuser", changes[-1].seq, 10) == ([], False)
+
+def test_make_connection_migrates_old_database(tmp_path):
+    """
+    Tests that a database created before particle_tags, the change log and
+    listing snippets existed gets all three backfilled when it is opened.
+    """
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute("""
+        CREATE TABLE particles (
+            id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, user_facing_id INTEGER NOT NULL,
+            title TEXT NOT NULL, body TEXT NOT NULL, tags TEXT, created_at TEXT, updated_at TEXT,
+            author TEXT, UNIQUE(author, user_facing_id)
+        )
+    """)
+    old.execute("INSERT INTO particles VALUES ('p1', 1, 1, 'T', 'B', 'a,b', '2025-01-01', '2025-01-01', 'testuser')")
+    old.commit()
+    old.close()
+
+    conn = storage.make_connection(path)
+    tags = conn.execute("SELECT tag FROM particle_tags WHERE particle_id = 'p1' ORDER BY tag").fetchall()
+    assert [row[0] for row in tags] == ["a", "b"]
+    changes, _ = storage.get_changes(conn, "testuser", 0, 10)
+    assert [c.particle_id for c in changes] == ["p1"]
+    assert [p.snippet for p in storage.list_particles(conn, "testuser", 10)] == ["B"]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == storage.SCHEMA_VERSION
+    conn.close()
+
+
+def test_list_particles_reads_only_the_covering_index(db_connection, sample_particle):
+    """Tests that listings come with snippets kept at write time and never touch the particles table."""
+    long_body = "x" * 5000
+    storage.save_particle(db_connection, sample_particle._replace(body=long_body))
+    storage.save_particle(db_connection, sample_particle._replace(id="p2", user_facing_id=102, title="Short", body="short"))
+
+    listing = storage.list_particles(db_connection, "testuser", 10)
+    assert [p.id for p in listing] == ["p2", "test-uuid-123"]
+    assert listing[0].snippet == "short"
+    assert listing[1].snippet == "x" * storage.SNIPPET_WIDTH + "..."
+
+    storage.save_particle(db_connection, sample_particle._replace(body="edited"))
+    assert storage.list_particles(db_connection, "testuser", 10)[1].snippet == "edited"
+
+    plan = db_connection.execute(
+        "EXPLAIN QUERY PLAN SELECT id, user_facing_id, created_at, title, snippet FROM particles "
+        "WHERE author = ? ORDER BY user_facing_id DESC LIMIT 10", ("testuser",)).fetchall()
+    assert any("COVERING INDEX idx_particles_listing" in row[-1] for row in plan)
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+def test_large_bodies_are_compressed_and_searched_as_plain_text(db_connection, sample_particle):
+    """Tests that a large HTML body is stored compressed, read back intact, and searched by its text."""
+    body = "<p>" + "the <strong>zebra</strong> grazes quietly. " * 100 + "</p>"
+    storage.save_particle(db_connection, sample_particle._replace(body=body))
+
+    stored, text = db_connection.execute("SELECT body, body_text FROM particles").fetchone()
+    assert isinstance(stored, bytes) and len(stored) < len(body) / 5
+    assert "<strong>" not in text and "the zebra grazes" in text
+    assert storage.get_particle(db_connection, sample_particle.id).body == body
+
+    [hit] = search.query(db_connection, "testuser", "zebra")
+    assert hit.snippet.startswith("the zebra grazes")
+    assert search.query(db_connection, "testuser", "strong") == []  # markup is not searchable
+
+
+def reopen(path):
+    """Opens the database as a newly started process would, so its schema is checked again."""
+    storage._initialized.discard(os.path.abspath(path))
+    return storage.make_connection(path)
+
+
+def test_schema_is_set_up_once_per_file(tmp_path):
+    """Tests that only the first connection to a file runs the schema script."""
+    path = str(tmp_path / "p.db")
+    storage.make_connection(path).close()
+    with profiling.profiled() as profile:
+        conn = storage.make_connection(path, factory=profiling.ProfiledConnection)
+        conn.close()
+    assert profile.statements == 0
+
+    os.remove(path)
+    conn = storage.make_connection(path)  # recreated: set up again
+    assert conn.execute("SELECT COUNT(*) FROM particles").fetchone()[0] == 0
+    conn.close()
+
+
+def test_migration_compresses_existing_bodies(tmp_path):
+    path = str(tmp_path / "v3.db")
+    conn = storage.make_connection(path)
+    body = "<p>" + "old note text " * 200 + "</p>"
+    conn.execute("INSERT INTO particles (id, user_id, user_facing_id, title, body, author) "
+                 "VALUES ('p1', 1, 1, 'T', ?, 'testuser')", (body,))
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    conn.close()
+
+    conn = reopen(path)
+    stored, text = conn.execute("SELECT body, body_text FROM particles").fetchone()
+    assert isinstance(stored, bytes) and text.startswith("old note text")
+    assert storage.get_particle(conn, "p1").body == body
+    conn.close()
+
+
+def test_migration_makes_normalized_titles_unique(tmp_path):
+    """Tests that titles which only differed in spacing get suffixed before the unique index is built."""
+    path = str(tmp_path / "v4.db")
+    conn = storage.make_connection(path)
+    conn.execute("DROP INDEX idx_particles_author_normalized_title")
+    for pid, ufid, title in (("p1", 1, "To do"), ("p2", 2, "to  DO"), ("p3", 3, "Other"), ("p4", 4, "To do (2)")):
+        conn.execute("INSERT INTO particles (id, user_id, user_facing_id, title, body, author, created_at) "
+                     "VALUES (?, 1, ?, ?, 'b', 'testuser', ?)", (pid, ufid, title, f"2025-01-0{ufid}"))
+    conn.execute("UPDATE particles SET normalized_title = NULL")
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+
+    conn = reopen(path)
+    titles = dict(conn.execute("SELECT id, title FROM particles").fetchall())
+    # "To do (2)" was already unique, so it keeps its title and the duplicate skips that suffix.
+    assert titles == {"p1": "To do", "p2": "to  DO (3)", "p3": "Other", "p4": "To do (2)"}
+    assert storage.get_particle_by_title(conn, "testuser", "TO DO").id == "p1"
+    assert storage.get_particle_by_title(conn, "testuser", "to do (3)").id == "p2"
+    changes, _ = storage.get_changes(conn, "testuser", 0, 10)
+    assert changes[-1].particle_id == "p2"  # the renamed particle is synced again
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM particles WHERE author = ? AND normalized_title = ?",
+                        ("testuser", "to do")).fetchall()
+    assert any("idx_particles_author_normalized_title" in row[-1] for row in plan)
+    conn.close()
+
+
+def test_backfills_leave_the_change_log_alone(tmp_path, sample_particle):
+    """Tests that migrations and derived-column updates do not make sync clients refetch anything."""
+    path = str(tmp_path / "v2.db")
+    conn = storage.make_connection(path)
+    body = "<p>" + "long body " * 200 + "</p>"
+    storage.save_particle(conn, sample_particle._replace(body=body))
+    # Stored as before snippets, compression and normalized titles existed.
+    conn.execute("UPDATE particles SET snippet = NULL, body = ?, body_text = NULL, normalized_title = NULL", (body,))
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    before = storage.get_changes(conn, "testuser", 0, 10)
+    conn.close()
+
+    conn = reopen(path)
+    assert storage.get_changes(conn, "testuser", 0, 10) == before
+    conn.execute("UPDATE particles SET snippet = 'x'")
+    assert storage.get_changes(conn, "testuser", 0, 10) == before
+    conn.close()
+
+
+def test_migration_drops_author_generations(tmp_path):
+    path = str(tmp_path / "v5.db")
+    conn = storage.make_connection(path)
+    conn.execute("CREATE TABLE author_generation (author TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+    conn.execute("CREATE TRIGGER particles_generation_insert AFTER INSERT ON particles BEGIN "
+                 "INSERT INTO author_generation VALUES (NEW.author, 1); END")
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+    conn.close()
+
+    conn = reopen(path)
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    assert "author_generation" not in names and "particles_generation_insert" not in names
+    conn.close()